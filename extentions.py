@@ -498,6 +498,21 @@ def register():
         default=False,
         update=Settings.update_settings
     )
+    Scene.use_pmx_cache = BoolProperty(
+        name=t('Scene.use_pmx_cache.label'),
+        description=t('Scene.use_pmx_cache.desc'),
+        default=True,
+        update=Settings.update_settings
+    )
+    Scene.pmx_cache_size = IntProperty(
+        name=t('Scene.pmx_cache_size.label'),
+        description=t('Scene.pmx_cache_size.desc'),
+        default=1024,
+        min=16,
+        max=65536,
+        subtype='UNSIGNED',
+        update=Settings.update_settings
+    )
     Scene.use_custom_mmd_tools = BoolProperty(
         name=t('Scene.use_custom_mmd_tools.label'),
         description=t('Scene.use_custom_mmd_tools.desc'),
@@ -4,6 +4,8 @@
 
 import logging
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, cast
 
 import bpy
@@ -32,8 +34,75 @@ class _DummyTextureSlot:
         self.texture = _DummyTexture(image)
 
 
+TextureFileInfo = namedtuple("TextureFileInfo", ["filepath", "size", "file_format"])
+
+
+class TexturePrefetcher:
+    """Read texture files on worker threads ahead of loading them as images.
+
+    Every file is checked (existence, size and format by its signature) and read once, so the
+    bpy.data.images.load() calls made later on the main thread find it in the OS page cache.
+    """
+
+    SIGNATURES = (
+        (b"\x89PNG\r\n\x1a\n", "PNG"),
+        (b"\xff\xd8\xff", "JPEG"),
+        (b"BM", "BMP"),
+        (b"DDS ", "DDS"),
+        (b"GIF8", "GIF"),
+        (b"II*\x00", "TIFF"),
+        (b"MM\x00*", "TIFF"),
+    )
+    EXTENSIONS = {".tga": "TARGA"}  # no signature
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, filepaths, workers=4):
+        self.__futures = {}
+        if workers < 1 or not filepaths:
+            return
+        executor = ThreadPoolExecutor(max_workers=workers)
+        for filepath in dict.fromkeys(filepaths):
+            self.__futures[filepath] = executor.submit(self.__read, filepath)
+        executor.shutdown(wait=False)  # the submitted files are still read
+
+    @classmethod
+    def __read(cls, filepath):
+        try:
+            with open(filepath, "rb") as f:
+                head = f.read(cls.CHUNK_SIZE)
+                size = len(head)
+                while True:
+                    chunk = f.read(cls.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+        except OSError:
+            return None
+        file_format = next((name for signature, name in cls.SIGNATURES if head.startswith(signature)), None)
+        if file_format is None:
+            file_format = cls.EXTENSIONS.get(os.path.splitext(filepath)[1].lower())
+        return TextureFileInfo(filepath, size, file_format)
+
+    def wait(self):
+        """Wait for all files and return the TextureFileInfo of the readable ones."""
+        infos = []
+        for filepath, future in self.__futures.items():
+            info = future.result()
+            if info is None:
+                logging.debug(" * Texture file not found: %s", filepath)
+            elif info.size == 0 or info.file_format is None:
+                logging.warning(" * Unrecognized texture file: %s", filepath)
+            else:
+                infos.append(info)
+        if infos:
+            logging.info("Prefetched %d texture files (%.1f MB)", len(infos), sum(i.size for i in infos) / (1 << 20))
+        return infos
+
+
 class FnMaterial:
     __NODES_ARE_READONLY = False
+    __g_image_index = None  # {(resolved filepath, mtime): image}, rebuilt from bpy.data.images when needed
+    __g_image_count = 0
 
     def __init__(self, material=None):
         self.__material = material
@@ -130,21 +199,46 @@ class FnMaterial:
     def material(self):
         return self.__material
 
-    def __same_image_file(self, image, filepath):
-        if image and image.source == "FILE":
-            # pylint: disable=assignment-from-no-return
-            img_filepath = bpy.path.abspath(image.filepath)  # image.filepath_from_user()
-            if img_filepath == filepath:
-                return True
-            # pylint: disable=bare-except
+    @staticmethod
+    def __image_key(filepath):
+        filepath = os.path.normcase(os.path.realpath(filepath))
+        try:
+            return filepath, os.stat(filepath).st_mtime_ns
+        except OSError:
+            return filepath, None
+
+    @classmethod
+    def __build_image_index(cls):
+        index = {}
+        for image in bpy.data.images:
+            if image.source == "FILE":
+                index.setdefault(cls.__image_key(bpy.path.abspath(image.filepath)), image)
+        cls.__g_image_index = index
+        cls.__g_image_count = len(bpy.data.images)
+
+    @classmethod
+    def clear_image_index(cls):
+        cls.__g_image_index = None
+
+    @classmethod
+    def __find_image(cls, key):
+        # images added or removed outside of this class are picked up by rebuilding the index
+        if cls.__g_image_index is None or cls.__g_image_count != len(bpy.data.images):
+            cls.__build_image_index()
+        image = cls.__g_image_index.get(key)
+        if image is not None:
             try:
-                return os.path.samefile(img_filepath, filepath)
-            except:
+                if image.source == "FILE" and cls.__image_key(bpy.path.abspath(image.filepath)) == key:
+                    return image
+            except ReferenceError:
                 pass
-        return False
+            cls.__build_image_index()
+            image = cls.__g_image_index.get(key)
+        return image
 
     def _load_image(self, filepath):
-        img = next((i for i in bpy.data.images if self.__same_image_file(i, filepath)), None)
+        key = self.__image_key(filepath)
+        img = self.__find_image(key)
         if img is None:
             # pylint: disable=bare-except
             try:
@@ -159,6 +253,8 @@ class FnMaterial:
                 img.use_alpha = use_alpha
             elif not use_alpha:
                 img.alpha_mode = "NONE"
+            FnMaterial.__g_image_index[key] = img
+            FnMaterial.__g_image_count = len(bpy.data.images)
         return img
 
     def update_toon_texture(self):
@@ -2,16 +2,30 @@
 # Copyright 2014 MMD Tools authors
 # This file is part of MMD Tools.
 
+import collections.abc
+import contextlib
 import logging
+import mmap
 import os
 import struct
 
+import numpy as np
+
 
 class InvalidFileError(Exception):
     pass
 class UnsupportedVersionError(Exception):
     pass
 
+def _indexDtype(size, signed):
+    if signed:
+        typedict = { 1 :'i1', 2 :'<i2', 4 :'<i4'}
+    else:
+        typedict = { 1 :'u1', 2 :'<u2', 4 :'<u4'}
+    if size not in typedict:
+        raise ValueError('invalid data size %s'%str(size))
+    return np.dtype(typedict[size])
+
 class FileStream:
     def __init__(self, path, file_obj, pmx_header):
         self.__path = path
@@ -46,10 +60,16 @@ class FileReadStream(FileStream):
         self.__fin = open(path, 'rb')
         FileStream.__init__(self, path, self.__fin, pmx_header)
 
+    def _read(self, length):
+        return self.__fin.read(length)
+
+    def _unpack(self, fmt, length):
+        return struct.unpack(fmt, self._read(length))
+
     def __readIndex(self, size, typedict):
         index = None
         if size in typedict :
-            index, = struct.unpack(typedict[size], self.__fin.read(size))
+            index, = self._unpack(typedict[size], size)
         else:
             raise ValueError('invalid data size %s'%str(size))
         return index
@@ -82,40 +102,110 @@ class FileReadStream(FileStream):
 
     # READ / WRITE methods for general types
     def readInt(self):
-        v, = struct.unpack('<i', self.__fin.read(4))
+        v, = self._unpack('<i', 4)
         return v
 
     def readShort(self):
-        v, = struct.unpack('<h', self.__fin.read(2))
+        v, = self._unpack('<h', 2)
         return v
 
     def readUnsignedShort(self):
-        v, = struct.unpack('<H', self.__fin.read(2))
+        v, = self._unpack('<H', 2)
         return v
 
     def readStr(self):
         length = self.readInt()
-        buf, = struct.unpack('<%ds'%length, self.__fin.read(length))
+        buf, = self._unpack('<%ds'%length, length)
         return str(buf, self.header().encoding.charset, errors='replace')
 
     def readFloat(self):
-        v, = struct.unpack('<f', self.__fin.read(4))
+        v, = self._unpack('<f', 4)
         return v
 
     def readVector(self, size):
-        return struct.unpack('<'+'f'*size, self.__fin.read(4*size))
+        return self._unpack('<'+'f'*size, 4*size)
 
     def readByte(self):
-        v, = struct.unpack('<B', self.__fin.read(1))
+        v, = self._unpack('<B', 1)
         return v
 
     def readBytes(self, length):
-        return self.__fin.read(length)
+        return bytes(self._read(length))
 
     def readSignedByte(self):
-        v, = struct.unpack('<b', self.__fin.read(1))
+        v, = self._unpack('<b', 1)
+        return v
+
+    def readArray(self, dtype, count):
+        """ Read count items of dtype as a NumPy array.
+        """
+        dtype = np.dtype(dtype)
+        data = self._read(dtype.itemsize * count)
+        if len(data) < dtype.itemsize * count:
+            raise struct.error('read requires a buffer of %d bytes'%(dtype.itemsize * count))
+        return np.frombuffer(data, dtype=dtype, count=count)
+
+    def peekBytes(self, length):
+        """ Read up to length bytes without moving the stream position.
+        """
+        pos = self.__fin.tell()
+        data = self.__fin.read(length)
+        self.__fin.seek(pos)
+        return data
+
+    def skip(self, length):
+        self.__fin.seek(length, 1)
+
+    def tell(self):
+        return self.__fin.tell()
+
+    def seek(self, pos):
+        self.__fin.seek(pos)
+
+class MappedReadStream(FileReadStream):
+    """ FileReadStream over a memory-mapped file.
+
+    Values are decoded with struct.unpack_from at the current offset, and readArray/peekBytes
+    return views of the mapping instead of copies. The mapping stays alive as long as any of
+    those views is referenced, even after the stream is closed.
+    """
+    def __init__(self, path, pmx_header=None):
+        fin = open(path, 'rb')
+        try:
+            self.__map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            fin.close()
+            raise InvalidFileError('File is empty.')
+        self.__view = memoryview(self.__map)
+        self.__pos = 0
+        FileStream.__init__(self, path, fin, pmx_header)
+
+    def close(self):
+        FileReadStream.close(self)
+        self.__view = self.__map = None
+
+    def _read(self, length):
+        pos = self.__pos
+        self.__pos = min(pos + length, len(self.__view))
+        return self.__view[pos:self.__pos]
+
+    def _unpack(self, fmt, length):
+        v = struct.unpack_from(fmt, self.__view, self.__pos)
+        self.__pos += length
         return v
 
+    def peekBytes(self, length):
+        return self.__view[self.__pos:self.__pos + length]
+
+    def skip(self, length):
+        self.__pos += length
+
+    def tell(self):
+        return self.__pos
+
+    def seek(self, pos):
+        self.__pos = pos
+
 class FileWriteStream(FileStream):
     def __init__(self, path, pmx_header=None):
         self.__fout = open(path, 'wb')
@@ -183,6 +273,11 @@ class FileWriteStream(FileStream):
     def writeSignedByte(self, v):
         self.__fout.write(struct.pack('<b', int(v)))
 
+    def writeArray(self, data):
+        """ Write the raw bytes of a NumPy array with a single write() call.
+        """
+        self.__fout.write(np.ascontiguousarray(data).tobytes())
+
 class Encoding:
     _MAP = [
         (0, 'utf-16-le'),
@@ -236,8 +331,10 @@ class Header:
         if model is not None:
             self.updateIndexSizes(model)
 
-    def updateIndexSizes(self, model):
-        self.vertex_index_size = self.__getIndexSize(len(model.vertices), False)
+    def updateIndexSizes(self, model, vertex_count=None):
+        if vertex_count is None:
+            vertex_count = len(model.vertices)
+        self.vertex_index_size = self.__getIndexSize(vertex_count, False)
         self.texture_index_size = self.__getIndexSize(len(model.textures), True)
         self.material_index_size = self.__getIndexSize(len(model.materials), True)
         self.bone_index_size = self.__getIndexSize(len(model.bones), True)
@@ -351,6 +448,28 @@ class Model:
         self.rigids = []
         self.joints = []
 
+    @property
+    def vertex_data(self):
+        """ VertexData of the vertex section, or None if self.vertices is not backed by arrays.
+        """
+        return getattr(self.vertices, 'data', None)
+
+    @property
+    def face_data(self):
+        """ (n, 3) array of the face section, or None if self.faces is not backed by an array.
+        """
+        return getattr(self.faces, 'data', None)
+
+    def setVertexData(self, vertex_data):
+        """ Replace the vertices with the rows of a VertexData.
+        """
+        self.vertices = ArrayBackedList(vertex_data, VertexData.toVertices)
+
+    def setFaceData(self, face_data):
+        """ Replace the faces with the rows of an (n, 3) array of vertex indices.
+        """
+        self.faces = ArrayBackedList(face_data, _toTuples)
+
     def load(self, fs):
         self.filepath = fs.path()
         self.header = fs.header()
@@ -366,31 +485,38 @@ class Model:
         logging.info('Comment:%s', self.comment)
         logging.info('Comment(english):%s', self.comment_e)
 
+        self.loadVertices(fs)
+        self.loadFaces(fs)
+        self.loadTextures(fs)
+        self.loadMaterials(fs, len(self.textures))
+        self.loadBones(fs)
+        self.loadMorphs(fs)
+        self.loadDisplay(fs)
+        self.loadRigids(fs)
+        self.loadJoints(fs)
+
+    def loadVertices(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info('Load Vertices')
         logging.info('------------------------------')
         num_vertices = fs.readInt()
-        self.vertices = []
-        for i in range(num_vertices):
-            v = Vertex()
-            v.load(fs)
-            self.vertices.append(v)
+        vertex_data = VertexData()
+        vertex_data.load(fs, num_vertices)
+        self.setVertexData(vertex_data)
         logging.info('----- Loaded %d vertices', len(self.vertices))
 
+    def loadFaces(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Faces')
         logging.info('------------------------------')
         num_faces = fs.readInt()
-        self.faces = []
-        for i in range(int(num_faces/3)):
-            f1 = fs.readVertexIndex()
-            f2 = fs.readVertexIndex()
-            f3 = fs.readVertexIndex()
-            self.faces.append((f3, f2, f1))
+        face_data = fs.readArray(_indexDtype(fs.header().vertex_index_size, False), int(num_faces/3)*3)
+        self.setFaceData(face_data.reshape(-1, 3)[:, ::-1])
         logging.info(' Load %d faces', len(self.faces))
 
+    def loadTextures(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Textures')
@@ -404,6 +530,7 @@ class Model:
             logging.info('Texture %d: %s', i, t.path)
         logging.info(' ----- Loaded %d textures', len(self.textures))
 
+    def loadMaterials(self, fs, num_textures):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Materials')
@@ -443,6 +570,7 @@ class Model:
 
         logging.info('----- Loaded %d  materials.', len(self.materials))
 
+    def loadBones(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Bones')
@@ -477,6 +605,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d bones.', len(self.bones))
 
+    def loadMorphs(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Morphs')
@@ -494,6 +623,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d morphs.', len(self.morphs))
 
+    def loadDisplay(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Display Items')
@@ -510,6 +640,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d display items.', len(self.display))
 
+    def loadRigids(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Rigid Bodies')
@@ -539,6 +670,7 @@ class Model:
 
         logging.info('----- Loaded %d rigid bodies.', len(self.rigids))
 
+    def loadJoints(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Joints')
@@ -565,11 +697,34 @@ class Model:
         logging.info('----- Loaded %d joints.', len(self.joints))
 
     def save(self, fs):
-        fs.writeStr(self.name)
-        fs.writeStr(self.name_e)
+        ModelWriter(fs).writeModel(self)
 
-        fs.writeStr(self.comment)
-        fs.writeStr(self.comment_e)
+    def __repr__(self):
+        return '<Model name %s, name_e %s, comment %s, comment_e %s, textures %s>'%(
+            self.name,
+            self.name_e,
+            self.comment,
+            self.comment_e,
+            str(self.textures),
+            )
+
+class ModelWriter:
+    """ Write the sections of a model one at a time.
+
+    The header (and so the index sizes) has to be written before the sections, but only the
+    section counts are needed for it, so a section can be built right before it is written and
+    released right after. The sections have to be written in the order of writeModel().
+    """
+    def __init__(self, fs):
+        self.__fs = fs
+
+    def writeInfo(self, model):
+        fs = self.__fs
+        fs.writeStr(model.name)
+        fs.writeStr(model.name_e)
+
+        fs.writeStr(model.comment)
+        fs.writeStr(model.comment_e)
 
         logging.info('''exportings pmx model data...
 name: %s
@@ -578,75 +733,76 @@ comment:
 %s
 comment(english):
 %s
-''', self.name, self.name_e, self.comment, self.comment_e)
+''', model.name, model.name_e, model.comment, model.comment_e)
 
-        logging.info('exporting vertices... %d', len(self.vertices))
-        fs.writeInt(len(self.vertices))
-        for i in self.vertices:
-            i.save(fs)
-        logging.info('finished exporting vertices.')
-
-        logging.info('exporting faces... %d', len(self.faces))
-        fs.writeInt(len(self.faces)*3)
-        for f3, f2, f1 in self.faces:
-            fs.writeVertexIndex(f1)
-            fs.writeVertexIndex(f2)
-            fs.writeVertexIndex(f3)
-        logging.info('finished exporting faces.')
-
-        logging.info('exporting textures... %d', len(self.textures))
-        fs.writeInt(len(self.textures))
-        for i in self.textures:
-            i.save(fs)
-        logging.info('finished exporting textures.')
-
-        logging.info('exporting materials... %d', len(self.materials))
-        fs.writeInt(len(self.materials))
-        for i in self.materials:
-            i.save(fs)
-        logging.info('finished exporting materials.')
+    def writeVertices(self, vertices):
+        """ Write the vertex section from a list of Vertex objects or an ArrayBackedList of VertexData.
+        """
+        vertex_data = getattr(vertices, 'data', None)
+        if vertex_data is None:
+            vertex_data = VertexData.fromVertices(vertices, self.__fs.header().additional_uvs)
+        self.writeVertexChunks(len(vertices), [vertex_data])
 
-        logging.info('exporting bones... %d', len(self.bones))
-        fs.writeInt(len(self.bones))
-        for i in self.bones:
-            i.save(fs)
-        logging.info('finished exporting bones.')
+    def writeVertexChunks(self, count, chunks):
+        """ Write the vertex section from VertexData chunks of count vertices in total.
 
-        logging.info('exporting morphs... %d', len(self.morphs))
-        fs.writeInt(len(self.morphs))
-        for i in self.morphs:
-            i.save(fs)
-        logging.info('finished exporting morphs.')
+        chunks can be an iterator building each chunk when it is written.
+        """
+        fs = self.__fs
+        logging.info('exporting vertices... %d', count)
+        fs.writeInt(count)
+        written = 0
+        for vertex_data in chunks:
+            vertex_data.save(fs)
+            written += len(vertex_data)
+        if written != count:
+            raise ValueError('%d vertices were written, but the header expects %d'%(written, count))
+        logging.info('finished exporting vertices.')
 
-        logging.info('exporting display items... %d', len(self.display))
-        fs.writeInt(len(self.display))
-        for i in self.display:
-            i.save(fs)
-        logging.info('finished exporting display items.')
+    def writeFaces(self, faces):
+        """ Write the face section from a list of faces or an ArrayBackedList of an (n, 3) array.
+        """
+        fs = self.__fs
+        logging.info('exporting faces... %d', len(faces))
+        fs.writeInt(len(faces)*3)
+        face_data = getattr(faces, 'data', None)
+        if face_data is None:
+            face_data = np.array(faces, dtype=np.int64).reshape(-1, 3)
+        fs.writeArray(face_data[:, ::-1].astype(_indexDtype(fs.header().vertex_index_size, False)))
+        logging.info('finished exporting faces.')
 
-        logging.info('exporting rigid bodies... %d', len(self.rigids))
-        fs.writeInt(len(self.rigids))
-        for i in self.rigids:
-            i.save(fs)
-        logging.info('finished exporting rigid bodies.')
+    def writeItems(self, name, items, count=None):
+        """ Write a section of objects with a save(fs) method.
 
-        logging.info('exporting joints... %d', len(self.joints))
-        fs.writeInt(len(self.joints))
-        for i in self.joints:
+        items can be an iterator building each item when it is written, its length has to be
+        given by count then.
+        """
+        fs = self.__fs
+        if count is None:
+            count = len(items)
+        logging.info('exporting %s... %d', name, count)
+        fs.writeInt(count)
+        written = 0
+        for i in items:
             i.save(fs)
-        logging.info('finished exporting joints.')
+            written += 1
+        if written != count:
+            raise ValueError('%d %s were written, but the header expects %d'%(written, name, count))
+        logging.info('finished exporting %s.', name)
+
+    def writeModel(self, model):
+        self.writeInfo(model)
+        self.writeVertices(model.vertices)
+        self.writeFaces(model.faces)
+        self.writeItems('textures', model.textures)
+        self.writeItems('materials', model.materials)
+        self.writeItems('bones', model.bones)
+        self.writeItems('morphs', model.morphs)
+        self.writeItems('display items', model.display)
+        self.writeItems('rigid bodies', model.rigids)
+        self.writeItems('joints', model.joints)
         logging.info('finished exporting the model.')
 
-
-    def __repr__(self):
-        return '<Model name %s, name_e %s, comment %s, comment_e %s, textures %s>'%(
-            self.name,
-            self.name_e,
-            self.comment,
-            self.comment_e,
-            str(self.textures),
-            )
-
 class Vertex:
     def __init__(self):
         self.co = [0.0, 0.0, 0.0]
@@ -781,6 +937,354 @@ class BoneWeight:
             raise ValueError('invalid weight type %s'%str(self.type))
 
 
+def _toTuples(data):
+    return [tuple(x) for x in data.tolist()]
+
+class ArrayBackedList(collections.abc.MutableSequence):
+    """ A list view of a section stored in NumPy arrays.
+
+    The items are only built (by factory(data)) when they are first accessed, so callers
+    working on the arrays never pay for the per-item objects. Any structural change of the
+    list detaches the arrays (data becomes None). Changes made to the items themselves are
+    not written back to the arrays.
+    """
+    def __init__(self, data, factory):
+        self.data = data
+        self.__factory = factory
+        self.__items = None
+
+    def __list(self):
+        if self.__items is None:
+            self.__items = self.__factory(self.data)
+        return self.__items
+
+    def __len__(self):
+        if self.__items is None:
+            return len(self.data)
+        return len(self.__items)
+
+    def __getitem__(self, index):
+        return self.__list()[index]
+
+    def __setitem__(self, index, value):
+        self.__list()[index] = value
+        self.data = None
+
+    def __delitem__(self, index):
+        del self.__list()[index]
+        self.data = None
+
+    def __iter__(self):
+        return iter(self.__list())
+
+    def insert(self, index, value):
+        self.__list().insert(index, value)
+        self.data = None
+
+    def sort(self, key=None, reverse=False):
+        self.__list().sort(key=key, reverse=reverse)
+        self.data = None
+
+    def __repr__(self):
+        return '<ArrayBackedList %d items>'%len(self)
+
+class VertexData:
+    """ Columnar storage of the vertex section.
+
+    Bone indices and weights are padded to 4 columns (bone -1, weight 0). BDEF2 and SDEF
+    vertices store (w, 1-w) in the first two weight columns, and the SDEF C/R0/R1 vectors
+    are only meaningful for rows whose weight_type is BoneWeight.SDEF.
+    """
+    def __init__(self, count=0, additional_uvs=0):
+        self.co = np.zeros((count, 3), dtype=np.float32)
+        self.normal = np.zeros((count, 3), dtype=np.float32)
+        self.uv = np.zeros((count, 2), dtype=np.float32)
+        self.additional_uvs = np.zeros((count, additional_uvs, 4), dtype=np.float32)
+        self.weight_type = np.zeros(count, dtype=np.uint8)
+        self.bones = np.full((count, 4), -1, dtype=np.int32)
+        self.weights = np.zeros((count, 4), dtype=np.float32)
+        self.sdef_c = np.zeros((count, 3), dtype=np.float32)
+        self.sdef_r0 = np.zeros((count, 3), dtype=np.float32)
+        self.sdef_r1 = np.zeros((count, 3), dtype=np.float32)
+        self.edge_scale = np.ones(count, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.co)
+
+    def __repr__(self):
+        return '<VertexData %d vertices, additional_uvs %d>'%(len(self), self.additional_uvs.shape[1])
+
+    def take(self, rows):
+        """ Return a new VertexData of the given rows.
+        """
+        data = VertexData.__new__(VertexData)
+        for name, value in vars(self).items():
+            setattr(data, name, value[rows])
+        return data
+
+    @staticmethod
+    def recordDtypes(header):
+        """ Return the structured dtype of a vertex record for each weight type.
+        """
+        bone = _indexDtype(header.bone_index_size, True)
+        head = [('co', '<f4', 3), ('normal', '<f4', 3), ('uv', '<f4', 2)]
+        if header.additional_uvs:
+            head.append(('additional_uvs', '<f4', (header.additional_uvs, 4)))
+        head.append(('weight_type', 'u1'))
+        tail = [('edge_scale', '<f4')]
+        return {
+            BoneWeight.BDEF1: np.dtype(head + [('bones', bone, (1,))] + tail),
+            BoneWeight.BDEF2: np.dtype(head + [('bones', bone, 2), ('weight', '<f4')] + tail),
+            BoneWeight.BDEF4: np.dtype(head + [('bones', bone, 4), ('weights', '<f4', 4)] + tail),
+            BoneWeight.SDEF: np.dtype(head + [('bones', bone, 2), ('weight', '<f4'),
+                ('sdef_c', '<f4', 3), ('sdef_r0', '<f4', 3), ('sdef_r1', '<f4', 3)] + tail),
+            }
+
+    @classmethod
+    def scan(cls, buf, count, header):
+        """ Locate count vertex records at the start of buf.
+
+        @return (offsets, size): the record offsets, or None if all records share the weight
+        type of the first one, and the total size of the records in bytes.
+        """
+        dtypes = cls.recordDtypes(header)
+        sizes = [dtypes[t].itemsize for t in range(len(dtypes))]
+        type_offset = dtypes[BoneWeight.BDEF1].fields['weight_type'][1]
+        if count < 1:
+            return None, 0
+
+        # fast path: a single weight type has fixed-size records
+        first_type = buf[type_offset] if len(buf) > type_offset else None
+        if first_type is not None and first_type < len(sizes) and len(buf) >= count * sizes[first_type]:
+            types = np.frombuffer(buf, dtype=np.uint8, count=count * sizes[first_type])[type_offset::sizes[first_type]]
+            if np.all(types == first_type):
+                return None, count * sizes[first_type]
+
+        # the record offsets depend on the weight type of every previous vertex
+        offsets = [0] * count
+        pos = 0
+        try:
+            for i in range(count):
+                offsets[i] = pos
+                pos += sizes[buf[pos + type_offset]]
+        except IndexError:
+            if pos + type_offset >= len(buf):
+                raise struct.error('vertex data is truncated')
+            raise ValueError('invalid weight type %s'%str(buf[pos + type_offset]))
+        if pos > len(buf):
+            raise struct.error('vertex data is truncated')
+        return np.array(offsets, dtype=np.int64), pos
+
+    @classmethod
+    def maxRecordSize(cls, header):
+        return max(dtype.itemsize for dtype in cls.recordDtypes(header).values())
+
+    def load(self, fs, count):
+        header = fs.header()
+        dtypes = self.recordDtypes(header)
+        type_offset = dtypes[BoneWeight.BDEF1].fields['weight_type'][1]
+
+        # pass 1: the record offsets
+        buf = fs.peekBytes(count * self.maxRecordSize(header))
+        offsets, size = self.scan(buf, count, header)
+        fs.skip(size)
+        if count < 1:
+            self.__init__(0, header.additional_uvs)
+            return
+
+        if offsets is None:
+            # a single weight type, so the section maps directly to a structured array
+            first_type = buf[type_offset]
+            self.__setUniformRecords(np.frombuffer(buf, dtype=dtypes[first_type], count=count), first_type)
+            return
+
+        # pass 2: gather the records of each weight type
+        self.__init__(count, header.additional_uvs)
+        raw = np.frombuffer(buf, dtype=np.uint8, count=size)
+        weight_type = self.weight_type
+        weight_type[:] = raw[offsets + type_offset]
+        for t, dtype in dtypes.items():
+            rows = np.flatnonzero(weight_type == t)
+            if len(rows) == 0:
+                continue
+            windows = np.lib.stride_tricks.sliding_window_view(raw, dtype.itemsize)
+            records = windows[offsets[rows]].view(dtype)[:, 0]
+            self.__setRecords(rows, records, t)
+
+    def __setUniformRecords(self, records, weight_type):
+        # the fields of records are used as they are (views of the file data, when possible)
+        count = len(records)
+        self.co = records['co']
+        self.normal = records['normal']
+        self.uv = records['uv']
+        if 'additional_uvs' in records.dtype.names:
+            self.additional_uvs = records['additional_uvs']
+        else:
+            self.additional_uvs = np.zeros((count, 0, 4), dtype=np.float32)
+        self.weight_type = records['weight_type']
+        self.edge_scale = records['edge_scale']
+        self.bones = np.full((count, 4), -1, dtype=np.int32)
+        self.weights = np.zeros((count, 4), dtype=np.float32)
+        if weight_type == BoneWeight.SDEF:
+            self.sdef_c, self.sdef_r0, self.sdef_r1 = records['sdef_c'], records['sdef_r0'], records['sdef_r1']
+        else:
+            self.sdef_c = np.zeros((count, 3), dtype=np.float32)
+            self.sdef_r0 = np.zeros((count, 3), dtype=np.float32)
+            self.sdef_r1 = np.zeros((count, 3), dtype=np.float32)
+        self.__setWeights(slice(None), records, weight_type)
+
+    def __setRecords(self, rows, records, weight_type):
+        self.co[rows] = records['co']
+        self.normal[rows] = records['normal']
+        self.uv[rows] = records['uv']
+        if self.additional_uvs.shape[1]:
+            self.additional_uvs[rows] = records['additional_uvs']
+        self.edge_scale[rows] = records['edge_scale']
+        if weight_type == BoneWeight.SDEF:
+            self.sdef_c[rows] = records['sdef_c']
+            self.sdef_r0[rows] = records['sdef_r0']
+            self.sdef_r1[rows] = records['sdef_r1']
+        self.__setWeights(rows, records, weight_type)
+
+    def __setWeights(self, rows, records, weight_type):
+        bones = records['bones'].reshape(len(records), -1)
+        self.bones[rows, :bones.shape[1]] = bones
+        if weight_type == BoneWeight.BDEF1:
+            self.weights[rows, 0] = 1.0
+        elif weight_type == BoneWeight.BDEF4:
+            self.weights[rows] = records['weights']
+        else:
+            self.weights[rows, 0] = records['weight']
+            self.weights[rows, 1] = 1.0 - records['weight']
+
+    @staticmethod
+    def fromVertices(vertices, additional_uvs=0):
+        """ Build a VertexData from a list of Vertex objects.
+        """
+        count = len(vertices)
+        data = VertexData(count, additional_uvs)
+        if count < 1:
+            return data
+        data.co[:] = [v.co for v in vertices]
+        data.normal[:] = [v.normal for v in vertices]
+        data.uv[:] = [v.uv for v in vertices]
+        data.edge_scale[:] = [v.edge_scale for v in vertices]
+        if additional_uvs:
+            for i, v in enumerate(vertices):
+                uvs = v.additional_uvs[:additional_uvs]
+                if uvs:
+                    data.additional_uvs[i, :len(uvs)] = uvs
+
+        weight_type = data.weight_type
+        bones, weights = data.bones, data.weights
+        for i, v in enumerate(vertices):
+            w = v.weight
+            weight_type[i] = w.type
+            if w.type == BoneWeight.BDEF1:
+                bones[i, 0] = w.bones[0]
+                weights[i, 0] = 1.0
+            elif w.type == BoneWeight.BDEF2:
+                bones[i, :2] = w.bones[:2]
+                weights[i, :2] = (w.weights[0], 1.0 - w.weights[0])
+            elif w.type == BoneWeight.BDEF4:
+                bones[i] = w.bones[:4]
+                weights[i] = w.weights[:4]
+            elif w.type == BoneWeight.SDEF:
+                if not isinstance(w.weights, BoneWeightSDEF):
+                    raise ValueError
+                bones[i, :2] = w.bones[:2]
+                weights[i, :2] = (w.weights.weight, 1.0 - w.weights.weight)
+                data.sdef_c[i] = w.weights.c
+                data.sdef_r0[i] = w.weights.r0
+                data.sdef_r1[i] = w.weights.r1
+            else:
+                raise ValueError('invalid weight type %s'%str(w.type))
+        return data
+
+    def save(self, fs):
+        header = fs.header()
+        dtypes = self.recordDtypes(header)
+        count = len(self)
+        if count < 1:
+            return
+        weight_type = self.weight_type
+        if weight_type.max() >= len(dtypes):
+            raise ValueError('invalid weight type %s'%str(weight_type.max()))
+
+        first_type = int(weight_type[0])
+        if np.all(weight_type == first_type):
+            fs.writeArray(self.__records(slice(None), first_type, dtypes[first_type]))
+            return
+
+        sizes = np.array([dtypes[t].itemsize for t in range(len(dtypes))], dtype=np.int64)
+        record_sizes = sizes[weight_type]
+        offsets = np.cumsum(record_sizes) - record_sizes
+        buf = np.zeros(int(record_sizes.sum()), dtype=np.uint8)
+        for t, dtype in dtypes.items():
+            rows = np.flatnonzero(weight_type == t)
+            if len(rows) == 0:
+                continue
+            windows = np.lib.stride_tricks.sliding_window_view(buf, dtype.itemsize, writeable=True)
+            windows[offsets[rows]] = self.__records(rows, t, dtype).view(np.uint8).reshape(len(rows), dtype.itemsize)
+        fs.writeArray(buf)
+
+    def __records(self, rows, weight_type, dtype):
+        co = self.co[rows]
+        records = np.zeros(len(co), dtype=dtype)
+        records['co'] = co
+        records['normal'] = self.normal[rows]
+        records['uv'] = self.uv[rows]
+        if 'additional_uvs' in dtype.names:
+            num_uvs = min(dtype['additional_uvs'].shape[0], self.additional_uvs.shape[1])
+            records['additional_uvs'][:, :num_uvs] = self.additional_uvs[rows, :num_uvs]
+        records['weight_type'] = weight_type
+        records['bones'] = self.bones[rows, :dtype['bones'].shape[0]]
+        if weight_type == BoneWeight.BDEF4:
+            records['weights'] = self.weights[rows]
+        elif weight_type != BoneWeight.BDEF1:
+            records['weight'] = self.weights[rows, 0]
+            if weight_type == BoneWeight.SDEF:
+                records['sdef_c'] = self.sdef_c[rows]
+                records['sdef_r0'] = self.sdef_r0[rows]
+                records['sdef_r1'] = self.sdef_r1[rows]
+        records['edge_scale'] = self.edge_scale[rows]
+        return records
+
+    def toVertices(self):
+        """ Build the list of Vertex objects.
+        """
+        co, normal, uv = self.co.tolist(), self.normal.tolist(), self.uv.tolist()
+        additional_uvs = self.additional_uvs.tolist()
+        bones, weights = self.bones.tolist(), self.weights.tolist()
+        sdef_c, sdef_r0, sdef_r1 = self.sdef_c.tolist(), self.sdef_r0.tolist(), self.sdef_r1.tolist()
+        edge_scale = self.edge_scale.tolist()
+
+        vertices = []
+        for i, t in enumerate(self.weight_type.tolist()):
+            v = Vertex()
+            v.co = tuple(co[i])
+            v.normal = tuple(normal[i])
+            v.uv = tuple(uv[i])
+            v.additional_uvs = [tuple(x) for x in additional_uvs[i]]
+            w = v.weight = BoneWeight()
+            w.type = t
+            if t == BoneWeight.BDEF1:
+                w.bones = bones[i][:1]
+            elif t == BoneWeight.BDEF2:
+                w.bones = bones[i][:2]
+                w.weights = weights[i][:1]
+            elif t == BoneWeight.BDEF4:
+                w.bones = bones[i]
+                w.weights = tuple(weights[i])
+            elif t == BoneWeight.SDEF:
+                w.bones = bones[i][:2]
+                w.weights = BoneWeightSDEF(weights[i][0], tuple(sdef_c[i]), tuple(sdef_r0[i]), tuple(sdef_r1[i]))
+            else:
+                raise ValueError('invalid weight type %s'%str(t))
+            v.edge_scale = edge_scale[i]
+            vertices.append(v)
+        return vertices
+
 class Texture:
     def __init__(self):
         self.path = ''
@@ -1148,11 +1652,17 @@ class Morph:
     def __repr__(self):
         return '<Morph name %s, name_e %s>'%(self.name, self.name_e)
 
+    @property
+    def offset_data(self):
+        """ Structured array of the offsets, or None if self.offsets is not backed by an array.
+        """
+        return getattr(self.offsets, 'data', None)
+
     def type_index(self):
         raise NotImplementedError
 
     @staticmethod
-    def create(fs):
+    def morphClass(type_index):
         _CLASSES = {
             0: GroupMorph,
             1: VertexMorph,
@@ -1164,13 +1674,16 @@ class Morph:
             7: UVMorph,
             8: MaterialMorph,
             }
+        return _CLASSES[type_index]
 
+    @staticmethod
+    def create(fs):
         name = fs.readStr()
         name_e = fs.readStr()
         logging.debug('morph: %s', name)
         category = fs.readSignedByte()
         typeIndex = fs.readSignedByte()
-        ret = _CLASSES[typeIndex](name, name_e, category, type_index = typeIndex)
+        ret = Morph.morphClass(typeIndex)(name, name_e, category, type_index = typeIndex)
         ret.load(fs)
         return ret
 
@@ -1179,14 +1692,38 @@ class Morph:
         """
         raise NotImplementedError
 
+    @staticmethod
+    def offsetDtype(header):
+        """ Return the structured dtype of an offset record. The field names are the
+        attribute names of the offset objects.
+        """
+        raise NotImplementedError
+
+    def setOffsetData(self, data):
+        """ Replace the offsets with the records of a structured array of offsetDtype().
+        """
+        raise NotImplementedError
+
+    def offsetArray(self, header):
+        """ Return the offsets as an array of self.offsetDtype(header).
+        """
+        dtype = self.offsetDtype(header)
+        data = self.offset_data
+        if data is not None:
+            return data.astype(dtype)
+        data = np.zeros(len(self.offsets), dtype=dtype)
+        if len(data):
+            for name in dtype.names:
+                data[name] = [getattr(x, name) for x in self.offsets]
+        return data
+
     def save(self, fs):
         fs.writeStr(self.name)
         fs.writeStr(self.name_e)
         fs.writeSignedByte(self.category)
         fs.writeSignedByte(self.type_index())
         fs.writeInt(len(self.offsets))
-        for i in self.offsets:
-            i.save(fs)
+        fs.writeArray(self.offsetArray(fs.header()))
 
 class VertexMorph(Morph):
     def __init__(self, *args, **kwargs):
@@ -1195,18 +1732,32 @@ class VertexMorph(Morph):
     def type_index(self):
         return 1
 
+    @staticmethod
+    def offsetDtype(header):
+        return np.dtype([('index', _indexDtype(header.vertex_index_size, False)), ('offset', '<f4', 3)])
+
+    def setOffsetData(self, data):
+        self.offsets = ArrayBackedList(data, VertexMorphOffset.fromArray)
+
     def load(self, fs):
         num = fs.readInt()
-        for i in range(num):
-            t = VertexMorphOffset()
-            t.load(fs)
-            self.offsets.append(t)
+        self.setOffsetData(fs.readArray(self.offsetDtype(fs.header()), num))
 
 class VertexMorphOffset:
     def __init__(self):
         self.index = 0
         self.offset = []
 
+    @staticmethod
+    def fromArray(data):
+        offsets = []
+        for index, offset in zip(data['index'].tolist(), data['offset'].tolist()):
+            t = VertexMorphOffset()
+            t.index = index
+            t.offset = tuple(offset)
+            offsets.append(t)
+        return offsets
+
     def load(self, fs):
         self.index = fs.readVertexIndex()
         self.offset = fs.readVector(3)
@@ -1223,19 +1774,32 @@ class UVMorph(Morph):
     def type_index(self):
         return self.uv_index + 3
 
+    @staticmethod
+    def offsetDtype(header):
+        return np.dtype([('index', _indexDtype(header.vertex_index_size, False)), ('offset', '<f4', 4)])
+
+    def setOffsetData(self, data):
+        self.offsets = ArrayBackedList(data, UVMorphOffset.fromArray)
+
     def load(self, fs):
-        self.offsets = []
         num = fs.readInt()
-        for i in range(num):
-            t = UVMorphOffset()
-            t.load(fs)
-            self.offsets.append(t)
+        self.setOffsetData(fs.readArray(self.offsetDtype(fs.header()), num))
 
 class UVMorphOffset:
     def __init__(self):
         self.index = 0
         self.offset = []
 
+    @staticmethod
+    def fromArray(data):
+        offsets = []
+        for index, offset in zip(data['index'].tolist(), data['offset'].tolist()):
+            t = UVMorphOffset()
+            t.index = index
+            t.offset = tuple(offset)
+            offsets.append(t)
+        return offsets
+
     def load(self, fs):
         self.index = fs.readVertexIndex()
         self.offset = fs.readVector(4)
@@ -1251,13 +1815,21 @@ class BoneMorph(Morph):
     def type_index(self):
         return 2
 
+    @staticmethod
+    def offsetDtype(header):
+        return np.dtype([('index', _indexDtype(header.bone_index_size, True)), ('location_offset', '<f4', 3), ('rotation_offset', '<f4', 4)])
+
+    def setOffsetData(self, data):
+        self.offsets = ArrayBackedList(data, BoneMorphOffset.fromArray)
+
     def load(self, fs):
-        self.offsets = []
         num = fs.readInt()
-        for i in range(num):
-            t = BoneMorphOffset()
-            t.load(fs)
-            self.offsets.append(t)
+        data = fs.readArray(self.offsetDtype(fs.header()), num)
+        no_rotation = ~data['rotation_offset'].any(axis=1)
+        if no_rotation.any():
+            data = data.copy()
+            data['rotation_offset'][no_rotation] = (0, 0, 0, 1)
+        self.setOffsetData(data)
 
 class BoneMorphOffset:
     def __init__(self):
@@ -1265,6 +1837,17 @@ class BoneMorphOffset:
         self.location_offset = []
         self.rotation_offset = []
 
+    @staticmethod
+    def fromArray(data):
+        offsets = []
+        for index, location, rotation in zip(data['index'].tolist(), data['location_offset'].tolist(), data['rotation_offset'].tolist()):
+            t = BoneMorphOffset()
+            t.index = index
+            t.location_offset = tuple(location)
+            t.rotation_offset = tuple(rotation)
+            offsets.append(t)
+        return offsets
+
     def load(self, fs):
         self.index = fs.readBoneIndex()
         self.location_offset = fs.readVector(3)
@@ -1284,6 +1867,22 @@ class MaterialMorph(Morph):
     def type_index(self):
         return 8
 
+    @staticmethod
+    def offsetDtype(header):
+        return np.dtype([
+            ('index', _indexDtype(header.material_index_size, True)),
+            ('offset_type', 'i1'),
+            ('diffuse_offset', '<f4', 4),
+            ('specular_offset', '<f4', 3),
+            ('shininess_offset', '<f4'),
+            ('ambient_offset', '<f4', 3),
+            ('edge_color_offset', '<f4', 4),
+            ('edge_size_offset', '<f4'),
+            ('texture_factor', '<f4', 4),
+            ('sphere_texture_factor', '<f4', 4),
+            ('toon_texture_factor', '<f4', 4),
+            ])
+
     def load(self, fs):
         self.offsets = []
         num = fs.readInt()
@@ -1342,6 +1941,10 @@ class GroupMorph(Morph):
     def type_index(self):
         return 0
 
+    @staticmethod
+    def offsetDtype(header):
+        return np.dtype([('morph', _indexDtype(header.morph_index_size, True)), ('factor', '<f4')])
+
     def load(self, fs):
         self.offsets = []
         num = fs.readInt()
@@ -1590,8 +2193,220 @@ class Joint:
 
 
 
-def load(path):
-    with FileReadStream(path) as fs:
+class PMXIndex:
+    """ Lazily decoded pmx file.
+
+    One quick pass over the memory-mapped file records the offset and the item count of
+    each section, and a section is only decoded when it is first accessed, e.g.
+
+        with PMXIndex(path) as index:
+            bone_names = index.names('bones')
+            textures = index.textures
+
+    Header, model name/comment and name queries do not decode any section.
+    """
+    SECTIONS = ('vertices', 'faces', 'textures', 'materials', 'bones', 'morphs', 'display', 'rigids', 'joints')
+
+    def __init__(self, path):
+        self.__fs = MappedReadStream(path)
+        self.__offsets = {}
+        self.__counts = {}
+        self.__item_offsets = {}
+        self.__loaded = set()
+        try:
+            fs = self.__fs
+            header = Header()
+            header.load(fs)
+            fs.setHeader(header)
+            model = self.__model = Model()
+            model.filepath = fs.path()
+            model.header = header
+            model.name = fs.readStr()
+            model.name_e = fs.readStr()
+            model.comment = fs.readStr()
+            model.comment_e = fs.readStr()
+            self.__skim()
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        if name in PMXIndex.SECTIONS:
+            return self.section(name)
+        raise AttributeError(name)
+
+    def close(self):
+        self.__fs.close()
+
+    @property
+    def header(self):
+        return self.__model.header
+
+    @property
+    def name(self):
+        return self.__model.name
+
+    @property
+    def name_e(self):
+        return self.__model.name_e
+
+    @property
+    def comment(self):
+        return self.__model.comment
+
+    @property
+    def comment_e(self):
+        return self.__model.comment_e
+
+    def count(self, section):
+        """ Return the number of items of a section (indices for 'faces').
+        """
+        return self.__counts.get(section, 0)
+
+    def offset(self, section):
+        """ Return the byte offset of a section, or None if it could not be located.
+        """
+        return self.__offsets.get(section, None)
+
+    def section(self, section):
+        """ Return a section as the matching Model attribute, decoding it on first access.
+        """
+        if section not in self.__loaded:
+            self.__load(section)
+        return getattr(self.__model, section)
+
+    def names(self, section, english=False):
+        """ Return the item names of a section, without decoding the section.
+        Texture paths are returned for 'textures'.
+        """
+        if section == 'textures':
+            return [t.path for t in self.section(section)]
+        if section in self.__loaded:
+            return [x.name_e if english else x.name for x in getattr(self.__model, section)]
+        fs = self.__fs
+        names = []
+        for pos in self.__item_offsets.get(section, ()):
+            fs.seek(pos)
+            name = fs.readStr()
+            if english:
+                name = fs.readStr()
+            names.append(name)
+        return names
+
+    def model(self):
+        """ Return the Model with every section decoded.
+        """
+        for section in self.SECTIONS:
+            self.section(section)
+        return self.__model
+
+    def __load(self, section):
+        self.__loaded.add(section)
+        if section not in self.__offsets:
+            return
+        fs = self.__fs
+        model = self.__model
+        fs.seek(self.__offsets[section])
+        try:
+            if section == 'materials':
+                model.loadMaterials(fs, self.count('textures'))
+            else:
+                getattr(model, 'load' + section.capitalize())(fs)
+        except struct.error as e:
+            logging.error(' * Corrupted file: %s', e)
+
+    def __skim(self):
+        fs = self.__fs
+        header = fs.header()
+        bone_size, morph_size = header.bone_index_size, header.morph_index_size
+        texture_size, rigid_size = header.texture_index_size, header.rigid_index_size
+
+        def skip_str():
+            fs.skip(fs.readInt())
+
+        def skip_names(section, count):
+            item_offsets = self.__item_offsets[section] = []
+            for i in range(count):
+                item_offsets.append(fs.tell())
+                skip_str()
+                skip_str()
+                yield i
+
+        try:
+            for section in self.SECTIONS:
+                self.__offsets[section] = fs.tell()
+                count = self.__counts[section] = fs.readInt()
+
+                if section == 'vertices':
+                    buf = fs.peekBytes(count * VertexData.maxRecordSize(header))
+                    fs.skip(VertexData.scan(buf, count, header)[1])
+                elif section == 'faces':
+                    fs.skip(int(count/3) * 3 * header.vertex_index_size)
+                elif section == 'textures':
+                    for i in range(count):
+                        skip_str()
+                elif section == 'materials':
+                    for i in skip_names(section, count):
+                        fs.skip(65 + 2 * texture_size + 1)
+                        fs.skip(1 if fs.readSignedByte() == 1 else texture_size)
+                        skip_str()
+                        fs.skip(4)
+                elif section == 'bones':
+                    for i in skip_names(section, count):
+                        fs.skip(12 + bone_size + 4)
+                        flags = fs.readShort()
+                        fs.skip(bone_size if flags & 0x0001 else 12)
+                        if flags & 0x0300:
+                            fs.skip(bone_size + 4)
+                        if flags & 0x0400:
+                            fs.skip(12)
+                        if flags & 0x0800:
+                            fs.skip(24)
+                        if flags & 0x2000:
+                            fs.skip(4)
+                        if flags & 0x0020:
+                            fs.skip(bone_size + 8)
+                            for j in range(fs.readInt()):
+                                fs.skip(bone_size)
+                                if fs.readByte() == 1:
+                                    fs.skip(24)
+                elif section == 'morphs':
+                    for i in skip_names(section, count):
+                        fs.skip(1)
+                        morph_class = Morph.morphClass(fs.readSignedByte())
+                        fs.skip(fs.readInt() * morph_class.offsetDtype(header).itemsize)
+                elif section == 'display':
+                    for i in skip_names(section, count):
+                        fs.skip(1)
+                        for j in range(fs.readInt()):
+                            disp_type = fs.readByte()
+                            if disp_type not in (0, 1):
+                                raise Exception('invalid value.')
+                            fs.skip(bone_size if disp_type == 0 else morph_size)
+                elif section == 'rigids':
+                    for i in skip_names(section, count):
+                        fs.skip(bone_size + 61)
+                elif section == 'joints':
+                    for i in skip_names(section, count):
+                        fs.skip(1 + 2 * rigid_size + 96)
+        except struct.error as e:
+            logging.error(' * Corrupted file: %s', e)
+
+
+def load(path, mmap=False):
+    """ Load a pmx file.
+
+    With mmap=True the file is memory-mapped, and the vertex, face and morph offset arrays
+    of the returned model are views of the mapping where the data layout allows it.
+    """
+    stream_class = MappedReadStream if mmap else FileReadStream
+    with stream_class(path) as fs:
         logging.info('****************************************')
         logging.info(' mmd_tools_local.pmx module')
         logging.info('----------------------------------------')
@@ -1613,10 +2428,22 @@ def load(path):
         logging.info('****************************************')
         return model
 
-def save(path, model, add_uv_count=0):
+@contextlib.contextmanager
+def openWriter(path, model, add_uv_count=0, vertex_count=None):
+    """ Open a pmx file for writing the sections of model with a ModelWriter.
+
+    The header is written from the section counts of model, which have to be final, while the
+    sections themselves can still be built (or released) as they are written. vertex_count
+    replaces len(model.vertices) when the vertices are written with writeVertexChunks().
+    """
     with FileWriteStream(path) as fs:
-        header = Header(model)
+        header = Header()
+        header.updateIndexSizes(model, vertex_count)
         header.additional_uvs = max(0, min(4, add_uv_count)) # UV1~UV4
         header.save(fs)
         fs.setHeader(header)
-        model.save(fs)
+        yield ModelWriter(fs)
+
+def save(path, model, add_uv_count=0):
+    with openWriter(path, model, add_uv_count) as writer:
+        writer.writeModel(model)
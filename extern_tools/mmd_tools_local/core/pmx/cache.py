@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 MMD Tools authors
+# This file is part of MMD Tools.
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from mmd_tools_local.core import pmx
+
+
+def _source_version():
+    """Hash the sources of the pmx classes and of this module, so entries written by other versions miss."""
+    h = hashlib.sha1()
+    for path in (pmx.__file__, __file__):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def _value(value):
+    """Convert an attribute of a pmx object to JSON, vectors (tuples) become lists."""
+    if isinstance(value, (list, tuple)):
+        return [_value(x) for x in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError("can't cache a value of type %s" % type(value).__name__)
+
+
+def _attribute(value):
+    """Convert a JSON value back to an attribute, the pmx loaders read vectors as tuples."""
+    if isinstance(value, list):
+        return tuple(_attribute(x) for x in value)
+    return value
+
+
+def _fields(obj, cls, *skip):
+    """The attributes of obj, which has to be a cls object, as JSON values, leaving out the skip attributes."""
+    if type(obj) is not cls:
+        raise TypeError("can't cache a %s as a pmx.%s" % (type(obj).__name__, cls.__name__))
+    return {k: _value(v) for k, v in vars(obj).items() if k not in skip}
+
+
+def _build(cls, fields, args=(), **objects):
+    """Construct a cls object and set its attributes from fields and objects.
+
+    fields and objects have to cover exactly the attributes cls sets up in __init__, so an entry
+    of a different layout fails here instead of giving a model the importer can't use.
+    """
+    obj = cls(*args)
+    if set(fields).union(objects) != set(vars(obj)):
+        raise ValueError("the attributes of pmx.%s don't match the cache entry" % cls.__name__)
+    for name, value in fields.items():
+        setattr(obj, name, _attribute(value))
+    for name, value in objects.items():
+        setattr(obj, name, value)
+    return obj
+
+
+# morphs whose offsets are lists of objects rather than arrays
+_OFFSET_CLASSES = {
+    pmx.MaterialMorph: pmx.MaterialMorphOffset,
+    pmx.GroupMorph: pmx.GroupMorphOffset,
+}
+
+
+def _has_offset_data(morph_class):
+    return morph_class.setOffsetData is not pmx.Morph.setOffsetData
+
+
+def _encode(model):
+    """Split model into the arrays and the JSON info of a cache entry.
+
+    The vertex data, faces and array morph offsets are stored as arrays, everything else as
+    the attributes of the section items.
+    """
+    vertex_data, face_data = model.vertex_data, model.face_data
+    if vertex_data is None or face_data is None:
+        raise ValueError("the vertices or faces are not backed by arrays")
+    header = model.header
+    arrays = {"vertex_" + name: value for name, value in vars(vertex_data).items()}
+    arrays["faces"] = face_data
+
+    morphs = []
+    for i, morph in enumerate(model.morphs):
+        morph_class = pmx.Morph.morphClass(morph.type_index())
+        item = {"type": morph.type_index(), "fields": _fields(morph, morph_class, "offsets")}
+        if _has_offset_data(morph_class):
+            arrays["morph%d" % i] = morph.offsetArray(header)
+        else:
+            offset_class = _OFFSET_CLASSES[morph_class]
+            item["offsets"] = [_fields(x, offset_class) for x in morph.offsets]
+        morphs.append(item)
+
+    bones = []
+    for bone in model.bones:
+        item = _fields(bone, pmx.Bone, "ik_links", "localCoordinate")
+        item["ik_links"] = [_fields(x, pmx.IKLink) for x in bone.ik_links]
+        coordinate = bone.localCoordinate
+        item["localCoordinate"] = None if coordinate is None else _value((coordinate.x_axis, coordinate.z_axis))
+        bones.append(item)
+
+    info = {
+        "model": _fields(model, pmx.Model, "header", "vertices", "faces", "textures", "materials", "bones", "morphs", "display", "rigids", "joints"),
+        "header": dict(_fields(header, pmx.Header, "sign", "encoding"), sign=header.sign.decode("latin-1"), encoding=header.encoding.index),
+        "textures": [_fields(x, pmx.Texture) for x in model.textures],
+        "materials": [_fields(x, pmx.Material) for x in model.materials],
+        "bones": bones,
+        "morphs": morphs,
+        "display": [_fields(x, pmx.Display) for x in model.display],
+        "rigids": [_fields(x, pmx.Rigid) for x in model.rigids],
+        "joints": [_fields(x, pmx.Joint) for x in model.joints],
+    }
+    arrays["info"] = np.frombuffer(json.dumps(info).encode("utf-8"), dtype=np.uint8)
+    return arrays
+
+
+def _decode(arrays):
+    """Rebuild the pmx.Model of the arrays of a cache entry written by _encode."""
+    info = json.loads(arrays.pop("info").tobytes().decode("utf-8"))
+
+    header = info["header"]
+    header = _build(pmx.Header, {k: v for k, v in header.items() if k not in ("sign", "encoding")}, sign=header["sign"].encode("latin-1"), encoding=pmx.Encoding(header["encoding"]))
+
+    bones = []
+    for item in info["bones"]:
+        ik_links = [_build(pmx.IKLink, x) for x in item.pop("ik_links")]
+        coordinate = item.pop("localCoordinate")
+        coordinate = None if coordinate is None else pmx.Coordinate(*_attribute(coordinate))
+        bones.append(_build(pmx.Bone, item, ik_links=ik_links, localCoordinate=coordinate))
+
+    morphs = []
+    for i, item in enumerate(info["morphs"]):
+        morph_class, fields = pmx.Morph.morphClass(item["type"]), item["fields"]
+        morph = _build(morph_class, fields, (fields["name"], fields["name_e"], fields["category"]), offsets=[])
+        if _has_offset_data(morph_class):
+            morph.setOffsetData(arrays.pop("morph%d" % i))
+        else:
+            morph.offsets = [_build(_OFFSET_CLASSES[morph_class], x) for x in item["offsets"]]
+        morphs.append(morph)
+
+    display = []
+    for item in info["display"]:
+        display.append(_build(pmx.Display, {k: v for k, v in item.items() if k != "data"}, data=[tuple(x) for x in item["data"]]))
+
+    vertex_arrays = {k[len("vertex_"):]: arrays.pop(k) for k in list(arrays) if k.startswith("vertex_")}
+    vertex_data = _build(pmx.VertexData, {}, **vertex_arrays)
+    face_data = arrays.pop("faces")
+    if arrays:
+        raise ValueError("unexpected members %s" % sorted(arrays))
+
+    model = _build(
+        pmx.Model,
+        info["model"],
+        header=header,
+        vertices=None,  # set below
+        faces=None,
+        textures=[_build(pmx.Texture, x) for x in info["textures"]],
+        materials=[_build(pmx.Material, x) for x in info["materials"]],
+        bones=bones,
+        morphs=morphs,
+        display=display,
+        rigids=[_build(pmx.Rigid, x) for x in info["rigids"]],
+        joints=[_build(pmx.Joint, x) for x in info["joints"]],
+    )
+    model.setVertexData(vertex_data)
+    model.setFaceData(face_data)
+    return model
+
+
+class PMXCache:
+    """On-disk cache of parsed pmx models.
+
+    Entries are .npz files named by the content hash of the pmx file and by VERSION, a hash of
+    the sources of the pmx classes, so entries of other versions are never read. The vertex data,
+    faces and array morph offsets are stored as npz members, and the attributes of the other
+    section items as a JSON member, from which the model is rebuilt with the pmx constructors.
+    An index maps (path, size, mtime) to the content hash, so an unchanged file is found without
+    being hashed again. The least recently used entries are removed when the cache grows over
+    max_size bytes.
+    """
+
+    VERSION = _source_version()
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__index = None
+
+    def load(self, filepath):
+        """Return the pmx.Model of filepath, parsing and storing it on a cache miss."""
+        filepath = os.path.abspath(filepath)
+        try:
+            entry_path = self.__find_entry(filepath)
+        except OSError as e:
+            logging.warning(" * Failed to update the pmx cache index in %s: %s", self.directory, e)
+            return pmx.load(filepath)
+
+        model = None
+        if os.path.isfile(entry_path):
+            try:
+                model = self.__read_entry(entry_path, filepath)
+            except Exception as e:
+                logging.warning(" * Failed to read the pmx cache entry %s: %s", entry_path, e)
+        if model is not None:
+            self.hits += 1
+            try:
+                os.utime(entry_path)  # mark as recently used
+            except OSError:
+                pass
+            logging.info("PMX cache hit: %s (hits: %d, misses: %d)", filepath, self.hits, self.misses)
+            return model
+
+        self.misses += 1
+        logging.info("PMX cache miss: %s (hits: %d, misses: %d)", filepath, self.hits, self.misses)
+        model = pmx.load(filepath)
+        try:
+            self.__write_entry(entry_path, model)
+            self.__evict()
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(" * Failed to write the pmx cache entry %s: %s", entry_path, e)
+        return model
+
+    def clear(self):
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            if name.endswith(".npz") or name == self.INDEX_FILE:
+                os.remove(os.path.join(self.directory, name))
+        self.__index = None
+
+    def __find_entry(self, filepath):
+        stat = os.stat(filepath)
+        index = self.__load_index()
+        entry = index.get(filepath)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            entry = index[filepath] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": self.__content_hash(filepath)}
+            self.__save_index()
+        return self.__entry_path(entry["hash"])
+
+    def __entry_path(self, content_hash):
+        return os.path.join(self.directory, "%s.%s.npz" % (content_hash, self.VERSION))
+
+    @staticmethod
+    def __content_hash(filepath):
+        h = hashlib.sha1()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def __load_index(self):
+        if self.__index is None:
+            try:
+                with open(os.path.join(self.directory, self.INDEX_FILE), encoding="utf-8") as f:
+                    self.__index = json.load(f)
+            except (OSError, ValueError):
+                self.__index = {}
+        return self.__index
+
+    def __save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.__index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __write_entry(self, entry_path, model):
+        arrays = _encode(model)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = entry_path + ".tmp"
+        with open(tmp_path, "wb") as fout:
+            np.savez(fout, **arrays)
+        os.replace(tmp_path, entry_path)
+
+    @staticmethod
+    def __read_entry(entry_path, filepath):
+        with np.load(entry_path, allow_pickle=False) as npz:
+            model = _decode({k: npz[k] for k in npz.files})
+
+        # the same content may be cached from another location, so rebase the texture paths
+        old_dir, new_dir = os.path.dirname(model.filepath), os.path.dirname(filepath)
+        if old_dir != new_dir:
+            for t in model.textures:
+                try:
+                    t.path = os.path.normpath(os.path.join(new_dir, os.path.relpath(t.path, old_dir)))
+                except ValueError:
+                    pass
+        model.filepath = filepath
+        return model
+
+    def __evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total_size = sum(x[1] for x in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logging.info("PMX cache: evict %s", path)
+            os.remove(path)
+            total_size -= size
+
+        # forget the files whose entries are gone, so the index doesn't grow without limit
+        index = self.__load_index()
+        stale = [k for k, v in index.items() if not os.path.isfile(self.__entry_path(v["hash"]))]
+        if stale:
+            for k in stale:
+                del index[k]
+            self.__save_index()
+
+
+__active_cache = None
+
+
+def configure(directory, max_size):
+    """Enable the cache used by the pmx importer, or disable it if directory is None."""
+    global __active_cache
+    if directory is None:
+        __active_cache = None
+    elif __active_cache is None or __active_cache.directory != directory:
+        __active_cache = PMXCache(directory, max_size)
+    else:
+        __active_cache.max_size = max_size
+
+
+def active_cache():
+    return __active_cache
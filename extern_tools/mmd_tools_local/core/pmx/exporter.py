@@ -2,17 +2,18 @@
 # Copyright 2014 MMD Tools authors
 # This file is part of MMD Tools.
 
-import copy
 import logging
 import math
 import os
 import shutil
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import bmesh
 import bpy
 import mathutils
+import numpy as np
 
 from mmd_tools_local import bpyutils
 from mmd_tools_local.core import pmx
@@ -25,33 +26,317 @@ from mmd_tools_local.operators.misc import MoveObject
 from mmd_tools_local.utils import saferelpath
 
 
-class _Vertex:
-    def __init__(self, co, groups, offsets, edge_scale, vertex_order, uv_offsets):
-        self.co = co
-        self.groups = groups  # [(group_number, weight), ...]
-        self.offsets = offsets
-        self.edge_scale = edge_scale
-        self.vertex_order = vertex_order  # used for controlling vertex order
-        self.uv_offsets = uv_offsets
-        self.index = None
-        self.uv = None
-        self.normal = None
-        self.sdef_data = []  # (C, R0, R1)
-        self.add_uvs = [None] * 4  # UV1~UV4
-
-
-class _Face:
-    def __init__(self, vertices, index=-1):
-        """Temporary Face Class"""
-        self.vertices = vertices
-        self.index = index
+def _foreach_get(collection, attr, count, size=1, dtype=np.float32):
+    """Read an attribute of the items of a bpy collection into an array of count rows."""
+    data = np.empty(count * size, dtype=dtype)
+    collection.foreach_get(attr, data)
+    return data.reshape(count, size) if size > 1 else data
+
+
+def _normalized(vectors):
+    """Normalize the rows of an (n, 3) array with the float32 results of Vector.normalized(), tiny vectors become zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    length_squared = np.square(vectors, dtype=np.float64).sum(axis=1)
+    valid = length_squared > 1e-35
+    scale = np.float32(1.0) / np.sqrt(np.where(valid, length_squared, 1.0)).astype(np.float32)
+    return np.where(valid[:, None], vectors * scale[:, None], np.float32(0.0))
+
+
+def _unique_rows(rows):
+    """Number the distinct rows of a 2D integer array in the order of their first appearance.
+
+    @return (ids, first): the number of each row, and the index of the first row of each number
+    """
+    count = len(rows)
+    order = np.lexsort(rows.T[::-1])
+    sorted_rows = rows[order]
+    is_first = np.ones(count, dtype=bool)
+    is_first[1:] = np.any(sorted_rows[1:] != sorted_rows[:-1], axis=1)
+    first = order[is_first]  # lexsort is stable, so these are the first rows of the groups
+    ids = np.empty(count, dtype=np.int64)
+    ids[order] = np.cumsum(is_first) - 1
+    rank = np.argsort(first)
+    renumber = np.empty(len(first), dtype=np.int64)
+    renumber[rank] = np.arange(len(first))
+    return renumber[ids], first[rank]
+
+
+def _expand_rows(rows, sorted_sources, order):
+    """Find the split vertices of some vertices.
+
+    @param rows: the vertex indices
+    @param sorted_sources: the vertex of each split vertex, sorted
+    @param order: the split vertex of each item of sorted_sources
+    @return (split, positions): the split vertices of the rows, and the position in rows of each one
+    """
+    begins = np.searchsorted(sorted_sources, rows, "left")
+    counts = np.searchsorted(sorted_sources, rows, "right") - begins
+    positions = np.repeat(np.arange(len(rows)), counts)
+    steps = np.arange(len(positions)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[begins[positions] + steps], positions
+
+
+def _tolerance_clusters(groups, values, tolerances, leaders):
+    """Cluster the rows of each group the way the exporter has always compared vertices.
+
+    Going through the rows in order, a row joins the first cluster of its group whose leader row is
+    within tolerance of it for every array of values (vector length of the difference), otherwise it
+    starts a new cluster led by itself. The first cluster of the group of a row is led by leaders[row],
+    which may be a row of another group. Each round here builds the next cluster of every group at once.
+
+    @return the cluster number of each row within its group
+    """
+    clusters = np.empty(len(groups), dtype=np.int64)
+    pending = np.arange(len(groups))
+    pending_leaders = leaders
+    cluster = 0
+    while len(pending):
+        match = np.ones(len(pending), dtype=bool)
+        for array, tolerance in zip(values, tolerances):
+            difference = array[pending] - array[pending_leaders]
+            match &= np.einsum("ij,ij->i", difference, difference) < tolerance * tolerance
+        match |= pending_leaders == pending  # even if its values are NaN
+        clusters[pending[match]] = cluster
+        pending = pending[~match]
+        cluster += 1
+        pending_groups = groups[pending]
+        group_ids, first = np.unique(pending_groups, return_index=True)
+        pending_leaders = pending[first][np.searchsorted(group_ids, pending_groups)]
+    return clusters
+
+
+def _split_loop_vertices(loop_vertices, attributes):
+    """Split the vertices at the loops of different normals or UVs.
+
+    attributes is a list of (values, tolerances) passes, [((uvs, normals), (0.001, 0.01))] followed by
+    the passes of the additional UVs, and each pass splits the split vertices of the previous one with
+    _tolerance_clusters. This gives the same vertices as the per loop comparisons of older versions,
+    where the split vertices of a vertex shared their additional UVs until an additional UV pass split
+    them: the first cluster of such a split vertex is led by the first loop of the vertex.
+
+    @return (loop_split, pass_loops): the split vertex of each loop, and for each pass the loop
+    holding the values of each split vertex. Split vertices are numbered in the order of their first loop.
+    """
+    split = loop_vertices
+    ids, first = _unique_rows(loop_vertices[:, None])
+    shared = first[ids]  # the loop that set the values shared by the split vertices of each loop
+    pass_rows = []
+    for values, tolerances in attributes:
+        clusters = _tolerance_clusters(split, values, tolerances, shared)
+        split, first = _unique_rows(np.column_stack((split, clusters)))
+        rows = np.where(clusters == 0, shared, first[split])
+        pass_rows.append(rows)
+        if len(pass_rows) > 1:  # new split vertices of additional UV passes no longer share values
+            shared = rows
+    return split, [rows[first] for rows in pass_rows]  # first is the first loop of each split vertex
+
+
+def _group_weights(data, group_index, default_weight):
+    """The weights of a vertex group for every vertex, default_weight where a vertex is not in the group."""
+    table = data.weight_table
+    weights = np.full(len(data.co), default_weight, dtype=np.float64)
+    rows = table["group"] == group_index
+    weights[table["vertex"][rows]] = table["weight"][rows]
+    return weights
+
+
+def _bone_weights(data):
+    """Compute the PMX bone weights of the vertices.
+
+    Vertices with up to one bone are BDEF1, with two bones BDEF2 (SDEF where the SDEF shape keys
+    move them), and with more bones BDEF4 of their four largest weights.
+
+    @return a VertexData of the weights of every vertex
+    """
+    vertex_count = len(data.co)
+    table = data.weight_table
+    table_bones = data.group_bones[table["group"]]
+    rows = (table["weight"] > 0) & (table_bones >= 0)
+    vertices, bones, weights = table["vertex"][rows], table_bones[rows], table["weight"][rows].astype(np.float64)
+    counts = np.bincount(vertices, minlength=vertex_count)
+
+    # the table rows are sorted by vertex, keep the largest weights first where there are too many
+    order = np.lexsort((np.where(counts[vertices] > 4, -weights, 0), vertices))
+    vertices, bones, weights = vertices[order], bones[order], weights[order]
+    ranks = np.arange(len(vertices)) - (np.cumsum(counts) - counts)[vertices]
+    rows = ranks < 4
+    group_bones = np.zeros((vertex_count, 4), dtype=np.int32)
+    group_weights = np.zeros((vertex_count, 4), dtype=np.float64)
+    group_bones[vertices[rows], ranks[rows]] = bones[rows]
+    group_weights[vertices[rows], ranks[rows]] = weights[rows]
+
+    result = pmx.VertexData(vertex_count)
+    result.weight_type[:] = pmx.BoneWeight.BDEF4
+    result.bones[:] = group_bones
+    w_all = group_weights[:, 0] + group_weights[:, 1] + group_weights[:, 2] + group_weights[:, 3]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result.weights[:] = group_weights / w_all[:, None]
+
+    bdef1 = counts < 2
+    result.weight_type[bdef1] = pmx.BoneWeight.BDEF1
+    result.bones[bdef1, 1:] = -1
+    result.weights[bdef1] = (1, 0, 0, 0)
+
+    bdef2 = np.flatnonzero(counts == 2)
+    w1, w2 = group_weights[bdef2, 0], group_weights[bdef2, 1]
+    w = w1 / (w1 + w2)
+    is_sdef = np.zeros(len(bdef2), dtype=bool)
+    c = data.sdef_keys.get("mmd_sdef_c", None)
+    if c is not None:
+        is_sdef = ~(np.linalg.norm(c[bdef2] - data.co[bdef2], axis=1) < 0.001)
+        sdef = bdef2[is_sdef]
+        logging.debug("   - Restored %d SDEF vertices", len(sdef))
+        result.sdef_c[sdef] = c[sdef]
+        result.sdef_r0[sdef] = data.sdef_keys.get("mmd_sdef_r0", data.co)[sdef]
+        result.sdef_r1[sdef] = data.sdef_keys.get("mmd_sdef_r1", data.co)[sdef]
+        swap = is_sdef & (group_bones[bdef2, 0] > group_bones[bdef2, 1])
+        result.bones[bdef2[swap], :2] = group_bones[bdef2[swap], 1::-1]
+        w[swap] = 1.0 - w[swap]
+    result.weight_type[bdef2] = np.where(is_sdef, pmx.BoneWeight.SDEF, pmx.BoneWeight.BDEF2)
+    result.bones[bdef2, 2:] = -1
+    result.weights[bdef2, 0] = w
+    result.weights[bdef2, 1] = 1.0 - w
+    result.weights[bdef2, 2:] = 0
+    return result
+
+
+def _uv_morph_offsets(data):
+    """The offsets of the UV morphs stored in the UV_<name>[+-][XYZW] vertex groups.
+
+    @return {name: (vertex indices, (n, 4) offsets)}
+    """
+    table = data.weight_table
+    axes = {g: (name, "XYZW".index(axis[1]), -1.0 if axis[0] == "-" else 1.0) for g, (name, axis) in data.uv_morph_groups.items()}
+    uv_offsets = {}
+    for name in dict.fromkeys(x[0] for x in axes.values()):
+        groups = [g for g, x in axes.items() if x[0] == name]
+        rows = (table["weight"] > 0) & np.isin(table["group"], groups)
+        if not np.any(rows):
+            continue
+        group_axes = np.zeros(max(groups) + 1, dtype=np.int64)
+        group_signs = np.zeros(max(groups) + 1, dtype=np.float64)
+        for g in groups:
+            group_axes[g], group_signs[g] = axes[g][1:]
+        entries = table[rows]
+        vertices, inverse = np.unique(entries["vertex"], return_inverse=True)
+        offsets = np.zeros((len(vertices), 4), dtype=np.float64)
+        np.add.at(offsets, (inverse, group_axes[entries["group"]]), group_signs[entries["group"]] * entries["weight"])
+        uv_offsets[name] = (vertices, offsets)
+    return uv_offsets
+
+
+def _process_mesh(data):
+    """Build the PMX vertices, faces and morph offsets of a mesh from its _MeshArrays.
+
+    This only works on arrays (numpy releases the GIL for most of it), so it can run on a worker thread.
+    """
+    attributes = [((data.loop_uvs, data.loop_normals), (0.001, 0.01))]
+    attributes.extend((uvzw, (0.001, 0.001)) for uvzw in data.loop_add_uvs)
+    loop_split, pass_loops = _split_loop_vertices(data.loop_vertices, attributes)
+    split_loops = pass_loops[0]
+    sources = data.loop_vertices[split_loops]
+    logging.debug(" - Split %d vertices of mesh %s into %d vertices", len(data.co), data.name, len(sources))
+
+    vertex_data = _bone_weights(data).take(sources)
+    vertex_data.co = data.co[sources]
+    vertex_data.normal = data.loop_normals[split_loops]
+    vertex_data.uv = data.loop_uvs[split_loops] * (1, -1) + (0, 1)
+    vertex_data.additional_uvs = np.zeros((len(sources), len(data.loop_add_uvs), 4), dtype=np.float32)
+    for i, ((uv, zw), loops) in enumerate(zip(data.loop_add_uvs, pass_loops[1:])):
+        vertex_data.additional_uvs[:, i] = np.hstack((uv[loops], zw[loops])) * (1, -1, 1, -1) + (0, 1, 0, 1)
+    vertex_data.edge_scale = _group_weights(data, data.edge_scale_group, 1)[sources].astype(np.float32)
+
+    vertex_orders = None
+    if data.vertex_order is not None:  # sort vertices
+        mesh_id, group_index = data.vertex_order
+        weights = _group_weights(data, group_index, 2)[sources] if group_index >= 0 else np.zeros(len(sources))
+        vertex_orders = np.column_stack((np.full(len(sources), mesh_id), weights, sources)).astype(np.float64)
+
+    faces = loop_split.reshape(-1, 3)
+    if data.reverse_faces:  # pmx.load/pmx.save reverse face vertices by default
+        faces = faces[:, ::-1]
+    if data.face_indices is None:
+        face_order = np.argsort(data.material_indices, kind="stable")
+    else:
+        face_order = np.lexsort((data.face_indices, data.material_indices))
+    faces = faces[face_order]
+    material_indices, starts = np.unique(data.material_indices[face_order], return_index=True)
+    material_faces = dict(zip(material_indices.tolist(), np.split(faces, starts[1:])))
+
+    # the offsets of the vertices apply to all of their split vertices
+    order = np.argsort(sources, kind="stable")
+    sorted_sources = sources[order]
+    shape_key_offsets = []
+    for rows, offsets in data.shape_key_offsets:
+        split, positions = _expand_rows(rows, sorted_sources, order)
+        shape_key_offsets.append((split, offsets[positions]))
+    uv_offsets = {}
+    for name, (rows, offsets) in _uv_morph_offsets(data).items():
+        split, positions = _expand_rows(rows, sorted_sources, order)
+        uv_offsets[name] = (split, offsets[positions])
+
+    return _Mesh(material_faces, data.shape_key_names, data.material_names, vertex_data, vertex_orders, shape_key_offsets, uv_offsets)
+
+
+def _take_rows(arrays, starts, rows, out):
+    """Gather rows of the concatenation of arrays into out, without concatenating the arrays.
+
+    starts are the first rows of the arrays in the concatenation. Arrays of more than two dimensions
+    (additional UVs) are cut or zero padded to the width of out.
+    """
+    owners = np.searchsorted(starts, rows, side="right") - 1
+    for i, array in enumerate(arrays):
+        selected = np.flatnonzero(owners == i)
+        local = rows[selected] - starts[i]
+        if out.ndim > 2:
+            count = min(out.shape[1], array.shape[1])
+            out[selected, :count] = array[local, :count]
+        else:
+            out[selected] = array[local]
+    return out
+
+
+def _take_vertex_data(vertex_data, starts, rows, additional_uvs):
+    """Gather rows of the concatenation of VertexData objects, keeping up to additional_uvs additional UVs."""
+    result = pmx.VertexData(len(rows), additional_uvs)
+    for name, value in vars(result).items():
+        _take_rows([getattr(data, name) for data in vertex_data], starts, rows, value)
+    return result
+
+
+class _MeshArrays:
+    def __init__(self, name):
+        """The data of a mesh object read from Blender, see _process_mesh()"""
+        self.name = name
+        self.co = None  # (vertices, 3) float32 array
+        self.loop_vertices = None
+        self.loop_normals = None
+        self.loop_uvs = None
+        self.loop_add_uvs = []  # [(uvs, zws), ...] of each additional UV
+        self.material_indices = None
+        self.face_indices = None  # the original polygon of each triangle, or None
+        self.reverse_faces = False
+        self.material_names = {}
+        self.weight_table = None  # (vertex, group, weight) entries of the sparse weight matrix
+        self.group_bones = None  # the bone index of each vertex group, -1 if it is not a bone
+        self.edge_scale_group = -1
+        self.vertex_order = None  # (mesh_id, vertex group index or -1) used for sorting vertices
+        self.uv_morph_groups = {}  # {vertex group index: (uv morph name, axis)}
+        self.sdef_keys = {}  # {shape key name: (vertices, 3) array} of the SDEF shape keys
+        self.shape_key_names = []
+        self.shape_key_offsets = []  # [(vertex indices, offsets), ...] of each shape key
 
 
 class _Mesh:
-    def __init__(self, material_faces, shape_key_names, material_names):
-        self.material_faces = material_faces  # dict of {material_index => [face1, face2, ....]}
+    def __init__(self, material_faces, shape_key_names, material_names, vertex_data, vertex_orders, shape_key_offsets, uv_offsets):
+        self.material_faces = material_faces  # dict of {material_index => (faces, 3) array of vertex indices}
         self.shape_key_names = shape_key_names
         self.material_names = material_names
+        self.vertex_data = vertex_data  # pmx.VertexData of the split vertices
+        self.vertex_orders = vertex_orders  # the sort keys of the vertices, or None
+        self.shape_key_offsets = shape_key_offsets  # [(vertex indices, offsets), ...] of each shape key
+        self.uv_offsets = uv_offsets  # {uv morph name: (vertex indices, offsets)}
+        self.exported = None  # the exported index of each vertex
 
 
 class _DefaultMaterial:
@@ -76,136 +361,89 @@ class __PmxExporter:
         "EYE": pmx.Morph.CATEGORY_EYE,
         "MOUTH": pmx.Morph.CATEGORY_MOUTH,
     }
+    VERTEX_CHUNK_SIZE = 1 << 16  # the number of vertices gathered at once by the streaming export
 
     def __init__(self):
         self.__model = None
         self.__bone_name_table = []
         self.__material_name_table = []
-        self.__exported_vertices = []
         self.__default_material = None
         self.__vertex_order_map = None  # used for controlling vertex order
         self.__overwrite_bone_morphs_from_pose_library = False
         self.__translate_in_presets = False
         self.__disable_specular = False
         self.__add_uv_count = 0
-
-    @staticmethod
-    def flipUV_V(uv):
-        u, v = uv
-        return u, 1.0 - v
+        self.__shape_key_chunk_size = 16
+        self.__mesh_workers = 1
+        self.__streaming = False
+        self.__vertex_morph_offsets = {}
+        self.__mesh_vertex_data = None  # (VertexData of each mesh, the first row of each mesh)
+        self.__vertex_sources = None  # the mesh vertex (row of __mesh_vertex_data) of each exported vertex
 
     def __getDefaultMaterial(self):
         if self.__default_material is None:
             self.__default_material = _DefaultMaterial()
         return self.__default_material.material
 
-    def __sortVertices(self):
+    def __sortVertices(self, meshes, vertex_orders):
         logging.info(" - Sorting vertices ...")
-        weight_items = self.__vertex_order_map.items()
-        sorted_indices = [i[0] for i in sorted(weight_items, key=lambda x: x[1].vertex_order)]
-        vertices = self.__model.vertices
-        self.__model.vertices = [vertices[i] for i in sorted_indices]
+        # a stable sort by (mesh_id, weight, vertex index), vertices of equal keys keep their export order
+        sorted_indices = np.lexsort(vertex_orders.T[::-1])
+        self.__vertex_sources = self.__vertex_sources[sorted_indices]
 
         # update indices
-        index_map = {x: i for i, x in enumerate(sorted_indices)}
-        for v in self.__vertex_order_map.values():
-            v.index = index_map[v.index]
-        for f in self.__model.faces:
-            f[:] = [index_map[i] for i in f]
-        logging.debug("   - Done (count:%d)", len(self.__vertex_order_map))
+        index_map = np.empty_like(sorted_indices)
+        index_map[sorted_indices] = np.arange(len(sorted_indices))
+        faces = self.__model.face_data
+        faces[:] = index_map[faces]
+        for mesh in meshes:
+            mesh.exported[:] = index_map[mesh.exported]
+        logging.debug("   - Done (count:%d)", len(sorted_indices))
+
+    def __takeVertexData(self, positions=slice(None)):
+        """Return the VertexData of the exported vertices at positions."""
+        vertex_data, starts = self.__mesh_vertex_data
+        return _take_vertex_data(vertex_data, starts, self.__vertex_sources[positions], min(self.__add_uv_count, 4))
+
+    def __exportedCo(self):
+        vertex_data = self.__model.vertex_data
+        if vertex_data is not None:
+            return vertex_data.co
+        vertex_data, starts = self.__mesh_vertex_data
+        return _take_rows([x.co for x in vertex_data], starts, self.__vertex_sources, np.empty((len(self.__vertex_sources), 3), dtype=np.float32))
 
     def __exportMeshes(self, meshes, bone_map):
         mat_map = OrderedDict()
-        for mesh in meshes:
+        for mesh_id, mesh in enumerate(meshes):
             for index, mat_faces in sorted(mesh.material_faces.items(), key=lambda x: x[0]):
                 name = mesh.material_names[index]
                 if name not in mat_map:
                     mat_map[name] = []
-                mat_map[name].append(mat_faces)
-
-        sort_vertices = self.__vertex_order_map is not None
-        if sort_vertices:
-            self.__vertex_order_map.clear()
-
-        # export vertices
+                mat_map[name].append((mesh_id, mat_faces))
+
+        # vertices are exported in the order they are first used by the faces of the materials
+        mesh_starts = np.cumsum([0] + [len(mesh.vertex_data) for mesh in meshes])
+        faces = [mat_faces + mesh_starts[mesh_id] for mat_meshes in mat_map.values() for mesh_id, mat_faces in mat_meshes]
+        faces = np.concatenate(faces or [np.zeros((0, 3), dtype=np.int64)]).astype(np.int64)
+        vertices, first_uses = np.unique(faces, return_index=True)
+        self.__vertex_sources = vertices[np.argsort(first_uses)]
+        exported = np.full(mesh_starts[-1], -1, dtype=np.int64)
+        exported[self.__vertex_sources] = np.arange(len(self.__vertex_sources))
+        self.__mesh_vertex_data = ([mesh.vertex_data for mesh in meshes], mesh_starts[:-1])
+        for mesh, start, end in zip(meshes, mesh_starts, mesh_starts[1:]):
+            mesh.exported = exported[start:end]
+            mesh.vertex_data = mesh.material_faces = None
+
+        self.__model.setFaceData(exported[faces])
         for mat_name, mat_meshes in mat_map.items():
-            face_count = 0
-            for mat_faces in mat_meshes:
-                mesh_vertices = []
-                for face in mat_faces:
-                    mesh_vertices.extend(face.vertices)
-
-                for v in mesh_vertices:
-                    if v.index is not None:
-                        continue
+            self.__exportMaterial(bpy.data.materials[mat_name], sum(len(mat_faces) for _, mat_faces in mat_meshes))
 
-                    v.index = len(self.__model.vertices)
-                    if sort_vertices:
-                        self.__vertex_order_map[v.index] = v
-
-                    pv = pmx.Vertex()
-                    pv.co = v.co
-                    pv.normal = v.normal
-                    pv.uv = self.flipUV_V(v.uv)
-                    pv.edge_scale = v.edge_scale
-                    for _uvzw in v.add_uvs:
-                        if _uvzw:
-                            pv.additional_uvs.append(self.flipUV_V(_uvzw[0]) + self.flipUV_V(_uvzw[1]))
-
-                    t = len(v.groups)
-                    if t == 0:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF1
-                        weight.bones = [0]
-                        pv.weight = weight
-                    elif t == 1:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF1
-                        weight.bones = [v.groups[0][0]]
-                        pv.weight = weight
-                    elif t == 2:
-                        vg1, vg2 = v.groups
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF2
-                        weight.bones = [vg1[0], vg2[0]]
-                        w1, w2 = vg1[1], vg2[1]
-                        weight.weights = [w1 / (w1 + w2)]
-                        if v.sdef_data:
-                            weight.type = pmx.BoneWeight.SDEF
-                            sdef_weights = pmx.BoneWeightSDEF()
-                            sdef_weights.weight = weight.weights[0]
-                            sdef_weights.c, sdef_weights.r0, sdef_weights.r1 = v.sdef_data
-                            if weight.bones[0] > weight.bones[1]:
-                                weight.bones.reverse()
-                                sdef_weights.weight = 1.0 - sdef_weights.weight
-                            weight.weights = sdef_weights
-                        pv.weight = weight
-                    else:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF4
-                        weight.bones = [0, 0, 0, 0]
-                        weight.weights = [0.0, 0.0, 0.0, 0.0]
-                        w_all = 0.0
-                        if t > 4:
-                            v.groups.sort(key=lambda x: -x[1])
-                        for i in range(min(t, 4)):
-                            gn, w = v.groups[i]
-                            weight.bones[i] = gn
-                            weight.weights[i] = w
-                            w_all += w
-                        for i in range(4):
-                            weight.weights[i] /= w_all
-                        pv.weight = weight
-                    self.__model.vertices.append(pv)
-                    self.__exported_vertices.append(v)
-
-                for face in mat_faces:
-                    self.__model.faces.append([x.index for x in face.vertices])
-                face_count += len(mat_faces)
-            self.__exportMaterial(bpy.data.materials[mat_name], face_count)
-
-        if sort_vertices:
-            self.__sortVertices()
+        if self.__vertex_order_map is not None:
+            self.__sortVertices(meshes, np.concatenate([mesh.vertex_orders for mesh in meshes] or [np.zeros((0, 3))])[self.__vertex_sources])
+
+        if not self.__streaming:  # otherwise the vertices are gathered from the meshes while they are written
+            self.__model.setVertexData(self.__takeVertexData())
+            self.__mesh_vertex_data = None
 
     def __exportTexture(self, filepath):
         if filepath.strip() == "":
@@ -608,17 +846,30 @@ class __PmxExporter:
                 morph_categories[vtx_morph.name] = categories.get(vtx_morph.category, pmx.Morph.CATEGORY_OHTER)
             shape_key_names.sort(key=lambda x: root.mmd_root.vertex_morphs.find(x))
 
+        morphs = []
         for i in shape_key_names:
             morph = pmx.VertexMorph(name=i, name_e=morph_english_names.get(i, ""), category=morph_categories.get(i, pmx.Morph.CATEGORY_OHTER))
             self.__model.morphs.append(morph)
+            morphs.append(morph)
 
-        append_table = dict(zip(shape_key_names, [m.offsets.append for m in self.__model.morphs]))
-        for v in self.__exported_vertices:
-            for i, offset in v.offsets.items():
-                mo = pmx.VertexMorphOffset()
-                mo.index = v.index
-                mo.offset = offset
-                append_table[i](mo)
+        # the offsets of the mesh vertices are mapped to the exported vertices by __setVertexMorphOffsets()
+        self.__vertex_morph_offsets = {i: [] for i in shape_key_names}
+        for mesh in meshes:
+            for i, (split, offsets) in zip(mesh.shape_key_names, mesh.shape_key_offsets):
+                self.__vertex_morph_offsets[i].append((mesh.exported, split, offsets))
+
+        if not self.__streaming:  # otherwise the offsets are set when the morphs are written
+            for morph in morphs:
+                self.__setVertexMorphOffsets(morph)
+
+    def __setVertexMorphOffsets(self, morph):
+        parts = self.__vertex_morph_offsets.pop(morph.name)
+        indices = np.concatenate([exported[split] for exported, split, _ in parts] or [np.zeros(0, dtype=np.int64)])
+        order = np.argsort(indices, kind="stable")
+        data = np.zeros(len(indices), dtype=[("index", np.int64), ("offset", np.float32, 3)])
+        data["index"] = indices[order]
+        data["offset"] = np.concatenate([offsets for _, _, offsets in parts] or [np.zeros((0, 3), dtype=np.float32)])[order]
+        morph.setOffsetData(data)
 
     def __export_material_morphs(self, root):
         mmd_root = root.mmd_root
@@ -658,12 +909,13 @@ class __PmxExporter:
         かなりいいかげんな実装
         """
         center = mathutils.Vector([0, 0, 0])
-        vertices = self.__model.vertices
+        vertices = self.__exportedCo().tolist()
         vert_num = len(vertices)
-        for v in self.__model.vertices:
-            center += mathutils.Vector(v.co) / vert_num
+        for v in vertices:
+            center += mathutils.Vector(v) / vert_num
 
-        faces = self.__model.faces
+        face_data = self.__model.face_data
+        faces = face_data.tolist()
         offset = 0
         distances = []
         for mat, bl_mat_name in zip(self.__model.materials, self.__material_name_table):
@@ -671,20 +923,20 @@ class __PmxExporter:
             face_num = int(mat.vertex_count / 3)
             for i in range(offset, offset + face_num):
                 face = faces[i]
-                d += (mathutils.Vector(vertices[face[0]].co) - center).length
-                d += (mathutils.Vector(vertices[face[1]].co) - center).length
-                d += (mathutils.Vector(vertices[face[2]].co) - center).length
+                d += (mathutils.Vector(vertices[face[0]]) - center).length
+                d += (mathutils.Vector(vertices[face[1]]) - center).length
+                d += (mathutils.Vector(vertices[face[2]]) - center).length
             distances.append((d / mat.vertex_count, mat, offset, face_num, bl_mat_name))
             offset += face_num
         sorted_faces = []
         sorted_mat = []
         self.__material_name_table.clear()
         for d, mat, offset, vert_count, bl_mat_name in sorted(distances, key=lambda x: x[0]):
-            sorted_faces.extend(faces[offset : offset + vert_count])
+            sorted_faces.append(face_data[offset : offset + vert_count])
             sorted_mat.append(mat)
             self.__material_name_table.append(bl_mat_name)
         self.__model.materials = sorted_mat
-        self.__model.faces = sorted_faces
+        self.__model.setFaceData(np.concatenate(sorted_faces or [face_data]))
 
     def __export_bone_morphs(self, root):
         if self.__overwrite_bone_morphs_from_pose_library:
@@ -736,34 +988,40 @@ class __PmxExporter:
                 bone_morph.offsets.append(morph_data)
             self.__model.morphs.append(bone_morph)
 
-    def __export_uv_morphs(self, root):
+    def __export_uv_morphs(self, root, meshes):
         mmd_root = root.mmd_root
         if len(mmd_root.uv_morphs) == 0:
             return
         categories = self.CATEGORIES
-        append_table_vg = {}
+        uv_morph_table_vg = {}
         for morph in mmd_root.uv_morphs:
             uv_morph = pmx.UVMorph(name=morph.name, name_e=morph.name_e, category=categories.get(morph.category, pmx.Morph.CATEGORY_OHTER))
             uv_morph.uv_index = morph.uv_index
             self.__model.morphs.append(uv_morph)
             if morph.data_type == "VERTEX_GROUP":
-                append_table_vg[morph.name] = uv_morph.offsets.append
+                uv_morph_table_vg[morph.name] = uv_morph
                 continue
             logging.warning(' * Deprecated UV morph "%s", please convert it to vertex groups', morph.name)
 
-        if append_table_vg:
+        if uv_morph_table_vg:
             incompleted = set()
-            uv_morphs = mmd_root.uv_morphs
-            for v in self.__exported_vertices:
-                for name, offset in v.uv_offsets.items():
-                    if name not in append_table_vg:
+            offset_table = {}
+            for mesh in meshes:
+                for name, (split, offsets) in mesh.uv_offsets.items():
+                    if name not in uv_morph_table_vg:
                         incompleted.add(name)
                         continue
-                    scale = uv_morphs[name].vertex_group_scale
-                    morph_data = pmx.UVMorphOffset()
-                    morph_data.index = v.index
-                    morph_data.offset = (offset[0] * scale, -offset[1] * scale, offset[2] * scale, -offset[3] * scale)
-                    append_table_vg[name](morph_data)
+                    offset_table.setdefault(name, []).append((mesh.exported[split], offsets))
+
+            uv_morphs = mmd_root.uv_morphs
+            for name, parts in offset_table.items():
+                scale = uv_morphs[name].vertex_group_scale
+                indices = np.concatenate([x[0] for x in parts])
+                order = np.argsort(indices, kind="stable")
+                data = np.zeros(len(indices), dtype=[("index", np.int64), ("offset", np.float32, 4)])
+                data["index"] = indices[order]
+                data["offset"] = np.concatenate([x[1] for x in parts])[order] * (scale, -scale, scale, -scale)
+                uv_morph_table_vg[name].setOffsetData(data)
 
             if incompleted:
                 logging.warning(" * Incompleted UV morphs %s with vertex groups", incompleted)
@@ -901,39 +1159,6 @@ class __PmxExporter:
             p_joint.spring_rotation_constant = Vector(mmd_joint.spring_angular).xzy
             self.__model.joints.append(p_joint)
 
-    @staticmethod
-    def __convertFaceUVToVertexUV(vert_index, uv, normal, vertices_map):
-        vertices = vertices_map[vert_index]
-        for i in vertices:
-            if i.uv is None:
-                i.uv = uv
-                i.normal = normal
-                return i
-            elif (i.uv - uv).length < 0.001 and (normal - i.normal).length < 0.01:
-                return i
-        n = copy.copy(i)  # shallow copy should be fine
-        n.uv = uv
-        n.normal = normal
-        vertices.append(n)
-        return n
-
-    @staticmethod
-    def __convertAddUV(vert, adduv, addzw, uv_index, vertices, rip_vertices):
-        if vert.add_uvs[uv_index] is None:
-            vert.add_uvs[uv_index] = (adduv, addzw)
-            return vert
-        for i in rip_vertices:
-            uvzw = i.add_uvs[uv_index]
-            if (uvzw[0] - adduv).length < 0.001 and (uvzw[1] - addzw).length < 0.001:
-                return i
-        n = copy.copy(vert)
-        add_uvs = n.add_uvs.copy()
-        add_uvs[uv_index] = (adduv, addzw)
-        n.add_uvs = add_uvs
-        vertices.append(n)
-        rip_vertices.append(n)
-        return n
-
     @staticmethod
     def __triangulate(mesh, custom_normals):
         bm = bmesh.new()
@@ -957,13 +1182,15 @@ class __PmxExporter:
         else:
             face_map = bmesh.ops.triangulate(bm, faces=bm.faces, quad_method="FIXED", ngon_method="EAR_CLIP")["face_map"]
             logging.debug(" - Remapping custom normals...")
-            loop_normals, face_indices = [], []
+            loop_ids, face_indices = [], []
             for f in bm.faces:
                 f_orig = face_map.get(f, f)
                 face_indices.append(f_orig.index)
                 vert_to_loop_id = face_verts_to_loop_id_map[f_orig]
                 for v in f.verts:
-                    loop_normals.append(custom_normals[vert_to_loop_id[v]])
+                    loop_ids.append(vert_to_loop_id[v])
+            loop_normals = custom_normals[np.array(loop_ids, dtype=np.int64)]
+            face_indices = np.array(face_indices, dtype=np.int64)
             logging.debug("   - Done (faces:%d)", len(bm.faces))
             bm.to_mesh(mesh)
             face_map.clear()
@@ -975,22 +1202,20 @@ class __PmxExporter:
 
     @staticmethod
     def __get_normals(mesh, matrix):
-        custom_normals = None
+        loop_count, face_count = len(mesh.loops), len(mesh.polygons)
         if hasattr(mesh, "has_custom_normals"):
             logging.debug(" - Calculating normals split...")
-            custom_normals = [(matrix @ l.normal).normalized() for l in mesh.loops]
+            normals = _foreach_get(mesh.loops, "normal", loop_count, 3)
         else:
             logging.debug(" - Calculating normals...")
-            custom_normals = []
-            for f in mesh.polygons:
-                if f.use_smooth:
-                    for v in f.vertices:
-                        custom_normals.append((matrix @ mesh.vertices[v].normal).normalized())
-                else:
-                    for v in f.vertices:
-                        custom_normals.append((matrix @ f.normal).normalized())
-        logging.debug("   - Done (polygons:%d)", len(mesh.polygons))
-        return custom_normals
+            loop_vertices = _foreach_get(mesh.loops, "vertex_index", loop_count, dtype=np.int32)
+            loop_totals = _foreach_get(mesh.polygons, "loop_total", face_count, dtype=np.int32)
+            use_smooth = np.repeat(_foreach_get(mesh.polygons, "use_smooth", face_count, dtype=bool), loop_totals)
+            vertex_normals = _foreach_get(mesh.vertices, "normal", len(mesh.vertices), 3)[loop_vertices]
+            face_normals = np.repeat(_foreach_get(mesh.polygons, "normal", face_count, 3), loop_totals, axis=0)
+            normals = np.where(use_smooth[:, None], vertex_normals, face_normals)
+        logging.debug("   - Done (polygons:%d)", face_count)
+        return _normalized(normals @ np.array(matrix, dtype=np.float32).T)
 
     def __doLoadMeshData(self, meshObj, bone_map):
         vg_to_bone = {i: bone_map[x.name] for i, x in enumerate(meshObj.vertex_groups) if x.name in bone_map}
@@ -1013,94 +1238,43 @@ class __PmxExporter:
 
         _to_mesh_clear = lambda obj, mesh: obj.to_mesh_clear()
 
+        data = _MeshArrays(meshObj.name)
         base_mesh = _to_mesh(meshObj)
-        loop_normals, face_indices = self.__triangulate(base_mesh, self.__get_normals(base_mesh, normal_matrix))
+        data.loop_normals, data.face_indices = self.__triangulate(base_mesh, self.__get_normals(base_mesh, normal_matrix))
         base_mesh.transform(pmx_matrix)
-
-        def _get_weight(vertex_group_index, vertex, default_weight):
-            for i in vertex.groups:
-                if i.group == vertex_group_index:
-                    return i.weight
-            return default_weight
-
-        get_edge_scale = None
+        data.reverse_faces = not pmx_matrix.is_negative
+
+        vertex_count, loop_count, face_count = len(base_mesh.vertices), len(base_mesh.loops), len(base_mesh.polygons)
+        if np.any(_foreach_get(base_mesh.polygons, "loop_total", face_count, dtype=np.int32) != 3):
+            raise Exception
+        data.co = base_co = _foreach_get(base_mesh.vertices, "co", vertex_count, 3)
+        data.loop_vertices = _foreach_get(base_mesh.loops, "vertex_index", loop_count, dtype=np.int32)
+        data.material_indices = _foreach_get(base_mesh.polygons, "material_index", face_count, dtype=np.int32)
+
+        # the entries of the sparse weight matrix, read in a single pass over the vertex groups
+        data.weight_table = np.fromiter(
+            ((i, g.group, g.weight) for i, v in enumerate(base_mesh.vertices) for g in v.groups),
+            dtype=[("vertex", np.int32), ("group", np.int32), ("weight", np.float32)],
+        )
+        data.group_bones = np.full(max(len(meshObj.vertex_groups), data.weight_table["group"].max(initial=-1) + 1), -1, dtype=np.int64)
+        for i, bone_index in vg_to_bone.items():
+            data.group_bones[i] = bone_index
         if vg_edge_scale:
-            get_edge_scale = lambda x: _get_weight(vg_edge_scale.index, x, 1)
-        else:
-            get_edge_scale = lambda x: 1
-
-        get_vertex_order = None
+            data.edge_scale_group = vg_edge_scale.index
         if self.__vertex_order_map:  # sort vertices
             mesh_id = self.__vertex_order_map.setdefault("mesh_id", 0)
             self.__vertex_order_map["mesh_id"] += 1
-            if vg_vertex_order and self.__vertex_order_map["method"] == "CUSTOM":
-                get_vertex_order = lambda x: (mesh_id, _get_weight(vg_vertex_order.index, x, 2), x.index)
-            else:
-                get_vertex_order = lambda x: (mesh_id, x.index)
-        else:
-            get_vertex_order = lambda x: None
-
-        uv_morph_names = {g.index: (n, x) for g, n, x in FnMorph.get_uv_morph_vertex_groups(meshObj)}
-
-        def get_uv_offsets(v):
-            uv_offsets = {}
-            for x in v.groups:
-                if x.group in uv_morph_names and x.weight > 0:
-                    name, axis = uv_morph_names[x.group]
-                    d = uv_offsets.setdefault(name, [0, 0, 0, 0])
-                    d["XYZW".index(axis[1])] += -x.weight if axis[0] == "-" else x.weight
-            return uv_offsets
-
-        base_vertices = {}
-        for v in base_mesh.vertices:
-            base_vertices[v.index] = [
-                _Vertex(
-                    v.co.copy(),
-                    [(vg_to_bone[x.group], x.weight) for x in v.groups if x.weight > 0 and x.group in vg_to_bone],
-                    {},
-                    get_edge_scale(v),
-                    get_vertex_order(v),
-                    get_uv_offsets(v),
-                )
-            ]
+            use_vertex_group = vg_vertex_order and self.__vertex_order_map["method"] == "CUSTOM"
+            data.vertex_order = (mesh_id, vg_vertex_order.index if use_vertex_group else -1)
+        data.uv_morph_groups = {g.index: (n, x) for g, n, x in FnMorph.get_uv_morph_vertex_groups(meshObj)}
 
         # load face data
-        class _DummyUV:
-            uv1 = uv2 = uv3 = mathutils.Vector((0, 1))
-
-            def __init__(self, uvs):
-                self.uv1, self.uv2, self.uv3 = (v.uv.copy() for v in uvs)
-
-        _UVWrapper = lambda x: (_DummyUV(x[i : i + 3]) for i in range(0, len(x), 3))
+        def _get_uvs(uv_layer):
+            if uv_layer is None:
+                return np.tile(np.array((0, 1), dtype=np.float32), (loop_count, 1))
+            return _foreach_get(uv_layer.data, "uv", loop_count, 2)
 
-        material_faces = {}
-        uv_data = base_mesh.uv_layers.active
-        if uv_data:
-            uv_data = _UVWrapper(uv_data.data)
-        else:
-            uv_data = iter(lambda: _DummyUV, None)
-        face_seq = []
-        for face, uv, face_index in zip(base_mesh.polygons, uv_data, face_indices or iter(lambda: -1, None)):
-            if len(face.vertices) != 3:
-                raise Exception
-            idx = face.index * 3
-            n1, n2, n3 = loop_normals[idx : idx + 3]
-            v1 = self.__convertFaceUVToVertexUV(face.vertices[0], uv.uv1, n1, base_vertices)
-            v2 = self.__convertFaceUVToVertexUV(face.vertices[1], uv.uv2, n2, base_vertices)
-            v3 = self.__convertFaceUVToVertexUV(face.vertices[2], uv.uv3, n3, base_vertices)
-
-            t = _Face([v1, v2, v3], face_index)
-            face_seq.append(t)
-            if face.material_index not in material_faces:
-                material_faces[face.material_index] = []
-            material_faces[face.material_index].append(t)
-
-        if face_indices:
-            for f in material_faces.values():
-                f.sort(key=lambda x: x.index)
-        _mat_name = lambda x: x.name if x else self.__getDefaultMaterial().name
-        material_names = {i: _mat_name(m) for i, m in enumerate(base_mesh.materials)}
-        material_names = {i: material_names.get(i, None) or _mat_name(None) for i in material_faces.keys()}
+        data.loop_uvs = _get_uvs(base_mesh.uv_layers.active)
 
         # export add UV
         bl_add_uvs = [i for i in base_mesh.uv_layers[1:] if not i.name.startswith("_")]
@@ -1109,41 +1283,31 @@ class __PmxExporter:
             if uv_n > 3:
                 logging.warning(" * extra addUV%d+ are not supported", uv_n + 1)
                 break
-            uv_data = _UVWrapper(uv_tex.data)
             zw_data = base_mesh.uv_layers.get("_" + uv_tex.name, None)
             logging.info(" # exporting addUV%d: %s [zw: %s]", uv_n + 1, uv_tex.name, zw_data)
-            if zw_data:
-                zw_data = _UVWrapper(zw_data.data)
-            else:
-                zw_data = iter(lambda: _DummyUV, None)
-            rip_vertices_map = {}
-            for f, face, uv, zw in zip(face_seq, base_mesh.polygons, uv_data, zw_data):
-                vertices = [base_vertices[x] for x in face.vertices]
-                rip_vertices = [rip_vertices_map.setdefault(x, [x]) for x in f.vertices]
-                f.vertices[0] = self.__convertAddUV(f.vertices[0], uv.uv1, zw.uv1, uv_n, vertices[0], rip_vertices[0])
-                f.vertices[1] = self.__convertAddUV(f.vertices[1], uv.uv2, zw.uv2, uv_n, vertices[1], rip_vertices[1])
-                f.vertices[2] = self.__convertAddUV(f.vertices[2], uv.uv3, zw.uv3, uv_n, vertices[2], rip_vertices[2])
+            data.loop_add_uvs.append((_get_uvs(uv_tex), _get_uvs(zw_data)))
+
+        _mat_name = lambda x: x.name if x else self.__getDefaultMaterial().name
+        material_names = {i: _mat_name(m) for i, m in enumerate(base_mesh.materials)}
+        data.material_names = {i: material_names.get(i, None) or _mat_name(None) for i in np.unique(data.material_indices).tolist()}
 
         _to_mesh_clear(meshObj, base_mesh)
 
         # calculate offsets
-        shape_key_list = []
+        shape_key_list, sdef_key_list = [], []
         if meshObj.data.shape_keys:
             for i, kb in enumerate(meshObj.data.shape_keys.key_blocks):
                 if i == 0:  # Basis
                     continue
                 if kb.name.startswith("mmd_bind") or kb.name == FnSDEF.SHAPEKEY_NAME:
                     continue
-                if kb.name == "mmd_sdef_c":  # make sure 'mmd_sdef_c' is at first
-                    shape_key_list = [(i, kb)] + shape_key_list
+                if kb.name in {"mmd_sdef_c", "mmd_sdef_r0", "mmd_sdef_r1"}:
+                    sdef_key_list.append((i, kb))
                 else:
                     shape_key_list.append((i, kb))
 
-        shape_key_names = []
-        sdef_counts = 0
-        for i, kb in shape_key_list:
-            shape_key_name = kb.name
-            logging.info(" - processing shape key: %s", shape_key_name)
+        def _load_shape_key(i, kb, co):
+            logging.info(" - processing shape key: %s", kb.name)
             kb_mute, kb.mute = kb.mute, False
             kb_value, kb.value = kb.value, 1.0
             meshObj.active_shape_key_index = i
@@ -1151,44 +1315,37 @@ class __PmxExporter:
             mesh.transform(pmx_matrix)
             kb.mute = kb_mute
             kb.value = kb_value
-            if len(mesh.vertices) != len(base_vertices):
-                logging.warning("   * Error! vertex count mismatch!")
-                continue
-            if shape_key_name in {"mmd_sdef_c", "mmd_sdef_r0", "mmd_sdef_r1"}:
-                if shape_key_name == "mmd_sdef_c":
-                    for v in mesh.vertices:
-                        base = base_vertices[v.index][0]
-                        if len(base.groups) != 2:
-                            continue
-                        base_co = base.co
-                        c_co = v.co
-                        if (c_co - base_co).length < 0.001:
-                            continue
-                        base.sdef_data[:] = tuple(c_co), base_co, base_co
-                        sdef_counts += 1
-                    logging.info("   - Restored %d SDEF vertices", sdef_counts)
-                elif sdef_counts > 0:
-                    ri = 1 if shape_key_name == "mmd_sdef_r0" else 2
-                    for v in mesh.vertices:
-                        sdef_data = base_vertices[v.index][0].sdef_data
-                        if sdef_data:
-                            sdef_data[ri] = tuple(v.co)
-                    logging.info("   - Updated SDEF data")
+            loaded = len(mesh.vertices) == vertex_count
+            if loaded:
+                mesh.vertices.foreach_get("co", co.reshape(-1))
             else:
-                shape_key_names.append(shape_key_name)
-                for v in mesh.vertices:
-                    base = base_vertices[v.index][0]
-                    offset = v.co - base.co
-                    if offset.length < 0.001:
-                        continue
-                    base.offsets[shape_key_name] = offset
+                logging.warning("   * Error! vertex count mismatch!")
             _to_mesh_clear(meshObj, mesh)
-
-        if not pmx_matrix.is_negative:  # pmx.load/pmx.save reverse face vertices by default
-            for f in face_seq:
-                f.vertices.reverse()
-
-        return _Mesh(material_faces, shape_key_names, material_names)
+            return loaded
+
+        for i, kb in sdef_key_list:
+            co = np.empty((vertex_count, 3), dtype=np.float32)
+            if _load_shape_key(i, kb, co):
+                data.sdef_keys[kb.name] = co
+
+        # the deltas of a chunk of shape keys are thresholded at once into sparse offsets
+        chunk_size = max(1, self.__shape_key_chunk_size)
+        for start in range(0, len(shape_key_list), chunk_size):
+            chunk = shape_key_list[start : start + chunk_size]
+            deltas = np.empty((len(chunk), vertex_count, 3), dtype=np.float32)
+            loaded = np.array([_load_shape_key(i, kb, key_co) for (i, kb), key_co in zip(chunk, deltas)], dtype=bool)
+            deltas -= base_co
+            deltas[~loaded] = 0
+            keys, rows = np.nonzero(~(np.einsum("kvi,kvi->kv", deltas, deltas) < 1e-6))
+            offsets = deltas[keys, rows]
+            bounds = np.searchsorted(keys, np.arange(len(chunk) + 1))
+            for j, (i, kb) in enumerate(chunk):
+                if loaded[j]:
+                    data.shape_key_names.append(kb.name)
+                    data.shape_key_offsets.append((rows[bounds[j] : bounds[j + 1]], offsets[bounds[j] : bounds[j + 1]]))
+            del deltas
+
+        return data
 
     def __loadMeshData(self, meshObj, bone_map):
         show_only_shape_key = meshObj.show_only_shape_key
@@ -1217,6 +1374,55 @@ class __PmxExporter:
             for m, show in muted_modifiers:
                 m.show_viewport = show
 
+    def __loadMeshes(self, meshes, bone_map):
+        """Load the meshes, the Blender data is read here and the arrays are processed on worker threads."""
+        mesh_arrays = [self.__loadMeshData(i, bone_map) for i in meshes]
+        workers = min(max(1, self.__mesh_workers), len(mesh_arrays))
+        if workers < 2:
+            return [_process_mesh(data) for data in mesh_arrays]
+        logging.info(" - Processing %d meshes on %d threads", len(mesh_arrays), workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_process_mesh, mesh_arrays))
+
+    def __saveStreaming(self, filepath):
+        """Write the model one section at a time.
+
+        The header needs the final counts of all sections, so every mesh is processed before the
+        file is written. From there on, the vertex section is gathered from the vertex data of the
+        meshes in chunks of VERTEX_CHUNK_SIZE vertices (it never exists as a whole), the vertex and
+        face data are released as soon as they are written, and the offsets of each vertex morph are
+        only built while it is written.
+        """
+        model = self.__model
+        vertex_count = len(self.__vertex_sources)
+
+        def _vertex_chunks():
+            for start in range(0, vertex_count, self.VERTEX_CHUNK_SIZE):
+                yield self.__takeVertexData(slice(start, start + self.VERTEX_CHUNK_SIZE))
+
+        def _morphs():
+            for morph in model.morphs:
+                if not isinstance(morph, pmx.VertexMorph) or morph.name not in self.__vertex_morph_offsets:
+                    yield morph
+                    continue
+                self.__setVertexMorphOffsets(morph)
+                yield morph
+                morph.offsets = []
+
+        with pmx.openWriter(filepath, model, add_uv_count=self.__add_uv_count, vertex_count=vertex_count) as writer:
+            writer.writeInfo(model)
+            writer.writeVertexChunks(vertex_count, _vertex_chunks())
+            self.__mesh_vertex_data = self.__vertex_sources = None
+            writer.writeFaces(model.faces)
+            model.faces = []
+            writer.writeItems("textures", model.textures)
+            writer.writeItems("materials", model.materials)
+            writer.writeItems("bones", model.bones)
+            writer.writeItems("morphs", _morphs(), count=len(model.morphs))
+            writer.writeItems("display items", model.display)
+            writer.writeItems("rigid bodies", model.rigids)
+            writer.writeItems("joints", model.joints)
+
     def __translate_armature(self, root_object: bpy.types.Object):
         FnTranslations.clear_data(root_object.mmd_root.translation)
         FnTranslations.collect_data(root_object.mmd_root.translation)
@@ -1250,6 +1456,9 @@ class __PmxExporter:
 
         self.__scale = args.get("scale", 1.0)
         self.__disable_specular = args.get("disable_specular", False)
+        self.__shape_key_chunk_size = args.get("shape_key_chunk_size", 16)
+        self.__mesh_workers = args.get("mesh_workers", 1)
+        self.__streaming = args.get("streaming", False)
         sort_vertices = args.get("sort_vertices", "NONE")
         if sort_vertices != "NONE":
             self.__vertex_order_map = {"method": sort_vertices}
@@ -1262,7 +1471,7 @@ class __PmxExporter:
 
         nameMap = self.__exportBones(root, meshes)
 
-        mesh_data = [self.__loadMeshData(i, nameMap) for i in meshes]
+        mesh_data = self.__loadMeshes(meshes, nameMap)
         self.__exportMeshes(mesh_data, nameMap)
         if args.get("sort_materials", False):
             self.__sortMaterials()
@@ -1271,9 +1480,10 @@ class __PmxExporter:
         if root is not None:
             self.__export_bone_morphs(root)
             self.__export_material_morphs(root)
-            self.__export_uv_morphs(root)
+            self.__export_uv_morphs(root, mesh_data)
             self.__export_group_morphs(root)
             self.__exportDisplayItems(root, nameMap)
+        del mesh_data  # only the morph offsets that are not written yet are kept
 
         rigid_map = self.__exportRigidBodies(rigids, nameMap)
         self.__exportJoints(joints, rigid_map)
@@ -1284,7 +1494,10 @@ class __PmxExporter:
             base_folder = bpyutils.addon_preferences("base_texture_folder", "")
             self.__copy_textures(output_dir, import_folder or base_folder)
 
-        pmx.save(filepath, self.__model, add_uv_count=self.__add_uv_count)
+        if self.__streaming:
+            self.__saveStreaming(filepath)
+        else:
+            pmx.save(filepath, self.__model, add_uv_count=self.__add_uv_count)
 
 
 def export(filepath, **kwargs):
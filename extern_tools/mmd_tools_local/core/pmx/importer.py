@@ -6,16 +6,20 @@ import collections
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import bpy
+import numpy as np
 from mathutils import Matrix, Vector
 
 from mmd_tools_local import bpyutils, utils
 from mmd_tools_local.core import pmx
+from mmd_tools_local.core.pmx import cache as pmx_cache
 from mmd_tools_local.core.bone import FnBone
-from mmd_tools_local.core.material import FnMaterial
+from mmd_tools_local.core.material import FnMaterial, TexturePrefetcher
 from mmd_tools_local.core.model import FnModel, Model
 from mmd_tools_local.core.morph import FnMorph
+from mmd_tools_local.core.profiler import PhaseProfiler
 from mmd_tools_local.core.vmd.importer import BoneConverter
 from mmd_tools_local.operators.display_item import DisplayItemQuickSetup
 from mmd_tools_local.operators.misc import MoveObject
@@ -39,6 +43,8 @@ class PMXImporter:
         7: "uv_morphs",
         8: "material_morphs",
     }
+    # the shape key coordinates of the vertex morphs are prepared in batches of about this many vertices
+    VERTEX_MORPH_BATCH_VERTICES = 1 << 20
 
     def __init__(self):
         self.__model = None
@@ -52,15 +58,19 @@ class PMXImporter:
 
         self.__vertexGroupTable = None
         self.__textureTable = None
+        self.__texturePrefetcher = None
         self.__rigidTable = None
 
         self.__boneTable = []
         self.__materialTable = []
         self.__imageTable = {}
 
-        self.__sdefVertices = {}  # pmx vertices
+        self.__sdefVertices = None  # (vertex indices, C, R0, R1) of SDEF vertices
         self.__blender_ik_links = set()
         self.__vertex_map = None
+        self.__loopIndicesOrig = None  # pmx vertex index of each loop
+        self.__loopIndices = None  # mesh vertex index of each loop
+        self.__vertexDataCache = None
 
         self.__materialFaceCountTable = None
 
@@ -73,6 +83,12 @@ class PMXImporter:
         u, v = uv
         return u, 1.0 - v
 
+    @staticmethod
+    def __flipUV_V_array(uv):
+        uv = np.array(uv, dtype=np.float32)
+        uv[:, 1] = 1.0 - uv[:, 1]
+        return uv
+
     def __createObjects(self):
         """Create main objects and link them to scene."""
         pmxModel = self.__model
@@ -110,71 +126,106 @@ class PMXImporter:
         vgroups = self.__meshObj.vertex_groups
         self.__vertexGroupTable = [vgroups.new(name=i.name) for i in self.__model.bones] or [vgroups.new(name="NO BONES")]
 
+    @staticmethod
+    def __addWeights(vertex_groups, groups, indices, weights):
+        """Add each vertex indices[i] to vertex_groups[groups[i]] with weights[i].
+
+        The vertices are added with one add() call per distinct (group, weight) pair.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        order = np.lexsort((weights, groups))
+        groups, weights = groups[order], weights[order]
+        starts = np.flatnonzero((np.diff(groups, prepend=-1) != 0) | (np.diff(weights, prepend=np.nan) != 0)).tolist()
+        indices = indices[order].tolist()
+        for start, end, group, weight in zip(starts, starts[1:] + [len(indices)], groups[starts].tolist(), weights[starts].tolist()):
+            vertex_groups[group].add(index=indices[start:end], weight=weight, type="REPLACE")
+
+    def __vertexData(self):
+        """Return the VertexData of the model, converting the vertex list once if it is not backed by arrays."""
+        if self.__vertexDataCache is None:
+            pmxModel = self.__model
+            self.__vertexDataCache = pmxModel.vertex_data
+            if self.__vertexDataCache is None:
+                self.__vertexDataCache = pmx.VertexData.fromVertices(pmxModel.vertices, getattr(pmxModel.header, "additional_uvs", 0))
+        return self.__vertexDataCache
+
     def __importVertices(self):
         self.__importVertexGroup()
 
-        pmxModel = self.__model
-        pmx_vertices = pmxModel.vertices
-        vertex_count = len(pmx_vertices)
+        vertex_data = self.__vertexData()
+        rows = np.arange(len(vertex_data))
         vertex_map = self.__vertex_map
         if vertex_map:
-            indices = collections.OrderedDict(vertex_map).keys()
-            pmx_vertices = tuple(pmxModel.vertices[x] for x in indices)
-            vertex_count = len(indices)
+            rows = np.fromiter(collections.OrderedDict(vertex_map).keys(), dtype=np.int64)
+        vertex_count = len(rows)
         if vertex_count < 1:
             return
 
         mesh = self.__meshObj.data
         mesh.vertices.add(count=vertex_count)
-        mesh.vertices.foreach_set("co", tuple(i for pv in pmx_vertices for i in (Vector(pv.co).xzy * self.__scale)))
+        mesh.vertices.foreach_set("co", (vertex_data.co[rows][:, [0, 2, 1]] * self.__scale).ravel())
 
-        vertex_group_table = self.__vertexGroupTable
+        vertex_indices = np.arange(vertex_count)
         vg_edge_scale = self.__meshObj.vertex_groups.new(name="mmd_edge_scale")
         vg_vertex_order = self.__meshObj.vertex_groups.new(name="mmd_vertex_order")
-        for i, pv in enumerate(pmx_vertices):
-            pv_bones, pv_weights, idx = pv.weight.bones, pv.weight.weights, (i,)
-
-            vg_edge_scale.add(index=idx, weight=pv.edge_scale, type="REPLACE")
-            vg_vertex_order.add(index=idx, weight=i / vertex_count, type="REPLACE")
-
-            if isinstance(pv_weights, pmx.BoneWeightSDEF):
-                if pv_bones[0] > pv_bones[1]:
-                    pv_bones.reverse()
-                    pv_weights.weight = 1.0 - pv_weights.weight
-                    pv_weights.r0, pv_weights.r1 = pv_weights.r1, pv_weights.r0
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights.weight, type="ADD")
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0 - pv_weights.weight, type="ADD")
-                self.__sdefVertices[i] = pv
-            elif len(pv_bones) == 1:
-                bone_index = pv_bones[0]
-                if bone_index >= 0:
-                    vertex_group_table[bone_index].add(index=idx, weight=1.0, type="ADD")
-            elif len(pv_bones) == 2:
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights[0], type="ADD")
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0 - pv_weights[0], type="ADD")
-            elif len(pv_bones) == 4:
-                for bone, weight in zip(pv_bones, pv_weights):
-                    vertex_group_table[bone].add(index=idx, weight=weight, type="ADD")
-            else:
-                raise Exception("unkown bone weight type.")
+        self.__addWeights([vg_edge_scale, vg_vertex_order], np.repeat([0, 1], vertex_count), np.tile(vertex_indices, 2), np.append(vertex_data.edge_scale[rows], vertex_indices / vertex_count))
+
+        weight_type = vertex_data.weight_type[rows]
+        if len(weight_type) and weight_type.max() > pmx.BoneWeight.SDEF:
+            raise Exception("unkown bone weight type.")
+        bones = vertex_data.bones[rows]
+        weights = vertex_data.weights[rows]
+
+        # SDEF vertices are stored with sorted bones, so (w, 1-w) and R0/R1 are swapped with them
+        sdef = np.flatnonzero(weight_type == pmx.BoneWeight.SDEF)
+        swap = sdef[bones[sdef, 0] > bones[sdef, 1]]
+        bones[swap, :2] = bones[swap, 1::-1]
+        weights[swap, :2] = weights[swap, 1::-1]
+        if len(sdef):
+            sdef_r0, sdef_r1 = vertex_data.sdef_r0[rows[sdef]], vertex_data.sdef_r1[rows[sdef]]
+            is_swapped = np.isin(sdef, swap)
+            sdef_r0[is_swapped], sdef_r1[is_swapped] = sdef_r1[is_swapped], sdef_r0[is_swapped].copy()
+            self.__sdefVertices = (sdef, vertex_data.sdef_c[rows[sdef]], sdef_r0, sdef_r1)
+
+        # one (vertex, bone, weight) entry per bone slot of the weight type: BDEF1, BDEF2, BDEF4, SDEF
+        slot_counts = np.array([1, 2, 4, 2])[weight_type]
+        vertex_index = np.repeat(vertex_indices, slot_counts)
+        slot = np.arange(len(vertex_index)) - np.repeat(np.cumsum(slot_counts) - slot_counts, slot_counts)
+        bone, weight = bones[vertex_index, slot], weights[vertex_index, slot].astype(np.float64)
+        used = (bone >= 0) | (weight_type[vertex_index] != pmx.BoneWeight.BDEF1)
+        vertex_index, bone, weight = vertex_index[used], bone[used], weight[used]
+
+        # the weights of a bone used twice by a vertex are added up like vertex_group.add(type="ADD")
+        vertex_group_table = self.__vertexGroupTable
+        group = np.where(bone < 0, bone + len(vertex_group_table), bone).astype(np.int64)
+        keys, inverse, counts = np.unique(vertex_index * len(vertex_group_table) + group, return_inverse=True, return_counts=True)
+        weight = np.bincount(inverse.ravel(), weights=weight, minlength=len(keys))
+        weight[counts > 1] = np.minimum(weight[counts > 1], 1.0)
+        vertex_index, group = np.divmod(keys, len(vertex_group_table))
+        self.__addWeights(vertex_group_table, group, vertex_index, weight)
 
         vg_edge_scale.lock_weight = True
         vg_vertex_order.lock_weight = True
 
     def __storeVerticesSDEF(self):
-        if len(self.__sdefVertices) < 1:
+        if self.__sdefVertices is None:
             return
 
         self.__createBasisShapeKey()
         sdefC = self.__meshObj.shape_key_add(name="mmd_sdef_c")
         sdefR0 = self.__meshObj.shape_key_add(name="mmd_sdef_r0")
         sdefR1 = self.__meshObj.shape_key_add(name="mmd_sdef_r1")
-        for i, pv in self.__sdefVertices.items():
-            w = pv.weight.weights
-            sdefC.data[i].co = Vector(w.c).xzy * self.__scale
-            sdefR0.data[i].co = Vector(w.r0).xzy * self.__scale
-            sdefR1.data[i].co = Vector(w.r1).xzy * self.__scale
-        logging.info("Stored %d SDEF vertices", len(self.__sdefVertices))
+        indices, c, r0, r1 = self.__sdefVertices
+
+        mesh = self.__meshObj.data
+        basis = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", basis)
+        basis = basis.reshape(-1, 3)
+        for shapeKey, vectors in ((sdefC, c), (sdefR0, r0), (sdefR1, r1)):
+            co = basis.copy()
+            co[indices] = vectors[:, [0, 2, 1]] * self.__scale
+            shapeKey.data.foreach_set("co", co.ravel())
+        logging.info("Stored %d SDEF vertices", len(indices))
 
     def __importTextures(self):
         pmxModel = self.__model
@@ -182,6 +233,7 @@ class PMXImporter:
         self.__textureTable = []
         for i in pmxModel.textures:
             self.__textureTable.append(bpy.path.resolve_ncase(path=i.path))
+        self.__texturePrefetcher = TexturePrefetcher(self.__textureTable, self.__texture_prefetch_workers)
 
     def __createEditBones(self, obj, pmx_bones):
         """create EditBones from pmx file data.
@@ -526,7 +578,7 @@ class PMXImporter:
         logging.debug("Finished importing joints in %f seconds.", time.time() - start_time)
 
     def __importMaterials(self):
-        self.__importTextures()
+        self.__texturePrefetcher.wait()
 
         pmxModel = self.__model
 
@@ -583,24 +635,28 @@ class PMXImporter:
         mesh = self.__meshObj.data
         vertex_map = self.__vertex_map
 
-        loop_indices_orig = tuple(i for f in pmxModel.faces for i in f)
-        loop_indices = tuple(vertex_map[i][1] for i in loop_indices_orig) if vertex_map else loop_indices_orig
-        material_indices = tuple(i for i, c in enumerate(self.__materialFaceCountTable) for x in range(c))
+        faces = pmxModel.face_data
+        if faces is None:
+            faces = np.array(pmxModel.faces, dtype=np.int32).reshape(-1, 3)
+        face_count = len(faces)
+        loop_indices_orig = faces.astype(np.int32).ravel()
+        loop_indices = np.array([x[1] for x in vertex_map], dtype=np.int32)[loop_indices_orig] if vertex_map else loop_indices_orig
+        material_indices = np.repeat(np.arange(len(self.__materialFaceCountTable), dtype=np.int32), self.__materialFaceCountTable)
 
-        mesh.loops.add(len(pmxModel.faces) * 3)
+        mesh.loops.add(face_count * 3)
         mesh.loops.foreach_set("vertex_index", loop_indices)
 
-        mesh.polygons.add(len(pmxModel.faces))
-        mesh.polygons.foreach_set("loop_start", tuple(range(0, len(mesh.loops), 3)))
-        mesh.polygons.foreach_set("loop_total", (3,) * len(pmxModel.faces))
-        mesh.polygons.foreach_set("use_smooth", (True,) * len(pmxModel.faces))
+        mesh.polygons.add(face_count)
+        mesh.polygons.foreach_set("loop_start", np.arange(0, face_count * 3, 3, dtype=np.int32))
+        mesh.polygons.foreach_set("loop_total", np.full(face_count, 3, dtype=np.int32))
+        mesh.polygons.foreach_set("use_smooth", np.ones(face_count, dtype=bool))
         mesh.polygons.foreach_set("material_index", material_indices)
 
         uv_textures, uv_layers = getattr(mesh, "uv_textures", mesh.uv_layers), mesh.uv_layers
         uv_tex = uv_textures.new()
         uv_layer = uv_layers[uv_tex.name]
-        uv_table = {vi: self.flipUV_V(v.uv) for vi, v in enumerate(pmxModel.vertices)}
-        uv_layer.data.foreach_set("uv", tuple(v for i in loop_indices_orig for v in uv_table[i]))
+        vertex_data = self.__vertexData()
+        uv_layer.data.foreach_set("uv", self.__flipUV_V_array(vertex_data.uv)[loop_indices_orig].ravel())
 
         if hasattr(mesh, "uv_textures"):
             for bf, mi in zip(uv_tex.data, material_indices):
@@ -609,68 +665,105 @@ class PMXImporter:
         if pmxModel.header and pmxModel.header.additional_uvs:
             logging.info("Importing %d additional uvs", pmxModel.header.additional_uvs)
             zw_data_map = collections.OrderedDict()
-            split_uvzw = lambda uvi: (self.flipUV_V(uvi[:2]), uvi[2:])
             for i in range(pmxModel.header.additional_uvs):
                 add_uv = uv_layers[uv_textures.new(name="UV" + str(i + 1)).name]
                 logging.info(" - %s...(uv channels)", add_uv.name)
-                uv_table = {vi: split_uvzw(v.additional_uvs[i]) for vi, v in enumerate(pmxModel.vertices)}
-                add_uv.data.foreach_set("uv", tuple(v for i in loop_indices_orig for v in uv_table[i][0]))
-                if not any(any(s[1]) for s in uv_table.values()):
+                uvzw = vertex_data.additional_uvs[:, i]
+                add_uv.data.foreach_set("uv", self.__flipUV_V_array(uvzw[:, :2])[loop_indices_orig].ravel())
+                if not np.any(uvzw[:, 2:]):
                     logging.info("\t- zw are all zeros: %s", add_uv.name)
                 else:
-                    zw_data_map["_" + add_uv.name] = {k: self.flipUV_V(v[1]) for k, v in uv_table.items()}
-            for name, zw_table in zw_data_map.items():
+                    zw_data_map["_" + add_uv.name] = self.__flipUV_V_array(uvzw[:, 2:])
+            for name, zw in zw_data_map.items():
                 logging.info(" - %s...(zw channels of %s)", name, name[1:])
                 add_zw = uv_textures.new(name=name)
                 if add_zw is None:
                     logging.warning("\t* Lost zw channels")
                     continue
                 add_zw = uv_layers[add_zw.name]
-                add_zw.data.foreach_set("uv", tuple(v for i in loop_indices_orig for v in zw_table[i]))
+                add_zw.data.foreach_set("uv", zw[loop_indices_orig].ravel())
 
+        self.__loopIndicesOrig, self.__loopIndices = loop_indices_orig, loop_indices
         self.__fixOverlappingFaceMaterials(mesh.materials, mesh.vertices, loop_indices, material_indices)
 
     def __fixOverlappingFaceMaterials(self, materials, vertices, loop_indices, material_indices):
         # FIXME: This is not the best way to setup blend_method, might just work for some common cases. And FnMaterial.update_alpha() is still using 'HASHED'.
         # For EEVEE, basically users should know which blend_method is best for each material of their models.
         # For Cycles, users have to offset or delete those z-fighting faces to fix it manually.
-        check = {}
-        mi_skip = -1
-        _vi_cache = {}
+        assert len(loop_indices) == len(material_indices) * 3
+        if len(material_indices) < 1:
+            return
 
-        def _rounded_co_vi(vi):
-            if vi not in _vi_cache:
-                vco = vertices[vi].co
-                _vi_cache[vi] = (round(vco[0], 6), round(vco[1], 6), round(vco[2], 6))
-            return _vi_cache[vi]
+        # faces are compared by their vertex coordinates rounded to 6 decimals, regardless of the vertex order.
+        # float32 * 1e6 is exact in float64, so rint() gives the same classes as round(co, 6)
+        co = np.empty(len(vertices) * 3, dtype=np.float32)
+        vertices.foreach_get("co", co)
+        rounded = np.rint(co.reshape(-1, 3).astype(np.float64) * 1e6).astype(np.int64)
+        vertex_keys = np.unique(rounded, axis=0, return_inverse=True)[1].ravel()
+        face_keys = np.ascontiguousarray(np.sort(vertex_keys[loop_indices].reshape(-1, 3), axis=1))
+        face_keys = face_keys.view([("v0", face_keys.dtype), ("v1", face_keys.dtype), ("v2", face_keys.dtype)]).ravel()
+        _, first_faces, keys = np.unique(face_keys, return_index=True, return_inverse=True)
+        keys = keys.ravel()
+        if not np.any(material_indices[first_faces[keys]] < material_indices):
+            return
 
-        assert len(loop_indices) == len(material_indices) * 3
-        for i, mi in enumerate(material_indices):
-            if mi <= mi_skip:
-                continue
-            si = 3 * i
-            verts = tuple(sorted((_rounded_co_vi(loop_indices[si]), _rounded_co_vi(loop_indices[si + 1]), _rounded_co_vi(loop_indices[si + 2]))))
-            if verts not in check:
-                check[verts] = mi
-            elif check[verts] < mi:
+        # faces of a material after its first overlapping face are not recorded, so replay the materials in order
+        seen = np.zeros(len(first_faces), dtype=bool)
+        bounds = np.flatnonzero(np.diff(material_indices)) + 1
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(material_indices)]):
+            material_keys = keys[start:stop]
+            overlapping = np.flatnonzero(seen[material_keys])
+            if len(overlapping):
+                mi = int(material_indices[start])
                 logging.debug(" >> fix blend method of material: %s", materials[mi].name)
                 materials[mi].blend_method = "BLEND"
                 materials[mi].show_transparent_back = False
-                mi_skip = mi
+                material_keys = material_keys[: overlapping[0]]
+            seen[material_keys] = True
+
+    @staticmethod
+    def __vertexMorphOffsets(morph):
+        data = morph.offset_data
+        if data is not None:
+            return data["index"].astype(np.int64), data["offset"]
+        return np.array([x.index for x in morph.offsets], dtype=np.int64), np.array([x.offset for x in morph.offsets], dtype=np.float32).reshape(-1, 3)
 
     def __importVertexMorphs(self):
         mmd_root = self.__root.mmd_root
         categories = self.CATEGORIES
         self.__createBasisShapeKey()
-        for morph in (x for x in self.__model.morphs if isinstance(x, pmx.VertexMorph)):
-            shapeKey = self.__meshObj.shape_key_add(name=morph.name)
-            vtx_morph = mmd_root.vertex_morphs.add()
-            vtx_morph.name = morph.name
-            vtx_morph.name_e = morph.name_e
-            vtx_morph.category = categories.get(morph.category, "OTHER")
-            for md in morph.offsets:
-                shapeKeyPoint = shapeKey.data[md.index]
-                shapeKeyPoint.co += Vector(md.offset).xzy * self.__scale
+        morphs = [x for x in self.__model.morphs if isinstance(x, pmx.VertexMorph)]
+        if len(morphs) < 1:
+            return
+
+        mesh = self.__meshObj.data
+        basis = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", basis)
+        basis = basis.reshape(-1, 3)
+        vertex_count = len(basis)
+        scale = self.__scale
+
+        def __shape_key_coordinates(batch):
+            co = np.tile(basis, (len(batch), 1))
+            indices, offsets = zip(*(self.__vertexMorphOffsets(m) for m in batch))
+            for index in indices:
+                if len(index) and (index.min() < 0 or index.max() >= vertex_count):
+                    raise IndexError("vertex morph offset index out of range")
+            indices = np.concatenate([index + i * vertex_count for i, index in enumerate(indices)])
+            np.add.at(co, indices, np.concatenate(offsets)[:, [0, 2, 1]] * scale)
+            return co.reshape(len(batch), -1)
+
+        batch_size = max(1, self.VERTEX_MORPH_BATCH_VERTICES // max(1, vertex_count))
+        batches = [morphs[i : i + batch_size] for i in range(0, len(morphs), batch_size)]
+        workers = min(len(batches) - 1, os.cpu_count() or 1) if self.__parallel_morphs else 0
+        for batch, coordinates in zip(batches, _imap_prefetched(__shape_key_coordinates, batches, workers)):
+            for morph, co in zip(batch, coordinates):
+                shapeKey = self.__meshObj.shape_key_add(name=morph.name)
+                vtx_morph = mmd_root.vertex_morphs.add()
+                vtx_morph.name = morph.name
+                vtx_morph.name_e = morph.name_e
+                vtx_morph.category = categories.get(morph.category, "OTHER")
+                shapeKey.data.foreach_set("co", co)
 
     def __importMaterialMorphs(self):
         mmd_root = self.__root.mmd_root
@@ -788,13 +881,22 @@ class PMXImporter:
             logging.info(" * No support for custom normals!!")
             return
         logging.info("Setting custom normals...")
+        # same float32 results as Vector.normalized(), tiny vectors become zero
+        normals = self.__vertexData().normal[:, [0, 2, 1]]
+        length_squared = np.square(normals, dtype=np.float64).sum(axis=1)
+        valid = length_squared > 1e-35
+        scale = np.float32(1.0) / np.sqrt(np.where(valid, length_squared, 1.0)).astype(np.float32)
+        normals = np.where(valid[:, None], normals * scale[:, None], np.float32(0.0))
         if self.__vertex_map:
-            verts, faces = self.__model.vertices, self.__model.faces
-            custom_normals = [(Vector(verts[i].normal).xzy).normalized() for f in faces for i in f]
-            mesh.normals_split_custom_set(custom_normals)
+            rows = np.fromiter(collections.OrderedDict(self.__vertex_map).keys(), dtype=np.int64)
+            loop_normals = normals[self.__loopIndicesOrig]
+            if self.__vertex_custom_normals and np.array_equal(loop_normals, normals[rows][self.__loopIndices]):
+                # every merged vertex has the same normal, no need to set them per loop
+                mesh.normals_split_custom_set_from_vertices(normals[rows])
+            else:
+                mesh.normals_split_custom_set(loop_normals)
         else:
-            custom_normals = [(Vector(v.normal).xzy).normalized() for v in self.__model.vertices]
-            mesh.normals_split_custom_set_from_vertices(custom_normals)
+            mesh.normals_split_custom_set_from_vertices(normals)
         logging.info("   - Done!!")
 
     def __renameLRBones(self, use_underscore):
@@ -815,12 +917,6 @@ class PMXImporter:
             used_names.add(m.name)
 
     def execute(self, **args):
-        if "pmx" in args:
-            self.__model = args["pmx"]
-        else:
-            self.__model = pmx.load(args["filepath"])
-        self.__fixRepeatedMorphName()
-
         types = args.get("types", set())
         clean_model = args.get("clean_model", False)
         remove_doubles = args.get("remove_doubles", False)
@@ -831,6 +927,9 @@ class PMXImporter:
         self.__fix_IK_links = args.get("fix_IK_links", False)
         self.__apply_bone_fixed_axis = args.get("apply_bone_fixed_axis", False)
         self.__translator = args.get("translator", None)
+        self.__parallel_morphs = args.get("parallel_morphs", True)
+        self.__texture_prefetch_workers = args.get("texture_prefetch_workers", 4)
+        self.__vertex_custom_normals = args.get("vertex_custom_normals", True)
 
         logging.info("****************************************")
         logging.info(" mmd_tools_local.import_pmx module")
@@ -841,58 +940,99 @@ class PMXImporter:
 
         start_time = time.time()
 
-        self.__createObjects()
-
-        if "MESH" in types:
-            if clean_model:
-                _PMXCleaner.clean(self.__model, "MORPHS" not in types)
-            if remove_doubles:
-                self.__vertex_map = _PMXCleaner.remove_doubles(self.__model, "MORPHS" not in types)
-            self.__createMeshObject()
-            self.__importVertices()
-            self.__importMaterials()
-            self.__importFaces()
-            self.__meshObj.data.update()
-            self.__assignCustomNormals()
-            self.__storeVerticesSDEF()
-
-        if "ARMATURE" in types:
-            # for tracking bone order
-            if "MESH" not in types:
-                self.__createMeshObject()
-                self.__importVertexGroup()
-            self.__importBones()
-            if args.get("rename_LR_bones", False):
-                use_underscore = args.get("use_underscore", False)
-                self.__renameLRBones(use_underscore)
-            if self.__translator:
-                self.__translateBoneNames()
-            if self.__apply_bone_fixed_axis:
-                FnBone.apply_bone_fixed_axis(self.__armObj)
-            FnBone.apply_additional_transformation(self.__armObj)
-
-        if "PHYSICS" in types:
-            self.__importRigids()
-            self.__importJoints()
-
-        if "DISPLAY" in types:
-            self.__importDisplayFrames()
-        else:
-            self.__rig.initialDisplayFrames()
-
-        if "MORPHS" in types:
-            self.__importGroupMorphs()
-            self.__importVertexMorphs()
-            self.__importBoneMorphs()
-            self.__importMaterialMorphs()
-            self.__importUVMorphs()
-
-        if self.__meshObj:
-            self.__addArmatureModifier(self.__meshObj, self.__armObj)
+        # top level phases: load, objects, [textures, mesh], [armature], [physics], display, [morphs], finish
+        phase_count = 4 + sum(2 if t == "MESH" else 1 for t in types if t in {"MESH", "ARMATURE", "PHYSICS", "MORPHS"})
+        with PhaseProfiler("import_pmx", phase_count, args.get("trace_filepath") or None) as profiler:
+            phase = profiler.phase
 
-        FnModel.change_mmd_ik_loop_factor(self.__root, args.get("ik_loop_factor", 1))
-        # bpy.context.scene.gravity[2] = -9.81 * 10 * self.__scale
-        self.__targetScene.active_object = self.__root
+            with phase("load"):
+                if "pmx" in args:
+                    self.__model = args["pmx"]
+                elif pmx_cache.active_cache() is not None:
+                    self.__model = pmx_cache.active_cache().load(args["filepath"])
+                else:
+                    self.__model = pmx.load(args["filepath"])
+                self.__fixRepeatedMorphName()
+
+            if "MESH" in types:
+                # the texture files are read while the objects and the mesh are built
+                with phase("textures"):
+                    self.__importTextures()
+
+            with phase("objects"):
+                self.__createObjects()
+
+            if "MESH" in types:
+                with phase("mesh"):
+                    if clean_model:
+                        with phase("clean"):
+                            _PMXCleaner.clean(self.__model, "MORPHS" not in types)
+                    if remove_doubles:
+                        with phase("remove_doubles"):
+                            self.__vertex_map = _PMXCleaner.remove_doubles(self.__model, "MORPHS" not in types)
+                    self.__createMeshObject()
+                    with phase("vertices"):
+                        self.__importVertices()
+                    with phase("materials"):
+                        self.__importMaterials()
+                    with phase("faces"):
+                        self.__importFaces()
+                        self.__meshObj.data.update()
+                    with phase("normals"):
+                        self.__assignCustomNormals()
+                    with phase("sdef"):
+                        self.__storeVerticesSDEF()
+
+            if "ARMATURE" in types:
+                with phase("armature"):
+                    # for tracking bone order
+                    if "MESH" not in types:
+                        self.__createMeshObject()
+                        self.__importVertexGroup()
+                    with phase("bones"):
+                        self.__importBones()
+                    if args.get("rename_LR_bones", False):
+                        use_underscore = args.get("use_underscore", False)
+                        self.__renameLRBones(use_underscore)
+                    if self.__translator:
+                        self.__translateBoneNames()
+                    if self.__apply_bone_fixed_axis:
+                        FnBone.apply_bone_fixed_axis(self.__armObj)
+                    FnBone.apply_additional_transformation(self.__armObj)
+
+            if "PHYSICS" in types:
+                with phase("physics"):
+                    with phase("rigids"):
+                        self.__importRigids()
+                    with phase("joints"):
+                        self.__importJoints()
+
+            with phase("display"):
+                if "DISPLAY" in types:
+                    self.__importDisplayFrames()
+                else:
+                    self.__rig.initialDisplayFrames()
+
+            if "MORPHS" in types:
+                with phase("morphs"):
+                    with phase("group_morphs"):
+                        self.__importGroupMorphs()
+                    with phase("vertex_morphs"):
+                        self.__importVertexMorphs()
+                    with phase("bone_morphs"):
+                        self.__importBoneMorphs()
+                    with phase("material_morphs"):
+                        self.__importMaterialMorphs()
+                    with phase("uv_morphs"):
+                        self.__importUVMorphs()
+
+            with phase("finish"):
+                if self.__meshObj:
+                    self.__addArmatureModifier(self.__meshObj, self.__armObj)
+
+                FnModel.change_mmd_ik_loop_factor(self.__root, args.get("ik_loop_factor", 1))
+                # bpy.context.scene.gravity[2] = -9.81 * 10 * self.__scale
+                self.__targetScene.active_object = self.__root
 
         logging.info(" Finished importing the model in %f seconds.", time.time() - start_time)
         logging.info("----------------------------------------")
@@ -900,33 +1040,51 @@ class PMXImporter:
         logging.info("****************************************")
 
 
+def _imap_prefetched(func, iterable, workers):
+    """Like map(func, iterable), but up to workers items ahead are computed by a thread pool."""
+    if workers < 1:
+        yield from map(func, iterable)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 class _PMXCleaner:
     @classmethod
     def clean(cls, pmx_model, mesh_only):
         logging.info("Cleaning PMX data...")
-        pmx_faces = pmx_model.faces
-        pmx_vertices = pmx_model.vertices
+        vertex_count = len(pmx_model.vertices)
 
         # clean face/vertex
-        cls.__clean_pmx_faces(pmx_faces, pmx_model.materials, lambda f: frozenset(f))
+        faces = cls.__face_array(pmx_model)
+        keys = np.sort(faces, axis=1)
+        degenerate = (keys[:, 0] == keys[:, 1]) | (keys[:, 1] == keys[:, 2])
+        faces = cls.__clean_pmx_faces(pmx_model, faces, keys, degenerate)
 
-        index_map = {v: v for f in pmx_faces for v in f}
-        is_index_clean = len(index_map) == len(pmx_vertices)
+        used = np.unique(faces)
+        is_index_clean = len(used) == vertex_count
         if is_index_clean:
             logging.info("   (vertices is clean)")
         else:
-            new_vertex_count = 0
-            for v in sorted(index_map):
-                if v != new_vertex_count:
-                    pmx_vertices[new_vertex_count] = pmx_vertices[v]
-                    index_map[v] = new_vertex_count
-                new_vertex_count += 1
-            logging.warning("   - removed %d vertices", len(pmx_vertices) - new_vertex_count)
-            del pmx_vertices[new_vertex_count:]
+            index_map = np.full(max(vertex_count, int(used[-1]) + 1 if len(used) else 0), -1, dtype=np.int64)
+            index_map[used] = np.arange(len(used))
+            logging.warning("   - removed %d vertices", vertex_count - len(used))
+            vertex_data = pmx_model.vertex_data
+            if vertex_data is not None:
+                pmx_model.setVertexData(vertex_data.take(used))
+            else:
+                pmx_vertices = pmx_model.vertices
+                pmx_vertices[:] = [pmx_vertices[i] for i in used.tolist()]
 
             # update vertex indices of faces
-            for f in pmx_faces:
-                f[:] = [index_map[v] for v in f]
+            faces = index_map[faces].astype(faces.dtype)
+        pmx_model.setFaceData(faces)
 
         if mesh_only:
             logging.info("   - Done (mesh only)!!")
@@ -934,38 +1092,38 @@ class _PMXCleaner:
 
         if not is_index_clean:
             # clean vertex/uv morphs
-            def __update_index(x):
-                x.index = index_map.get(x.index, None)
-                return x.index is not None
-
-            cls.__clean_pmx_morphs(pmx_model.morphs, __update_index)
+            cls.__clean_pmx_morphs(pmx_model.morphs, lambda index: np.where((index >= 0) & (index < len(index_map)), index_map[np.clip(index, 0, len(index_map) - 1)], -1))
         logging.info("   - Done!!")
 
     @classmethod
     def remove_doubles(cls, pmx_model, mesh_only):
         logging.info("Removing doubles...")
-        pmx_vertices = pmx_model.vertices
+        vertex_data = pmx_model.vertex_data
+        if vertex_data is not None:
+            co, uv = vertex_data.co, vertex_data.uv
+        else:
+            co = np.array([v.co for v in pmx_model.vertices], dtype=np.float64).reshape(-1, 3)
+            uv = np.array([v.uv for v in pmx_model.vertices], dtype=np.float64).reshape(-1, 2)
+        vertex_count = len(co)
 
-        vertex_map = [None] * len(pmx_vertices)
-        # gather vertex data
-        for i, v in enumerate(pmx_vertices):
-            vertex_map[i] = [tuple(v.co)]
+        # gather vertex data: the position and the (morph index, offset) of every vertex/uv morph offset
+        entries = []
         if not mesh_only:
             for i, m in enumerate(pmx_model.morphs):
-                if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
-                    continue
-                for x in m.offsets:
-                    vertex_map[x.index].append((i,) + tuple(x.offset))
-        # generate vertex merging table
-        keys = {}
-        for i, v in enumerate(vertex_map):
-            k = tuple(v)
-            if k in keys:
-                vertex_map[i] = keys[k]  # merge pmx_vertices[i] to pmx_vertices[keys[k][0]]
-            else:
-                vertex_map[i] = keys[k] = (i, len(keys))  # (pmx index, blender index)
-        counts = len(vertex_map) - len(keys)
-        keys.clear()
+                if isinstance(m, (pmx.VertexMorph, pmx.UVMorph)):
+                    index, offset = cls.__morph_offsets(m)
+                    if len(index) and (index.min() < 0 or index.max() >= vertex_count):
+                        raise IndexError("morph offset index out of range")
+                    entries.append((index, np.full(len(index), i), offset))
+        groups = cls.__vertex_groups(co, entries)
+
+        # generate vertex merging table: (pmx index, blender index), blender indices in order of first appearance
+        _, first, inverse = np.unique(groups, return_index=True, return_inverse=True)
+        order = np.empty(len(first), dtype=np.int64)
+        order[np.argsort(first)] = np.arange(len(first))
+        inverse = inverse.ravel()
+        pmx_index, blender_index = first[inverse], order[inverse]
+        counts = vertex_count - len(first)
         if counts:
             logging.warning("   - %d vertices will be removed", counts)
         else:
@@ -973,56 +1131,131 @@ class _PMXCleaner:
             return None
 
         # clean face
-        # face_key_func = lambda f: frozenset(vertex_map[x][0] for x in f)
-        face_key_func = lambda f: frozenset({vertex_map[x][0]: tuple(pmx_vertices[x].uv) for x in f}.items())
-        cls.__clean_pmx_faces(pmx_model.faces, pmx_model.materials, face_key_func)
+        faces = cls.__face_array(pmx_model)
+        reps = pmx_index[faces]
+        degenerate = (reps[:, 0] == reps[:, 1]) | (reps[:, 1] == reps[:, 2]) | (reps[:, 0] == reps[:, 2])
+        # a NaN uv is only equal to itself, so the uv of such a vertex is keyed by the vertex index
+        uv_keys = np.column_stack([np.zeros(vertex_count, dtype=np.int64), cls.__float_keys(uv)])
+        is_nan = np.isnan(uv).any(axis=1)
+        uv_keys[is_nan] = np.column_stack([np.ones(np.count_nonzero(is_nan), dtype=np.int64), np.flatnonzero(is_nan), np.zeros(np.count_nonzero(is_nan), dtype=np.int64)])
+        order = np.argsort(reps, axis=1)
+        face_uv = np.take_along_axis(uv_keys[faces], order[:, :, None], axis=1)
+        keys = np.column_stack([np.take_along_axis(reps, order, axis=1), face_uv.reshape(len(faces), 9)])
+        pmx_model.setFaceData(cls.__clean_pmx_faces(pmx_model, faces, keys, degenerate))
 
         if mesh_only:
             logging.info("   - Done (mesh only)!!")
         else:
             # clean vertex/uv morphs
-            def __update_index(x):
-                indices = vertex_map[x.index]
-                x.index = indices[1] if x.index == indices[0] else None
-                return x.index is not None
-
-            cls.__clean_pmx_morphs(pmx_model.morphs, __update_index)
+            is_kept = pmx_index == np.arange(vertex_count)
+            cls.__clean_pmx_morphs(pmx_model.morphs, lambda index: np.where(is_kept[index], blender_index[index], -1))
             logging.info("   - Done!!")
-        return vertex_map
+        return list(zip(pmx_index.tolist(), blender_index.tolist()))
 
     @staticmethod
-    def __clean_pmx_faces(pmx_faces, pmx_materials, face_key_func):
-        new_face_count = 0
-        face_iter = iter(pmx_faces)
-        for mat in pmx_materials:
-            used_faces = set()
-            new_vertex_count = 0
-            for i in range(int(mat.vertex_count / 3)):
-                f = next(face_iter)
-
-                f_key = face_key_func(f)
-                if len(f_key) != 3 or f_key in used_faces:
-                    continue
-                used_faces.add(f_key)
-
-                pmx_faces[new_face_count] = list(f)
-                new_face_count += 1
-                new_vertex_count += 3
-            mat.vertex_count = new_vertex_count
-        face_iter = None
-        if new_face_count == len(pmx_faces):
+    def __unique_rows(rows):
+        """Return (ids, first): ids numbers the distinct rows of a 2D array, first[id] is the index where a row first appears."""
+        order = np.lexsort(rows.T[::-1])
+        sorted_rows = rows[order]
+        is_new = np.ones(len(rows), dtype=bool)
+        is_new[1:] = (sorted_rows[1:] != sorted_rows[:-1]).any(axis=1)
+        ids = np.empty(len(rows), dtype=np.int64)
+        ids[order] = np.cumsum(is_new) - 1
+        return ids, order[is_new]
+
+    @staticmethod
+    def __float_keys(values):
+        """Return int64 keys which are equal where the float values are equal (0.0 == -0.0)."""
+        return (np.asarray(values, dtype=np.float64) + 0.0).view(np.int64)
+
+    @staticmethod
+    def __face_array(pmx_model):
+        faces = pmx_model.face_data
+        if faces is None:
+            faces = np.array(pmx_model.faces, dtype=np.int64).reshape(-1, 3)
+        return faces
+
+    @staticmethod
+    def __morph_offsets(morph):
+        data = morph.offset_data
+        if data is not None:
+            return data["index"].astype(np.int64), data["offset"]
+        offsets = morph.offsets
+        return np.array([x.index for x in offsets], dtype=np.int64), np.array([x.offset for x in offsets], dtype=np.float64).reshape(len(offsets), 4 if isinstance(morph, pmx.UVMorph) else 3)
+
+    @classmethod
+    def __vertex_groups(cls, co, entries):
+        """Return an id for each vertex, equal for vertices with the same position and the same sequence of morph offsets.
+
+        Values which are NaN are never equal, so such vertices get ids of their own.
+        """
+        vertex_count = len(co)
+        is_nan = np.isnan(co).any(axis=1)
+        if entries:
+            entry_vertex = np.concatenate([index for index, _, _ in entries])
+            entry_morph = np.concatenate([morph for _, morph, _ in entries])
+            entry_offset = np.zeros((len(entry_vertex), 4), dtype=np.float64)
+            start = 0
+            for index, _, offset in entries:
+                entry_offset[start : start + len(index), : offset.shape[1]] = offset
+                start += len(index)
+            is_nan[entry_vertex[np.isnan(entry_offset).any(axis=1)]] = True
+        else:
+            entry_vertex = np.zeros(0, dtype=np.int64)
+        lengths = np.bincount(entry_vertex, minlength=vertex_count)
+
+        groups = cls.__unique_rows(np.column_stack([cls.__float_keys(co), lengths]))[0]
+        if len(entry_vertex):
+            entry_keys = cls.__unique_rows(np.column_stack([entry_morph, cls.__float_keys(entry_offset)]))[0]
+            # refine the groups by the k-th offset of each vertex, in the order of the morphs and their offsets
+            order = np.argsort(entry_vertex, kind="stable")
+            entry_vertex, entry_keys = entry_vertex[order], entry_keys[order]
+            position = np.arange(len(entry_vertex)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            for k in range(lengths.max()):
+                selected = position == k
+                vertices = entry_vertex[selected]
+                refined = cls.__unique_rows(np.column_stack([groups[vertices], entry_keys[selected]]))[0]
+                groups[vertices] = groups.max() + 1 + refined
+        groups[is_nan] = groups.max(initial=-1) + 1 + np.arange(np.count_nonzero(is_nan))
+        return groups
+
+    @classmethod
+    def __clean_pmx_faces(cls, pmx_model, faces, keys, degenerate):
+        """Return the faces without degenerate faces and duplicates (equal keys) in the same material, and update the vertex counts of the materials."""
+        pmx_materials = pmx_model.materials
+        face_counts = [int(mat.vertex_count / 3) for mat in pmx_materials]
+        if sum(face_counts) > len(faces):
+            raise ValueError("materials use more faces than the model has")
+        material_index = np.repeat(np.arange(len(pmx_materials)), face_counts)
+        candidates = np.flatnonzero(~degenerate[: len(material_index)])
+        rows = np.column_stack([material_index[candidates], keys[candidates]])
+        kept = np.sort(candidates[cls.__unique_rows(rows)[1]])
+        for mat, count in zip(pmx_materials, np.bincount(material_index[kept], minlength=len(pmx_materials)).tolist()):
+            mat.vertex_count = count * 3
+        if len(kept) == len(faces):
             logging.info("   (faces is clean)")
         else:
-            logging.warning("   - removed %d faces", len(pmx_faces) - new_face_count)
-            del pmx_faces[new_face_count:]
+            logging.warning("   - removed %d faces", len(faces) - len(kept))
+        return faces[kept]
 
-    @staticmethod
-    def __clean_pmx_morphs(pmx_morphs, index_update_func):
+    @classmethod
+    def __clean_pmx_morphs(cls, pmx_morphs, index_update_func):
+        """Update the indices of the vertex/uv morph offsets with index_update_func(indices), and remove the offsets whose new index is -1."""
         for m in pmx_morphs:
             if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
                 continue
             old_len = len(m.offsets)
-            m.offsets = [x for x in m.offsets if index_update_func(x)]
+            new_index = index_update_func(cls.__morph_offsets(m)[0])
+            is_kept = new_index >= 0
+            data = m.offset_data
+            if data is not None:
+                data = data[is_kept]
+                data["index"] = new_index[is_kept]
+                m.setOffsetData(data)
+            else:
+                m.offsets = [x for x, keep in zip(m.offsets, is_kept.tolist()) if keep]
+                for x, index in zip(m.offsets, new_index[is_kept].tolist()):
+                    x.index = index
             counts = old_len - len(m.offsets)
             if counts:
                 logging.warning('   - removed %d (of %d) offsets of "%s"', counts, old_len, m.name)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 MMD Tools authors
+# This file is part of MMD Tools.
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import bpy
+
+
+def _resident_memory():
+    """Return the resident memory of the process in bytes, or None if it is unknown."""
+    try:
+        import psutil  # pylint: disable=import-outside-toplevel
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PhaseProfiler:
+    """Measure the phases of an import.
+
+    Phases are nested with the phase() context manager. Each phase is logged with its duration and
+    the change of the resident memory, the finished top level phases are reported through the
+    progress indicator of the window manager, and all phases can be written as a JSON trace in
+    Chrome trace-event format (chrome://tracing, https://ui.perfetto.dev) when the profiler exits.
+    """
+
+    def __init__(self, name, phase_count, trace_filepath=None):
+        self.name = name
+        self.phase_count = phase_count
+        self.trace_filepath = trace_filepath
+        self.__events = []
+        self.__phases = 0
+        self.__depth = 0
+        self.__finished = 0
+        self.__start_time = None
+        self.__wm = getattr(bpy.context, "window_manager", None)
+
+    def __enter__(self):
+        self.__start_time = time.perf_counter()
+        if self.__wm:
+            self.__wm.progress_begin(0, self.phase_count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__wm:
+            self.__wm.progress_end()
+        logging.info(" %s: %d phases in %.3f seconds", self.name, self.__phases, time.perf_counter() - self.__start_time)
+        if self.trace_filepath:
+            try:
+                self.write_trace(self.trace_filepath)
+            except OSError as e:
+                logging.warning(" * Failed to write the trace file %s: %s", self.trace_filepath, e)
+        return False
+
+    def __timestamp(self, t):
+        return (t - self.__start_time) * 1e6
+
+    @contextmanager
+    def phase(self, name):
+        depth = self.__depth
+        self.__depth += 1
+        memory = _resident_memory()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            end_time = time.perf_counter()
+            self.__depth -= 1
+            self.__phases += 1
+            memory_end = _resident_memory()
+            args = {}
+            if memory is not None and memory_end is not None:
+                args = {"rss_mb": round(memory_end / (1 << 20), 3), "rss_delta_mb": round((memory_end - memory) / (1 << 20), 3)}
+                logging.info("%s- %s: %.3f seconds, %+.1f MB", "  " * depth, name, end_time - start_time, args["rss_delta_mb"])
+            else:
+                logging.info("%s- %s: %.3f seconds", "  " * depth, name, end_time - start_time)
+            self.__events.append(
+                {
+                    "name": name,
+                    "cat": self.name,
+                    "ph": "X",
+                    "ts": self.__timestamp(start_time),
+                    "dur": (end_time - start_time) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+            if args:
+                self.__events.append({"name": "memory", "ph": "C", "ts": self.__timestamp(end_time), "pid": os.getpid(), "args": {"rss_mb": args["rss_mb"]}})
+            if depth == 0:
+                self.__finished += 1
+                if self.__wm:
+                    self.__wm.progress_update(min(self.__finished, self.phase_count))
+
+    def write_trace(self, filepath):
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.__events, "displayTimeUnit": "ms", "otherData": {"name": self.name}}, f)
+        logging.info(" Wrote the trace of %s to %s", self.name, filepath)
@@ -6,6 +6,10 @@ import collections
 import logging
 import struct
 
+import numpy as np
+
+from mmd_tools_local.core.pmx import ArrayBackedList
+
 
 class InvalidFileError(Exception):
     pass
@@ -56,6 +60,26 @@ class BoneFrameKey:
             self.rotation = (0, 0, 0, 1)
         self.interp = list(struct.unpack("<64b", fin.read(64)))
 
+    @staticmethod
+    def recordDtype():
+        return np.dtype([("frame_number", "<u4"), ("location", "<f4", (3,)), ("rotation", "<f4", (4,)), ("interp", "i1", (64,))])
+
+    @staticmethod
+    def fixRecords(data):
+        data["rotation"][~data["rotation"].any(axis=1)] = (0, 0, 0, 1)
+
+    @staticmethod
+    def fromArray(data):
+        keys = []
+        for frame_number, location, rotation, interp in zip(data["frame_number"].tolist(), data["location"].tolist(), data["rotation"].tolist(), data["interp"].tolist()):
+            k = BoneFrameKey()
+            k.frame_number = frame_number
+            k.location = location
+            k.rotation = rotation
+            k.interp = interp
+            keys.append(k)
+        return keys
+
     def save(self, fin):
         fin.write(struct.pack("<L", self.frame_number))
         fin.write(struct.pack("<fff", *self.location))
@@ -79,6 +103,24 @@ class ShapeKeyFrameKey:
         (self.frame_number,) = struct.unpack("<L", fin.read(4))
         (self.weight,) = struct.unpack("<f", fin.read(4))
 
+    @staticmethod
+    def recordDtype():
+        return np.dtype([("frame_number", "<u4"), ("weight", "<f4")])
+
+    @staticmethod
+    def fixRecords(data):
+        pass
+
+    @staticmethod
+    def fromArray(data):
+        keys = []
+        for frame_number, weight in zip(data["frame_number"].tolist(), data["weight"].tolist()):
+            k = ShapeKeyFrameKey()
+            k.frame_number = frame_number
+            k.weight = weight
+            keys.append(k)
+        return keys
+
     def save(self, fin):
         fin.write(struct.pack("<L", self.frame_number))
         fin.write(struct.pack("<f", self.weight))
@@ -223,20 +265,53 @@ class _AnimationBase(collections.defaultdict):
     def frameClass():
         raise NotImplementedError
 
+    @classmethod
+    def recordDtype(cls):
+        return np.dtype([("name", "S15")] + cls.frameClass().recordDtype().descr)
+
+    def frameData(self, name):
+        """Return the records of name as a structured array sorted by frame_number, or None if the frame keys were modified."""
+        return getattr(self.get(name), "data", None)
+
+    def setFrameData(self, name, records):
+        """Set the frame keys of name from a structured array of recordDtype(), the name field is ignored."""
+        self[name] = ArrayBackedList(records, self.frameClass().fromArray)
+
     def load(self, fin):
         (count,) = struct.unpack("<L", fin.read(4))
         logging.info("loading %s... %d", self.__class__.__name__, count)
-        for i in range(count):
-            name = _toShiftJisString(struct.unpack("<15s", fin.read(15))[0])
-            cls = self.frameClass()
-            frameKey = cls()
-            frameKey.load(fin)
-            self[name].append(frameKey)
+        cls = self.frameClass()
+        dtype = self.recordDtype()
+        data = fin.read(count * dtype.itemsize)
+        records = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize).copy()
+        cls.fixRecords(records)
+
+        # group the records by the raw name bytes, so each name is only decoded once
+        names, first_index, inverse, counts = np.unique(records["name"], return_index=True, return_inverse=True, return_counts=True)
+        order = np.lexsort((records["frame_number"], inverse.ravel()))
+        groups = np.split(records[order], np.cumsum(counts)[:-1])
+        for i in np.argsort(first_index, kind="stable").tolist():
+            name = _toShiftJisString(names[i])
+            frames = groups[i]
+            prev = self.frameData(name)
+            if prev is not None:  # different bytes with the same name (garbage after the terminator)
+                frames = np.concatenate((prev, frames))
+                frames = frames[np.argsort(frames["frame_number"], kind="stable")]
+            self.setFrameData(name, frames)
+
+        if len(records) < count:
+            raise struct.error("unexpected end of data")
 
     def save(self, fin):
         count = sum([len(i) for i in self.values()])
         fin.write(struct.pack("<L", count))
         for name, frameKeys in self.items():
+            records = getattr(frameKeys, "data", None)
+            if records is not None:  # unmodified records are written as they are
+                records = records.copy()
+                records["name"] = _toShiftJisBytes(name)
+                fin.write(records.tobytes())
+                continue
             name_data = struct.pack("<15s", _toShiftJisBytes(name))
             for frameKey in frameKeys:
                 fin.write(name_data)
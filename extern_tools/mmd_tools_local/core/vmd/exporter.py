@@ -5,126 +5,157 @@
 import logging
 import math
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Set
 
 import bpy
 import mathutils
+import numpy as np
 
 from mmd_tools_local.core import vmd
 from mmd_tools_local.core.camera import MMDCamera
 from mmd_tools_local.core.lamp import MMDLamp
-from mmd_tools_local.core.vmd.importer import _FnBezier
+from mmd_tools_local.core.vmd.importer import _FnBezier, _FnRotationArray
 
 
 class _FCurve:
-    @staticmethod
-    def __x_co_0(x: bpy.types.Keyframe):
-        return x.co[0]
+    __DEFAULT_INTERP = (20, 20, 107, 107)
 
     def __init__(self, default_value):
         self.__default_value = default_value
         self.__fcurve: Optional[bpy.types.FCurve] = None
-        self.__sorted_keyframe_points: Optional[List[bpy.types.Keyframe]] = None
+        # keyframe points sorted by frame, read with foreach_get
+        self.__co: Optional[np.ndarray] = None
+        self.__handle_left: Optional[np.ndarray] = None
+        self.__handle_right: Optional[np.ndarray] = None
+        self.__interpolation: Optional[np.ndarray] = None
+
+    @staticmethod
+    def __interpolationValue(name):
+        return bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items[name].value
 
     def setFCurve(self, fcurve: bpy.types.FCurve):
         assert fcurve.is_valid and self.__fcurve is None
         self.__fcurve = fcurve
-        self.__sorted_keyframe_points: List[bpy.types.Keyframe] = sorted(self.__fcurve.keyframe_points, key=self.__x_co_0)
+        keyframe_points = fcurve.keyframe_points
+        count = len(keyframe_points)
+        co = np.empty(count * 2, dtype=np.float32)
+        handle_left = np.empty(count * 2, dtype=np.float32)
+        handle_right = np.empty(count * 2, dtype=np.float32)
+        interpolation = np.empty(count, dtype=np.int32)
+        keyframe_points.foreach_get("co", co)
+        keyframe_points.foreach_get("handle_left", handle_left)
+        keyframe_points.foreach_get("handle_right", handle_right)
+        keyframe_points.foreach_get("interpolation", interpolation)
+        order = np.argsort(co[0::2], kind="stable")
+        self.__co = co.reshape(-1, 2)[order]
+        self.__handle_left = handle_left.reshape(-1, 2)[order]
+        self.__handle_right = handle_right.reshape(-1, 2)[order]
+        self.__interpolation = interpolation[order]
+
+    def __bezierPoints(self, kp0, kp1):
+        """Control points of the bezier segments from keyframe indices kp0 to kp1, like _FnBezier.from_fcurve.
+
+        The points are float32 arrays, so the results are the same as the mathutils.Vector math of _FnBezier.
+        """
+        p0, p1, p2, p3 = self.__co[kp0], self.__handle_right[kp0].copy(), self.__handle_left[kp1].copy(), self.__co[kp1]
+        x0, x1, x2, x3 = (p[:, 0].astype(np.float64) for p in (p0, p1, p2, p3))
+        m = x1 > x3
+        t = (x3[m] - x0[m]) / (x1[m] - x0[m])
+        p1[m] = (1 - t).astype(np.float32)[:, None] * p0[m] + p1[m] * t.astype(np.float32)[:, None]
+        m = x0 > x2
+        t = (x3[m] - x0[m]) / (x3[m] - x2[m])
+        p2[m] = (1 - t).astype(np.float32)[:, None] * p3[m] + p2[m] * t.astype(np.float32)[:, None]
+        return p0, p1, p2, p3
 
     def frameNumbers(self):
-        sorted_keyframe_points = self.__sorted_keyframe_points
         result: Set[int] = set()
-        if sorted_keyframe_points is None:
-            return result
-
-        if len(sorted_keyframe_points) == 0:
+        if self.__co is None or len(self.__co) == 0:
             return result
 
-        kp1 = sorted_keyframe_points[0]
-        result.add(int(kp1.co[0] + 0.5))
-
-        kp0 = kp1
-        for kp1 in sorted_keyframe_points[1:]:
-            result.add(int(kp1.co[0] + 0.5))
-            if kp0.interpolation != "LINEAR" and kp1.co.x - kp0.co.x > 2.5:
-                if kp0.interpolation == "CONSTANT":
-                    result.add(int(kp1.co[0] - 0.5))
-                elif kp0.interpolation == "BEZIER":
-                    bz = _FnBezier.from_fcurve(kp0, kp1)
-                    for t in bz.find_critical():
-                        result.add(int(bz.evaluate(t).x + 0.5))
-            kp0 = kp1
+        x = self.__co[:, 0].astype(np.float64)
+        result.update(np.trunc(x + 0.5).astype(np.int64).tolist())
 
-        return result
+        interpolation = self.__interpolation[:-1]
+        segments = (interpolation != self.__interpolationValue("LINEAR")) & (x[1:] - x[:-1] > 2.5)
+        constant = np.flatnonzero(segments & (interpolation == self.__interpolationValue("CONSTANT")))
+        result.update(np.trunc(x[constant + 1] - 0.5).astype(np.int64).tolist())
 
-    @staticmethod
-    def getVMDControlPoints(kp0, kp1):
-        if kp0.interpolation == "BEZIER":
-            return _FCurve.__toVMDControlPoints(_FnBezier.from_fcurve(kp0, kp1))
-        return ((20, 20), (107, 107))
+        bezier = np.flatnonzero(segments & (interpolation == self.__interpolationValue("BEZIER")))
+        points = self.__bezierPoints(bezier, bezier + 1)
+        y0, y1, y2, y3 = (p[:, 1] for p in points)
+        y_min, y_max = np.minimum(y0, y3), np.maximum(y0, y3)
+        critical = np.flatnonzero((y1 > y_max) | (y1 < y_min) | (y2 > y_max) | (y2 < y_min))
+        for i in critical.tolist():
+            bz = _FnBezier(*(mathutils.Vector(p[i].tolist()) for p in points))
+            for t in bz.find_critical():
+                result.add(int(bz.evaluate(t).x + 0.5))
 
-    @staticmethod
-    def __toVMDControlPoints(bezier):
-        p0, p1, p2, p3 = bezier.points
-
-        dx, dy = p3 - p0
-        if abs(dy) < 1e-6 or abs(dx) < 1.5:
-            return ((20, 20), (107, 107))
-
-        x1, y1 = p1 - p0
-        x2, y2 = p2 - p0
-        x1 = max(0, min(127, int(0.5 + x1 * 127.0 / dx)))
-        x2 = max(0, min(127, int(0.5 + x2 * 127.0 / dx)))
-        y1 = max(0, min(127, int(0.5 + y1 * 127.0 / dy)))
-        y2 = max(0, min(127, int(0.5 + y2 * 127.0 / dy)))
-        return ((x1, y1), (x2, y2))
+        return result
 
-    def sampleFrames(self, frame_numbers: List[int]):
+    @classmethod
+    def __toVMDControlPoints(cls, p0, p1, p2, p3):
+        """(x1, y1, x2, y2) of the bezier segments of float32 (n, 2) control points."""
+        dx, dy = (p3 - p0).astype(np.float64).T
+        x1, y1 = (p1 - p0).astype(np.float64).T
+        x2, y2 = (p2 - p0).astype(np.float64).T
+        linear = (np.abs(dy) < 1e-6) | (np.abs(dx) < 1.5)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = np.column_stack((x1 * 127.0 / dx, y1 * 127.0 / dy, x2 * 127.0 / dx, y2 * 127.0 / dy))
+        result[linear] = cls.__DEFAULT_INTERP
+        return np.clip(np.trunc(0.5 + result), 0, 127).astype(np.int64)
+
+    def sampleFrameArrays(self, frame_numbers: np.ndarray):
+        """Return the values and the VMD interpolations (x1, y1, x2, y2) of the curve at the sorted frame_numbers."""
         # assume set(frame_numbers) & set(self.frameNumbers()) == set(self.frameNumbers())
-        fcurve = self.__fcurve
-        if fcurve is None or len(fcurve.keyframe_points) == 0:  # no key frames
-            return [[self.__default_value, ((20, 20), (107, 107))] for _ in frame_numbers]
-
-        result = list()
-
-        evaluate = fcurve.evaluate
-        frame_iter = iter(frame_numbers)
-        prev_kp = None
-        prev_i = None
-        kp: bpy.types.Keyframe
-        for kp in self.__sorted_keyframe_points:
-            i = int(kp.co[0] + 0.5)
-            if i == prev_i:
-                prev_kp = kp
-                continue
-            prev_i = i
-            frames = []
-            while True:
-                frame = next(frame_iter)
-                frames.append(frame)
-                if frame >= i:
-                    break
-            assert len(frames) >= 1 and frames[-1] == i
-            if prev_kp is None:
-                for f in frames:  # starting key frames
-                    result.append([kp.co[1], ((20, 20), (107, 107))])
-            elif len(frames) == 1:
-                result.append([kp.co[1], self.getVMDControlPoints(prev_kp, kp)])
-            elif prev_kp.interpolation == "BEZIER":
-                bz = _FnBezier.from_fcurve(prev_kp, kp)
+        count = len(frame_numbers)
+        interps = np.tile(np.array(self.__DEFAULT_INTERP, dtype=np.int64), (count, 1))
+        if self.__co is None or len(self.__co) == 0:  # no key frames
+            return np.full(count, self.__default_value), interps
+
+        co = self.__co
+        values = np.empty(count, dtype=np.float64)
+        key_frames = np.trunc(co[:, 0].astype(np.float64) + 0.5).astype(np.int64)
+        # of the keys at the same frame, the first one ends the previous segment and the last one starts the next segment
+        first = np.flatnonzero(np.diff(key_frames, prepend=key_frames[0] - 1))
+        last = np.append(first[1:] - 1, len(key_frames) - 1)
+        pos = np.searchsorted(frame_numbers, key_frames[first])
+        assert pos[-1] < count and (frame_numbers[pos] == key_frames[first]).all()
+
+        values[: pos[0] + 1] = co[first[0], 1]  # starting key frames
+        values[pos[-1] + 1 :] = co[last[-1], 1]
+
+        kp0, kp1 = last[:-1], first[1:]
+        pos0, pos1 = pos[:-1], pos[1:]
+        values[pos1] = co[kp1, 1]
+        is_bezier = self.__interpolation[kp0] == self.__interpolationValue("BEZIER")
+        bezier = np.flatnonzero(is_bezier)
+        points = self.__bezierPoints(kp0[bezier], kp1[bezier])
+        interps[pos1[bezier]] = self.__toVMDControlPoints(*points)
+
+        evaluate = self.__fcurve.evaluate
+        for seg in np.flatnonzero(pos1 - pos0 > 1).tolist():
+            indices = slice(pos0[seg] + 1, pos1[seg] + 1)
+            frames = frame_numbers[indices].tolist()
+            if is_bezier[seg]:
+                i = np.searchsorted(bezier, seg)
+                bz = _FnBezier(*(mathutils.Vector(p[i].tolist()) for p in points))
+                sampled = []
                 for f in frames[:-1]:
                     b1, bz, pt = bz.split_by_x(f)
-                    result.append([pt.y, self.__toVMDControlPoints(b1)])
-                result.append([bz.points[-1].y, self.__toVMDControlPoints(bz)])
+                    sampled.append((pt.y, b1.points))
+                sampled.append((bz.points[-1].y, bz.points))
+                values[indices] = [y for y, _ in sampled]
+                interps[indices] = self.__toVMDControlPoints(*np.array([b for _, b in sampled], dtype=np.float32).transpose(1, 0, 2))
             else:
-                for f in frames:
-                    result.append([evaluate(f), ((20, 20), (107, 107))])
-            prev_kp = kp
+                values[indices] = [evaluate(f) for f in frames]
+                interps[indices] = self.__DEFAULT_INTERP
 
-        prev_kp_co_1 = prev_kp.co[1]
-        result.extend([[prev_kp_co_1, ((20, 20), (107, 107))] for _ in frame_iter])
+        return values, interps
 
-        return result
+    def sampleFrames(self, frame_numbers: List[int]):
+        values, interps = self.sampleFrameArrays(np.asarray(frame_numbers, dtype=np.int64))
+        return [[v, ((x1, y1), (x2, y2))] for v, (x1, y1, x2, y2) in zip(values.tolist(), interps.tolist())]
 
 
 class VMDExporter:
@@ -135,13 +166,14 @@ class VMDExporter:
         self.__bone_converter_cls = vmd.importer.BoneConverter
         self.__ik_fcurves = {}
 
-    def __allFrameKeys(self, curves: List[_FCurve]):
+    def __sampleAllFrames(self, curves: List[_FCurve]):
+        """Return the exported frame numbers and the sampled (values, interps) of each curve."""
         all_frames = set()
         for i in curves:
             all_frames |= i.frameNumbers()
 
         if len(all_frames) == 0:
-            return
+            return np.empty(0, dtype=np.int64), [i.sampleFrameArrays(np.empty(0, dtype=np.int64)) for i in curves]
 
         frame_start = min(all_frames)
         if frame_start != self.__frame_start:
@@ -153,49 +185,45 @@ class VMDExporter:
             frame_end = self.__frame_end
             all_frames.add(frame_end)
 
-        all_frames = sorted(all_frames)
-        all_keys = [i.sampleFrames(all_frames) for i in curves]
-        # return zip(all_frames, *all_keys)
-        for data in zip(all_frames, *all_keys):
-            frame_number = data[0]
-            if frame_number < frame_start:
-                continue
-            if frame_number > frame_end:
-                break
-            yield data
+        all_frames = np.array(sorted(all_frames), dtype=np.int64)
+        all_keys = [i.sampleFrameArrays(all_frames) for i in curves]
+        mask = (all_frames >= frame_start) & (all_frames <= frame_end)
+        return all_frames[mask], [(values[mask], interps[mask]) for values, interps in all_keys]
 
-    @staticmethod
-    def __minRotationDiff(prev_q, curr_q):
-        t1 = (prev_q.w - curr_q.w) ** 2 + (prev_q.x - curr_q.x) ** 2 + (prev_q.y - curr_q.y) ** 2 + (prev_q.z - curr_q.z) ** 2
-        t2 = (prev_q.w + curr_q.w) ** 2 + (prev_q.x + curr_q.x) ** 2 + (prev_q.y + curr_q.y) ** 2 + (prev_q.z + curr_q.z) ** 2
-        # t1 = prev_q.rotation_difference(curr_q).angle
-        # t2 = prev_q.rotation_difference(-curr_q).angle
-        return -curr_q if t2 < t1 else curr_q
+    def __allFrameKeys(self, curves: List[_FCurve]):
+        frame_numbers, all_keys = self.__sampleAllFrames(curves)
+        all_keys = [[[v, ((x1, y1), (x2, y2))] for v, (x1, y1, x2, y2) in zip(values.tolist(), interps.tolist())] for values, interps in all_keys]
+        return zip(frame_numbers.tolist(), *all_keys)
+
+    # (x_x1, y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2, 0) indices of the bone interpolation data
+    # fmt: off
+    # minimum acceptable data
+    #    x_x1, 0, 0, 0, x_y1, 0, 0, 0, x_x2, 0, 0, 0, x_y2, 0, 0, 0,
+    #    y_x1, 0, 0, 0, y_y1, 0, 0, 0, y_x2, 0, 0, 0, y_y2, 0, 0, 0,
+    #    z_x1, 0, 0, 0, z_y1, 0, 0, 0, z_x2, 0, 0, 0, z_y2, 0, 0, 0,
+    #    r_x1, 0, 0, 0, r_y1, 0, 0, 0, r_x2, 0, 0, 0, r_y2, 0, 0, 0,
+    __BONE_INTERP_LAYOUT = [  # full data, indices in [2, 3, 31, 46, 47, 61, 62, 63] are unclear
+        0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+        1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16,
+        2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 16,
+        3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 16, 16,
+    ]
+    # fmt: on
+
+    @classmethod
+    def __getVMDBoneInterpolation(cls, x_axis, y_axis, z_axis, rotation):
+        """The 64 interpolation values of each frame from the (n, 4) (x1, y1, x2, y2) arrays of each axis."""
+        data = np.stack((x_axis, y_axis, z_axis, rotation), axis=2).reshape(-1, 16)
+        data = np.column_stack((data, np.zeros(len(data), dtype=data.dtype)))
+        return data[:, cls.__BONE_INTERP_LAYOUT]
 
     @staticmethod
-    def __getVMDBoneInterpolation(x_axis, y_axis, z_axis, rotation):
-        x_x1, x_y1 = x_axis[0]
-        x_x2, x_y2 = x_axis[1]
-        y_x1, y_y1 = y_axis[0]
-        y_x2, y_y2 = y_axis[1]
-        z_x1, z_y1 = z_axis[0]
-        z_x2, z_y2 = z_axis[1]
-        r_x1, r_y1 = rotation[0]
-        r_x2, r_y2 = rotation[1]
-        # fmt: off
-        # return [ # minimum acceptable data
-        #    x_x1, 0, 0, 0, x_y1, 0, 0, 0, x_x2, 0, 0, 0, x_y2, 0, 0, 0,
-        #    y_x1, 0, 0, 0, y_y1, 0, 0, 0, y_x2, 0, 0, 0, y_y2, 0, 0, 0,
-        #    z_x1, 0, 0, 0, z_y1, 0, 0, 0, z_x2, 0, 0, 0, z_y2, 0, 0, 0,
-        #    r_x1, 0, 0, 0, r_y1, 0, 0, 0, r_x2, 0, 0, 0, r_y2, 0, 0, 0,
-        #    ]
-        return [ # full data, indices in [2, 3, 31, 46, 47, 61, 62, 63] are unclear
-            x_x1, y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,
-            y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,
-            z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,
-            r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,    0,
-        ]
-        # fmt: on
+    def __pickRotationInterpolations(rotation_interps):
+        result = np.tile(np.array((20, 20, 107, 107), dtype=np.int64), (len(rotation_interps[0]), 1))
+        for ir in reversed(rotation_interps):
+            picked = (ir != (20, 20, 107, 107)).any(axis=1)
+            result[picked] = ir[picked]
+        return result
 
     @staticmethod
     def __pickRotationInterpolation(rotation_interps):
@@ -207,21 +235,12 @@ class VMDExporter:
     @staticmethod
     def __xyzw_from_rotation_mode(mode):
         if mode == "QUATERNION":
-            return lambda xyzw: xyzw
+            return lambda x, y, z, w: np.column_stack((x, y, z, w))
 
         if mode == "AXIS_ANGLE":
+            return lambda x, y, z, w: _FnRotationArray.from_axis_angle(np.column_stack((x, y, z)), w)[:, [1, 2, 3, 0]]
 
-            def __xyzw_from_axis_angle(xyzw):
-                q = mathutils.Quaternion(xyzw[:3], xyzw[3])
-                return [q.x, q.y, q.z, q.w]
-
-            return __xyzw_from_axis_angle
-
-        def __xyzw_from_euler(xyzw):
-            q = mathutils.Euler(xyzw[:3], xyzw[3]).to_quaternion()
-            return [q.x, q.y, q.z, q.w]
-
-        return __xyzw_from_euler
+        return lambda x, y, z, _mode: _FnRotationArray.from_euler(np.column_stack((x, y, z)), mode)[:, [1, 2, 3, 0]]
 
     def __exportBoneAnimation(self, armObj):
         if armObj is None:
@@ -277,26 +296,21 @@ class VMDExporter:
             if key_name in vmd_bone_anim:
                 raise ValueError(f"VMD bone name {key_name} collision")
 
-            frame_keys = vmd_bone_anim[key_name]
-
             get_xyzw = self.__xyzw_from_rotation_mode(bone.rotation_mode)
             converter = self.__bone_converter_cls(bone, self.__scale, invert=True)
-            prev_rot = None
-            for frame_number, x, y, z, rw, rx, ry, rz in self.__allFrameKeys(bone_curves):
-                key = vmd.BoneFrameKey()
-                key.frame_number = frame_number - self.__frame_start
-                key.location = converter.convert_location([x[0], y[0], z[0]])
-                curr_rot = converter.convert_rotation(get_xyzw([rx[0], ry[0], rz[0], rw[0]]))
-                if prev_rot is not None:
-                    curr_rot = self.__minRotationDiff(prev_rot, curr_rot)
-                prev_rot = curr_rot
-                key.rotation = curr_rot[1:] + curr_rot[0:1]  # (w, x, y, z) to (x, y, z, w)
+            frame_numbers, ((x, ix), (y, iy), (z, iz), (rw, irw), (rx, irx), (ry, iry), (rz, irz)) = self.__sampleAllFrames(bone_curves)
+            records = np.zeros(len(frame_numbers), dtype=vmd_bone_anim.recordDtype())
+            if len(records):
+                records["frame_number"] = frame_numbers - self.__frame_start
+                records["location"] = converter.convert_locations(np.column_stack((x, y, z)))
+                rotations = _FnRotationArray.compatible_quaternions(None, converter.convert_rotations(get_xyzw(rx, ry, rz, rw)))
+                records["rotation"] = rotations[:, [1, 2, 3, 0]]  # (w, x, y, z) to (x, y, z, w)
                 # FIXME we can only choose one interpolation from (rw, rx, ry, rz) for bone's rotation
-                ir = self.__pickRotationInterpolation([rw[1], rx[1], ry[1], rz[1]])
-                ix, iy, iz = converter.convert_interpolation([x[1], y[1], z[1]])
-                key.interp = self.__getVMDBoneInterpolation(ix, iy, iz, ir)
-                frame_keys.append(key)
-            logging.info("(bone) frames:%5d  name: %s", len(frame_keys), key_name)
+                ir = self.__pickRotationInterpolations([irw, irx, iry, irz])
+                ix, iy, iz = converter.convert_interpolation([ix, iy, iz])
+                records["interp"] = self.__getVMDBoneInterpolation(ix, iy, iz, ir)
+            vmd_bone_anim.setFrameData(key_name, records)
+            logging.info("(bone) frames:%5d  name: %s", len(records), key_name)
         logging.info("---- bone animations:%5d  source: %s", len(vmd_bone_anim), armObj.name)
         return vmd_bone_anim
 
@@ -337,17 +351,16 @@ class VMDExporter:
 
             key_name = kb.name
             assert key_name not in vmd_morph_anim
-            anim = vmd_morph_anim[key_name]
 
             curve = _FCurve(kb.value)
             curve.setFCurve(fcurve)
 
-            for frame_number, weight in self.__allFrameKeys([curve]):
-                key = vmd.ShapeKeyFrameKey()
-                key.frame_number = frame_number - self.__frame_start
-                key.weight = weight[0]
-                anim.append(key)
-            logging.info("(mesh) frames:%5d  name: %s", len(anim), key_name)
+            frame_numbers, ((weights, _),) = self.__sampleAllFrames([curve])
+            records = np.zeros(len(frame_numbers), dtype=vmd_morph_anim.recordDtype())
+            records["frame_number"] = frame_numbers - self.__frame_start
+            records["weight"] = weights
+            vmd_morph_anim.setFrameData(key_name, records)
+            logging.info("(mesh) frames:%5d  name: %s", len(records), key_name)
         logging.info("---- morph animations:%5d  source: %s", len(vmd_morph_anim), meshObj.name)
         return vmd_morph_anim
 
@@ -485,12 +498,15 @@ class VMDExporter:
         logging.info("(lamp) frames:%5d  name: %s", len(vmd_lamp_anim), mmd_lamp.name)
         return vmd_lamp_anim
 
-    def export(self, **args):
+    def build(self, **args):
+        """Return the vmd.File of the motion data to export, or None if there is nothing to export.
+
+        It takes the same arguments as export() except filepath.
+        """
         armature = args.get("armature", None)
         mesh = args.get("mesh", None)
         camera = args.get("camera", None)
         lamp = args.get("lamp", None)
-        filepath = args.get("filepath", "")
 
         self.__scale = args.get("scale", 1.0)
 
@@ -508,7 +524,7 @@ class VMDExporter:
             vmdFile.boneAnimation = self.__exportBoneAnimation(armature)
             vmdFile.shapeKeyAnimation = self.__exportMorphAnimation(mesh)
             vmdFile.propertyAnimation = self.__exportPropertyAnimation(armature)
-            vmdFile.save(filepath=filepath)
+            return vmdFile
 
         elif camera or lamp:
             vmdFile = vmd.File()
@@ -516,4 +532,27 @@ class VMDExporter:
             vmdFile.header.model_name = "カメラ・照明"
             vmdFile.cameraAnimation = self.__exportCameraAnimation(camera)
             vmdFile.lampAnimation = self.__exportLampAnimation(lamp)
-            vmdFile.save(filepath=filepath)
+            return vmdFile
+
+        return None
+
+    def export(self, **args):
+        vmdFile = self.build(**args)
+        if vmdFile is not None:
+            vmdFile.save(filepath=args.get("filepath", ""))
+
+
+def export_models(params_list, max_workers=None):
+    """Export the motion of several models concurrently, each item of params_list is the arguments of VMDExporter.export().
+
+    Blender data can only be accessed from the main thread, so the motions are sampled here one after another,
+    while the files are written by a thread pool as soon as they are ready.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for params in params_list:
+            vmdFile = VMDExporter().build(**params)
+            if vmdFile is not None:
+                futures.append(executor.submit(vmdFile.save, filepath=params.get("filepath", "")))
+        for future in futures:
+            future.result()
@@ -8,6 +8,7 @@ import os
 from typing import Union
 
 import bpy
+import numpy as np
 from mathutils import Quaternion, Vector
 
 from mmd_tools_local import utils
@@ -75,6 +76,216 @@ class _InterpolationHelper:
         return (interpolation_xyz[i] for i in self.__indices)
 
 
+class _FnRotationArray:
+    """Array versions of the mathutils rotation conversions used by the bone converters.
+
+    Quaternions are (n, 4) arrays in (w, x, y, z) order and matrices are (n, 3, 3) arrays indexed [row][col].
+    """
+
+    @staticmethod
+    def normalized(quats):
+        length = np.linalg.norm(quats, axis=1, keepdims=True)
+        result = np.divide(quats, length, out=np.zeros_like(quats), where=length != 0)
+        result[length[:, 0] == 0, 1] = 1  # same fallback as mathutils
+        return result
+
+    @staticmethod
+    def from_xyzw(rotations_xyzw):
+        return np.asarray(rotations_xyzw, dtype=np.float64)[:, [3, 0, 1, 2]]
+
+    @classmethod
+    def to_axis_angle(cls, quats):
+        q = cls.normalized(quats)
+        valid = np.abs(q[:, 0]) <= 1
+        half_angle = np.arccos(np.clip(q[:, 0], -1, 1))
+        si = np.sin(half_angle)
+        si[np.abs(si) < 0.0005] = 1
+        axis = q[:, 1:] / si[:, None]
+        axis[~axis.any(axis=1), 1] = 1
+        axis[~valid] = (1, 0, 0)
+        return axis, np.where(valid, half_angle * 2, 0)
+
+    @classmethod
+    def from_axis_angle(cls, axis, angle):
+        length = np.linalg.norm(axis, axis=1, keepdims=True)
+        axis = np.divide(axis, length, out=np.zeros_like(axis), where=length != 0)
+        angle = np.asarray(angle, dtype=np.float64)
+        half_angle = (angle + math.pi - 2 * math.pi * np.floor((angle + math.pi) / (2 * math.pi)) - math.pi) / 2  # wrapped to [-pi, pi]
+        half_angle[np.abs(half_angle) < 1e-12] = 0  # a full turn is no rotation, not a rounding error of it
+        result = np.column_stack((np.cos(half_angle), axis * np.sin(half_angle)[:, None]))
+        result[length[:, 0] == 0] = (1, 0, 0, 0)
+        return result
+
+    @classmethod
+    def rotate_axis(cls, mat, quats):
+        """Quaternion((mat @ q.axis) * -1, q.angle) of each quaternion."""
+        axis, angle = cls.to_axis_angle(quats)
+        angle = 2 * np.arccos(np.clip(cls.normalized(quats)[:, 0], -1, 1))
+        return cls.from_axis_angle(axis @ -np.asarray(mat).T, angle)
+
+    @staticmethod
+    def to_matrix(quats):
+        w, x, y, z = quats.T
+        return np.stack(
+            (
+                np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=-1),
+                np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=-1),
+                np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=-1),
+            ),
+            axis=1,
+        )
+
+    @classmethod
+    def from_matrix(cls, mats):
+        """Matrix.to_quaternion() of each matrix, the columns are normalized first."""
+        m = mats / np.linalg.norm(mats, axis=1, keepdims=True)
+        m[np.linalg.det(m) < 0] *= -1
+        m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+        m01, m02, m10, m12, m20, m21 = m[:, 0, 1], m[:, 0, 2], m[:, 1, 0], m[:, 1, 2], m[:, 2, 0], m[:, 2, 1]
+        use_w = m00 + m11 + m22 > 0
+        use_x = ~use_w & (m00 > m11) & (m00 > m22)
+        use_y = ~use_w & ~use_x & (m11 > m22)
+        use_z = ~(use_w | use_x | use_y)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            s = 2 * np.sqrt(np.select((use_x, use_y, use_z), (1 + m00 - m11 - m22, 1 - m00 + m11 - m22, 1 - m00 - m11 + m22), 1 + m00 + m11 + m22))
+            q = np.select(
+                (use_x[:, None], use_y[:, None], use_z[:, None]),
+                (
+                    np.column_stack(((m21 - m12) / s, 0.25 * s, (m10 + m01) / s, (m02 + m20) / s)),
+                    np.column_stack(((m02 - m20) / s, (m10 + m01) / s, 0.25 * s, (m21 + m12) / s)),
+                    np.column_stack(((m10 - m01) / s, (m02 + m20) / s, (m21 + m12) / s, 0.25 * s)),
+                ),
+                np.column_stack((0.25 * s, (m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s)),
+            )
+        q[q[:, 0] < 0] *= -1  # w is non-negative for a canonical result, like mathutils
+        return cls.normalized(q)
+
+    # (i, j, k, parity) of each euler order, the same as Blender's rotation order table
+    __EULER_ORDERS = {
+        "XYZ": (0, 1, 2, False),
+        "XZY": (0, 2, 1, True),
+        "YXZ": (1, 0, 2, True),
+        "YZX": (1, 2, 0, False),
+        "ZXY": (2, 0, 1, False),
+        "ZYX": (2, 1, 0, True),
+    }
+
+    @classmethod
+    def to_euler(cls, quats, order="XYZ"):
+        i, j, k, parity = cls.__EULER_ORDERS[order]
+        mat = cls.to_matrix(cls.normalized(quats)).transpose(0, 2, 1)  # indexed [col][row] like Blender
+        cy = np.hypot(mat[:, i, i], mat[:, i, j])
+        eul1 = np.empty((len(mat), 3))
+        eul2 = np.empty((len(mat), 3))
+        eul1[:, i] = np.arctan2(mat[:, j, k], mat[:, k, k])
+        eul1[:, j] = np.arctan2(-mat[:, i, k], cy)
+        eul1[:, k] = np.arctan2(mat[:, i, j], mat[:, i, i])
+        eul2[:, i] = np.arctan2(-mat[:, j, k], -mat[:, k, k])
+        eul2[:, j] = np.arctan2(-mat[:, i, k], -cy)
+        eul2[:, k] = np.arctan2(-mat[:, i, j], -mat[:, i, i])
+        gimbal = cy <= 16 * np.finfo(np.float32).eps
+        eul1[gimbal, i] = np.arctan2(-mat[gimbal, k, j], mat[gimbal, j, j])
+        eul1[gimbal, k] = 0
+        eul2[gimbal] = eul1[gimbal]
+        result = np.where((np.abs(eul1).sum(axis=1) > np.abs(eul2).sum(axis=1))[:, None], eul2, eul1)
+        return -result if parity else result
+
+    @classmethod
+    def from_euler(cls, eulers, order="XYZ"):
+        """Euler.to_quaternion() of each (x, y, z) euler."""
+        i, j, k, parity = cls.__EULER_ORDERS[order]
+        eulers = np.asarray(eulers, dtype=np.float64)
+        ti, tj, th = eulers[:, i] * 0.5, eulers[:, j] * (-0.5 if parity else 0.5), eulers[:, k] * 0.5
+        ci, cj, ch = np.cos(ti), np.cos(tj), np.cos(th)
+        si, sj, sh = np.sin(ti), np.sin(tj), np.sin(th)
+        cc, cs, sc, ss = ci * ch, ci * sh, si * ch, si * sh
+        result = np.empty((len(eulers), 4))
+        result[:, 0] = cj * cc + sj * ss
+        result[:, 1 + i] = cj * sc - sj * cs
+        result[:, 1 + j] = cj * ss + sj * cc
+        result[:, 1 + k] = cj * cs - sj * sc
+        if parity:
+            result[:, 1 + j] *= -1
+        return result
+
+    @staticmethod
+    def __flips(dots):
+        # the current value is negated if its dot product with the fixed previous value is negative,
+        # so it flips relative to the previous sign if dots < 0 and keeps it if dots > 0,
+        # while dots == 0 always keeps the current value as it is
+        flip = np.where(dots < 0, 1, 0)
+        flip[dots == 0] = -1
+        return flip
+
+    @staticmethod
+    def __flip_signs(flip):
+        """Signs of a chain where each element is negated relative to its (already fixed) predecessor if flip says so."""
+        # flip: 1 (negate relative to prev), 0 (keep relative to prev), -1 (restart with +1)
+        step = np.where(flip == 1, -1, 1)
+        chain = np.cumprod(step)
+        restart = np.where(flip == -1, np.arange(len(flip)), 0)
+        np.maximum.accumulate(restart, out=restart)
+        return chain * chain[restart] * step[restart]
+
+    @classmethod
+    def compatible_quaternions(cls, prev, quats):
+        """Pick the sign of each quaternion with the smaller difference to the previous one, like VMDImporter.__minRotationDiff."""
+        quats = np.array(quats, dtype=np.float64)
+        if len(quats) == 0:
+            return quats
+        dots = np.empty(len(quats))
+        dots[1:] = np.einsum("ij,ij->i", quats[:-1], quats[1:])
+        dots[0] = np.dot(np.asarray(prev, dtype=np.float64), quats[0]) if prev is not None else 0
+        return quats * cls.__flip_signs(cls.__flips(dots))[:, None]
+
+    @classmethod
+    def compatible_axis_angles(cls, prev, rotations):
+        """Make each (angle, x, y, z) compatible with the previous one, like the axis angle converter of VMDImporter."""
+        rotations = np.array(rotations, dtype=np.float64)
+        if len(rotations) == 0:
+            return rotations
+        prev = np.asarray(prev, dtype=np.float64) if prev is not None else None
+        dots = np.empty(len(rotations))
+        dots[1:] = np.einsum("ij,ij->i", rotations[:-1, 1:], rotations[1:, 1:])
+        dots[0] = np.dot(prev[1:], rotations[0, 1:]) if prev is not None else 0
+        rotations *= cls.__flip_signs(cls.__flips(dots))[:, None]
+
+        angles = rotations[:, 0]
+        diff = np.empty(len(angles))
+        diff[1:] = angles[:-1] - angles[1:]
+        diff[0] = prev[0] - angles[0] if prev is not None else 0
+        pi_2 = math.pi * 2
+        turns = np.where(np.abs(diff) > math.pi, np.trunc(np.where(diff < 0, -0.5, 0.5) + diff / pi_2), 0)
+        angles += np.cumsum(turns) * pi_2
+        return rotations
+
+    @staticmethod
+    def compatible_eulers(prev, eulers):
+        """Make each euler compatible with the previous one, like mathutils.Euler.make_compatible."""
+        result = np.array(eulers, dtype=np.float64)
+        if prev is None:
+            if len(result) == 0:
+                return result
+            prev = result[0]
+        pi_2 = 2 * math.pi
+        prev = list(prev)
+        for index, eul in enumerate(result.tolist()):
+            deul = [0.0, 0.0, 0.0]
+            for i in range(3):
+                deul[i] = eul[i] - prev[i]
+                if deul[i] > 5.1:
+                    eul[i] -= math.floor(deul[i] / pi_2 + 0.5) * pi_2
+                    deul[i] = eul[i] - prev[i]
+                elif deul[i] < -5.1:
+                    eul[i] += math.floor(-deul[i] / pi_2 + 0.5) * pi_2
+                    deul[i] = eul[i] - prev[i]
+            for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+                if abs(deul[i]) > 3.2 and abs(deul[j]) < 1.6 and abs(deul[k]) < 1.6:
+                    eul[i] += -pi_2 if deul[i] > 0 else pi_2
+            result[index] = prev = eul
+        return result
+
+
 class BoneConverter:
     def __init__(self, pose_bone, scale, invert=False):
         mat = pose_bone.bone.matrix_local.to_3x3()
@@ -83,6 +294,7 @@ class BoneConverter:
         self.__scale = scale
         if invert:
             self.__mat.invert()
+        self.__mat_array = np.array(self.__mat, dtype=np.float64)
         self.convert_interpolation = _InterpolationHelper(self.__mat).convert
 
     def convert_location(self, location):
@@ -93,6 +305,15 @@ class BoneConverter:
         rot.x, rot.y, rot.z, rot.w = rotation_xyzw
         return Quaternion((self.__mat @ rot.axis) * -1, rot.angle).normalized()
 
+    def convert_locations(self, locations):
+        """Array version of convert_location, (n, 3) locations to (n, 3) locations."""
+        return (np.asarray(locations, dtype=np.float64) @ self.__mat_array.T) * self.__scale
+
+    def convert_rotations(self, rotations_xyzw):
+        """Array version of convert_rotation, (n, 4) (x, y, z, w) rotations to (n, 4) (w, x, y, z) quaternions."""
+        quats = _FnRotationArray.from_xyzw(rotations_xyzw)
+        return _FnRotationArray.normalized(_FnRotationArray.rotate_axis(self.__mat_array, quats))
+
 
 class BoneConverterPoseMode:
     def __init__(self, pose_bone, scale, invert=False):
@@ -105,12 +326,20 @@ class BoneConverterPoseMode:
         self.__offset = pose_bone.location.copy()
         self.convert_location = self._convert_location
         self.convert_rotation = self._convert_rotation
+        self.convert_locations = self._convert_locations
+        self.convert_rotations = self._convert_rotations
         if invert:
             self.__mat.invert()
             self.__mat_rot.invert()
             self.__mat_loc.invert()
             self.convert_location = self._convert_location_inverted
             self.convert_rotation = self._convert_rotation_inverted
+            self.convert_locations = self._convert_locations_inverted
+            self.convert_rotations = self._convert_rotations_inverted
+        self.__mat_array = np.array(self.__mat, dtype=np.float64)
+        self.__mat_rot_array = np.array(self.__mat_rot, dtype=np.float64)
+        self.__mat_loc_array = np.array(self.__mat_loc, dtype=np.float64)
+        self.__offset_array = np.array(self.__offset, dtype=np.float64)
         self.convert_interpolation = _InterpolationHelper(self.__mat_loc).convert
 
     def _convert_location(self, location):
@@ -131,6 +360,21 @@ class BoneConverterPoseMode:
         rot = (self.__mat_rot @ rot.to_matrix()).to_quaternion()
         return Quaternion((self.__mat @ rot.axis) * -1, rot.angle).normalized()
 
+    def _convert_locations(self, locations):
+        return self.__offset_array + (np.asarray(locations, dtype=np.float64) @ self.__mat_loc_array.T) * self.__scale
+
+    def _convert_rotations(self, rotations_xyzw):
+        quats = _FnRotationArray.rotate_axis(self.__mat_array, _FnRotationArray.from_xyzw(rotations_xyzw))
+        return _FnRotationArray.from_matrix(self.__mat_rot_array @ _FnRotationArray.to_matrix(quats))
+
+    def _convert_locations_inverted(self, locations):
+        return ((np.asarray(locations, dtype=np.float64) - self.__offset_array) @ self.__mat_loc_array.T) * self.__scale
+
+    def _convert_rotations_inverted(self, rotations_xyzw):
+        quats = _FnRotationArray.from_xyzw(rotations_xyzw)
+        quats = _FnRotationArray.from_matrix(self.__mat_rot_array @ _FnRotationArray.to_matrix(quats))
+        return _FnRotationArray.normalized(_FnRotationArray.rotate_axis(self.__mat_array, quats))
+
 
 class _FnBezier:
     @classmethod
@@ -296,6 +540,51 @@ class VMDImporter:
         kp.handle_right_type = "FREE"
         kp.handle_right = kp.co + Vector((1, 0))
 
+    @staticmethod
+    def __setKeyframePoints(fcurve, frames, values, bezier, default_value=None):
+        """Write all keyframe points of fcurve at once.
+
+        bezier[i] is the VMD interpolation (x1, y1, x2, y2) of the curve from key i-1 to key i.
+        A LINEAR key at frame 1 is inserted before the keys if default_value is not None.
+        """
+        enum_items = bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items
+        LINEAR, BEZIER = enum_items["LINEAR"].value, enum_items["BEZIER"].value
+        enum_items = bpy.types.Keyframe.bl_rna.properties["handle_left_type"].enum_items
+        FREE, AUTO_CLAMPED = enum_items["FREE"].value, enum_items["AUTO_CLAMPED"].value
+
+        count = len(frames)
+        co = np.empty((count, 2), dtype=np.float32)
+        co[:, 0] = frames
+        co[:, 1] = values
+        co64 = co.astype(np.float64)
+        d = (co64[1:] - co64[:-1]) / 127.0
+        handle_left = co64 - (1, 0)
+        handle_right = co64 + (1, 0)
+        handle_right[:-1] = co64[:-1] + d * bezier[1:, 0:2]
+        handle_left[1:] = co64[:-1] + d * bezier[1:, 2:4]
+        interpolation = np.full(count, BEZIER, dtype=np.int32)
+        interpolation[:-1] = np.where((bezier[1:, 0] == bezier[1:, 1]) & (bezier[1:, 2] == bezier[1:, 3]), LINEAR, BEZIER)
+        handle_left_type = np.full(count, FREE, dtype=np.int32)
+        handle_right_type = np.full(count, FREE, dtype=np.int32)
+
+        if default_value is not None:
+            co = np.vstack(((1, default_value), co)).astype(np.float32)
+            handle_left = np.vstack(((0, default_value), handle_left))
+            handle_right = np.vstack(((2, default_value), handle_right))
+            interpolation = np.append(LINEAR, interpolation).astype(np.int32)
+            handle_left_type = np.append(FREE, handle_left_type).astype(np.int32)
+            handle_right_type = np.append(AUTO_CLAMPED, handle_right_type).astype(np.int32)
+            handle_left_type[1] = AUTO_CLAMPED
+
+        keyframe_points = fcurve.keyframe_points
+        keyframe_points.add(len(co))
+        keyframe_points.foreach_set("co", co.ravel())
+        keyframe_points.foreach_set("handle_left", handle_left.astype(np.float32).ravel())
+        keyframe_points.foreach_set("handle_right", handle_right.astype(np.float32).ravel())
+        keyframe_points.foreach_set("interpolation", interpolation)
+        keyframe_points.foreach_set("handle_left_type", handle_left_type)
+        keyframe_points.foreach_set("handle_right_type", handle_right_type)
+
     @staticmethod
     def __keyframe_insert_inner(fcurves: bpy.types.ActionFCurves, path: str, index: int, frame: float, value: float):
         fcurve = fcurves.find(path, index=index)
@@ -323,10 +612,13 @@ class VMDImporter:
 
         class _ConverterWrap:
             convert_location = converter.convert_location
+            convert_locations = converter.convert_locations
             convert_interpolation = converter.convert_interpolation
             if mode == "QUATERNION":
                 convert_rotation = converter.convert_rotation
                 compatible_rotation = compatible_quaternion
+                convert_rotations = converter.convert_rotations
+                compatible_rotations = _FnRotationArray.compatible_quaternions
             elif mode == "AXIS_ANGLE":
 
                 @staticmethod
@@ -346,9 +638,18 @@ class VMDImporter:
                         angle += int(bias + angle_diff / pi_2) * pi_2
                     return (angle, x, y, z)
 
+                @staticmethod
+                def convert_rotations(rots):
+                    axis, angle = _FnRotationArray.to_axis_angle(converter.convert_rotations(rots))
+                    return np.column_stack((angle, axis))
+
+                compatible_rotations = _FnRotationArray.compatible_axis_angles
+
             else:
                 convert_rotation = lambda rot: converter.convert_rotation(rot).to_euler(mode)
                 compatible_rotation = lambda prev, curr: curr.make_compatible(prev) or curr
+                convert_rotations = lambda rots: _FnRotationArray.to_euler(converter.convert_rotations(rots), mode)
+                compatible_rotations = _FnRotationArray.compatible_eulers
 
         return _ConverterWrap
 
@@ -380,15 +681,11 @@ class VMDImporter:
         if self.__bone_mapper:
             pose_bones = self.__bone_mapper(armObj)
 
-        _loc = _rot = lambda i: i
+        loc_sign = rot_sign = 1
         if self.__mirror:
             pose_bones = _MirrorMapper(pose_bones)
-            _loc, _rot = _MirrorMapper.get_location, _MirrorMapper.get_rotation
-
-        class _Dummy:
-            pass
+            loc_sign, rot_sign = np.array(_MirrorMapper.get_location((1, 1, 1))), np.array(_MirrorMapper.get_rotation((1, 1, 1, 1)))
 
-        dummy_keyframe_points = iter(lambda: _Dummy, None)
         prop_rot_map = {"QUATERNION": "rotation_quaternion", "AXIS_ANGLE": "rotation_axis_angle"}
 
         bone_name_table = {}
@@ -404,59 +701,43 @@ class VMDImporter:
             assert bone_name_table.get(bone.name, name) == name
             bone_name_table[bone.name] = name
 
-            fcurves = [dummy_keyframe_points] * 7  # x, y, z, r0, r1, r2, (r3)
             data_path_rot = prop_rot_map.get(bone.rotation_mode, "rotation_euler")
             bone_rotation = getattr(bone, data_path_rot)
             default_values = list(bone.location) + list(bone_rotation)
+            fcurves = []  # x, y, z, r0, r1, r2, (r3)
             data_path = 'pose.bones["%s"].location' % bone.name
             for axis_i in range(3):
-                fcurves[axis_i] = action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name)
+                fcurves.append(action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name))
             data_path = 'pose.bones["%s"].%s' % (bone.name, data_path_rot)
             for axis_i in range(len(bone_rotation)):
-                fcurves[3 + axis_i] = action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name)
-
-            for i in range(len(default_values)):
-                c = fcurves[i]
-                c.keyframe_points.add(extra_frame + num_frame)
-                kp_iter = iter(c.keyframe_points)
-                if extra_frame:
-                    kp = next(kp_iter)
-                    kp.co = (1, default_values[i])
-                    kp.interpolation = "LINEAR"
-                fcurves[i] = kp_iter
+                fcurves.append(action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name))
+
+            frame_data = boneAnim.frameData(name)
+            if frame_data is None:
+                keyFrames = sorted(keyFrames, key=lambda x: x.frame_number)
+                frames = np.array([k.frame_number for k in keyFrames], dtype=np.float64)
+                locations = np.array([k.location for k in keyFrames], dtype=np.float64).reshape(-1, 3)
+                rotations = np.array([k.rotation for k in keyFrames], dtype=np.float64).reshape(-1, 4)
+                interps = np.array([k.interp for k in keyFrames], dtype=np.float64).reshape(-1, 64)
+            else:
+                frames = frame_data["frame_number"].astype(np.float64)
+                locations = frame_data["location"].astype(np.float64)
+                rotations = frame_data["rotation"].astype(np.float64)
+                interps = frame_data["interp"].astype(np.float64)
 
             converter = self.__getBoneConverter(bone)
-            prev_rot = bone_rotation if extra_frame else None
-            prev_kps, indices = None, tuple(converter.convert_interpolation((0, 16, 32))) + (48,) * len(bone_rotation)
-            keyFrames.sort(key=lambda x: x.frame_number)
-            for k, x, y, z, r0, r1, r2, r3 in zip(keyFrames, *fcurves):
-                frame = k.frame_number + self.__frame_margin
-                loc = converter.convert_location(_loc(k.location))
-                curr_rot = converter.convert_rotation(_rot(k.rotation))
-                if prev_rot is not None:
-                    curr_rot = converter.compatible_rotation(prev_rot, curr_rot)
-                    # FIXME the rotation interpolation has slightly different result
-                    #   Blender: rot(x) = prev_rot*(1 - bezier(t)) + curr_rot*bezier(t)
-                    #       MMD: rot(x) = prev_rot.slerp(curr_rot, factor=bezier(t))
-                prev_rot = curr_rot
-
-                x.co = (frame, loc[0])
-                y.co = (frame, loc[1])
-                z.co = (frame, loc[2])
-                r0.co = (frame, curr_rot[0])
-                r1.co = (frame, curr_rot[1])
-                r2.co = (frame, curr_rot[2])
-                r3.co = (frame, curr_rot[-1])
-
-                curr_kps = (x, y, z, r0, r1, r2, r3)
-                if prev_kps is not None:
-                    interp = k.interp
-                    for idx, prev_kp, kp in zip(indices, prev_kps, curr_kps):
-                        self.__setInterpolation(interp[idx : idx + 16 : 4], prev_kp, kp)
-                prev_kps = curr_kps
-
-        for c in action.fcurves:
-            self.__fixFcurveHandles(c)
+            rotations = converter.convert_rotations(rotations * rot_sign)
+            # FIXME the rotation interpolation has slightly different result
+            #   Blender: rot(x) = prev_rot*(1 - bezier(t)) + curr_rot*bezier(t)
+            #       MMD: rot(x) = prev_rot.slerp(curr_rot, factor=bezier(t))
+            rotations = converter.compatible_rotations(bone_rotation if extra_frame else None, rotations)
+            values = np.column_stack((converter.convert_locations(locations * loc_sign), rotations))
+
+            frames += self.__frame_margin
+            indices = tuple(converter.convert_interpolation((0, 16, 32))) + (48,) * len(bone_rotation)
+            for i, (c, idx) in enumerate(zip(fcurves, indices)):
+                default_value = default_values[i] if extra_frame else None
+                self.__setKeyframePoints(c, frames, values[:, i], interps[:, idx : idx + 16 : 4], default_value)
 
         # # ensure IK's default state
         # for b in armObj.pose.bones:
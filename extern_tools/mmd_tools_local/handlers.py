@@ -16,8 +16,9 @@ class MMDHanders:
         FnSDEF.clear_cache()
         FnSDEF.register_driver_function()
 
-        from mmd_tools_local.core.material import MigrationFnMaterial
+        from mmd_tools_local.core.material import FnMaterial, MigrationFnMaterial
 
+        FnMaterial.clear_image_index()
         MigrationFnMaterial.update_mmd_shader()
 
         from mmd_tools_local.core.morph import MigrationFnMorph
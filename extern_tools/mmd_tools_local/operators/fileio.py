@@ -154,6 +154,24 @@ class ImportPmx(Operator, ImportHelper):
         description="The diffuse color factor of texture slot for .spa textures",
         default=1.0,
     )
+    parallel_morphs: bpy.props.BoolProperty(
+        name="Prepare Morphs in Parallel",
+        description="Compute the shape keys of vertex morphs in batches on worker threads",
+        default=True,
+    )
+    vertex_custom_normals: bpy.props.BoolProperty(
+        name="Per-Vertex Custom Normals",
+        description="Set custom normals per vertex instead of per face corner when the merged vertices share the same normal",
+        default=True,
+    )
+    texture_prefetch_workers: bpy.props.IntProperty(
+        name="Texture Prefetch Workers",
+        description="Number of threads reading texture files ahead of loading them (0 to disable)",
+        min=0,
+        soft_max=16,
+        max=64,
+        default=4,
+    )
     log_level: bpy.props.EnumProperty(
         name="Log level",
         description="Select log level",
@@ -165,6 +183,12 @@ class ImportPmx(Operator, ImportHelper):
         description="Create a log file",
         default=False,
     )
+    trace_filepath: bpy.props.StringProperty(
+        name="Profile Trace File",
+        description="Write the timing and memory of each import phase to this file as a Chrome trace (JSON), leave empty to disable",
+        subtype="FILE_PATH",
+        default="",
+    )
 
     def execute(self, context):
         try:
@@ -206,6 +230,10 @@ class ImportPmx(Operator, ImportHelper):
                 use_mipmap=self.use_mipmap,
                 sph_blend_factor=self.sph_blend_factor,
                 spa_blend_factor=self.spa_blend_factor,
+                parallel_morphs=self.parallel_morphs,
+                texture_prefetch_workers=self.texture_prefetch_workers,
+                vertex_custom_normals=self.vertex_custom_normals,
+                trace_filepath=bpy.path.abspath(self.trace_filepath),
             )
             self.report({"INFO"}, 'Imported MMD model from "%s"' % self.filepath)
         except Exception as e:
@@ -503,6 +531,26 @@ class ExportPmx(Operator, ExportHelper):
         ],
         default="NONE",
     )
+    shape_key_chunk_size: bpy.props.IntProperty(
+        name="Shape Key Chunk Size",
+        description="Number of shape keys whose vertex offsets are computed together, larger values use more memory",
+        min=1,
+        soft_max=256,
+        default=16,
+    )
+    mesh_workers: bpy.props.IntProperty(
+        name="Mesh Workers",
+        description="Number of threads processing the data of the meshes (1 to process the meshes one after another)",
+        min=1,
+        soft_max=16,
+        max=64,
+        default=1,
+    )
+    streaming: bpy.props.BoolProperty(
+        name="Streaming Export",
+        description="Gather the vertices from the meshes while they are written and release each section once it is written, so large scenes are exported with less memory",
+        default=False,
+    )
     log_level: bpy.props.EnumProperty(
         name="Log level",
         description="Select log level",
@@ -576,6 +624,9 @@ class ExportPmx(Operator, ExportHelper):
                 translate_in_presets=self.translate_in_presets,
                 sort_materials=self.sort_materials,
                 sort_vertices=self.sort_vertices,
+                shape_key_chunk_size=self.shape_key_chunk_size,
+                mesh_workers=self.mesh_workers,
+                streaming=self.streaming,
                 disable_specular=self.disable_specular,
             )
             self.report({"INFO"}, 'Exported MMD model "%s" to "%s"' % (root.name, self.filepath))
@@ -617,6 +668,11 @@ class ExportVmd(Operator, ExportHelper):
         description="Export frames only in the frame range of context scene",
         default=False,
     )
+    use_selected_models: bpy.props.BoolProperty(
+        name="Selected Models",
+        description="Export the motion of each selected MMD model concurrently, to the files named after the models in the folder of the file path",
+        default=False,
+    )
 
     @classmethod
     def poll(cls, context):
@@ -633,6 +689,15 @@ class ExportVmd(Operator, ExportHelper):
 
         return False
 
+    @staticmethod
+    def __model_params(root):
+        rig = mmd_model.Model(root)
+        return {
+            "mesh": rig.morph_slider.placeholder(binded=True) or rig.firstMesh(),
+            "armature": rig.armature(),
+            "model_name": root.mmd_root.name or root.name,
+        }
+
     def execute(self, context):
         params = {
             "filepath": self.filepath,
@@ -641,12 +706,27 @@ class ExportVmd(Operator, ExportHelper):
             "use_frame_range": self.use_frame_range,
         }
 
+        models = {mmd_model.Model.findRoot(i) for i in context.selected_objects} - {None}
+        if self.use_selected_models and len(models) > 1:
+            folder = os.path.dirname(self.filepath)
+            params_list = []
+            for root in models:
+                model_params = dict(params, filepath=os.path.join(folder, bpy.path.clean_name(root.name) + ".vmd"))
+                model_params.update(self.__model_params(root))
+                params_list.append(model_params)
+            try:
+                start_time = time.time()
+                vmd_exporter.export_models(params_list)
+                logging.info(" Finished exporting motion of %d models in %f seconds.", len(params_list), time.time() - start_time)
+            except Exception as e:
+                err_msg = traceback.format_exc()
+                logging.error(err_msg)
+                self.report({"ERROR"}, err_msg)
+            return {"FINISHED"}
+
         obj = context.active_object
         if obj.mmd_type == "ROOT":
-            rig = mmd_model.Model(obj)
-            params["mesh"] = rig.morph_slider.placeholder(binded=True) or rig.firstMesh()
-            params["armature"] = rig.armature()
-            params["model_name"] = obj.mmd_root.name or obj.name
+            params.update(self.__model_params(obj))
         elif getattr(obj.data, "shape_keys", None):
             params["mesh"] = obj
             params["model_name"] = obj.name
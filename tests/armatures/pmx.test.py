@@ -0,0 +1,87 @@
+# GPL License
+
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+
+from mmd_tools_local.core import pmx
+
+
+def create_model(weight_types):
+    vertex_count = len(weight_types)
+    rng = np.random.default_rng(0)
+    data = pmx.VertexData(vertex_count)
+    data.co[:] = rng.random((vertex_count, 3), dtype=np.float32)
+    data.normal[:] = (0, 1, 0)
+    data.uv[:] = rng.random((vertex_count, 2), dtype=np.float32)
+    data.edge_scale[:] = 1
+    data.weight_type[:] = weight_types
+    for t in np.unique(data.weight_type).tolist():
+        rows = np.flatnonzero(data.weight_type == t)
+        if t == pmx.BoneWeight.BDEF1:
+            data.bones[rows, 0] = rows % 4
+            data.weights[rows, 0] = 1
+        elif t == pmx.BoneWeight.BDEF4:
+            data.bones[rows] = (0, 1, 2, 3)
+            data.weights[rows] = (0.25, 0.25, 0.25, 0.25)
+        else:
+            data.bones[rows, :2] = (1, 0)
+            data.weights[rows, :2] = (0.75, 0.25)
+            if t == pmx.BoneWeight.SDEF:
+                data.sdef_c[rows] = rng.random((len(rows), 3), dtype=np.float32)
+                data.sdef_r0[rows] = rng.random((len(rows), 3), dtype=np.float32)
+                data.sdef_r1[rows] = rng.random((len(rows), 3), dtype=np.float32)
+
+    model = pmx.Model()
+    model.name = model.name_e = 'Round Trip'
+    model.setVertexData(data)
+    model.setFaceData(np.arange(vertex_count - vertex_count % 3, dtype=np.int64).reshape(-1, 3))
+    for i in range(4):
+        bone = pmx.Bone()
+        bone.name = bone.name_e = 'Bone%d' % i
+        bone.location = [0.0, 0.0, 0.0]
+        model.bones.append(bone)
+    morph = pmx.VertexMorph(name='Morph', name_e='Morph', category=pmx.Morph.CATEGORY_OHTER)
+    offsets = np.zeros(3, dtype=[('index', np.int64), ('offset', np.float32, 3)])
+    offsets['index'] = (0, 1, vertex_count - 1)
+    offsets['offset'] = rng.random((3, 3), dtype=np.float32)
+    morph.setOffsetData(offsets)
+    model.morphs.append(morph)
+    return model
+
+
+class TestAddon(unittest.TestCase):
+    def assert_round_trip(self, model):
+        data = model.vertex_data
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'model.pmx')
+            pmx.save(filepath, model)
+            with open(filepath, 'rb') as f:
+                saved = f.read()
+            for use_mmap in (False, True):
+                loaded = pmx.load(filepath, mmap=use_mmap)
+                for name, value in vars(data).items():
+                    np.testing.assert_array_equal(getattr(loaded.vertex_data, name), value, err_msg=name)
+                np.testing.assert_array_equal(loaded.face_data, model.face_data)
+                self.assertEqual([(x.index, x.offset) for x in loaded.morphs[0].offsets], [(x.index, x.offset) for x in model.morphs[0].offsets])
+
+                resaved_filepath = os.path.join(directory, 'resaved.pmx')
+                pmx.save(resaved_filepath, loaded)
+                with open(resaved_filepath, 'rb') as f:
+                    self.assertEqual(f.read(), saved)
+                del loaded
+
+    def test_bdef1_round_trip(self):
+        self.assert_round_trip(create_model([pmx.BoneWeight.BDEF1] * 300))
+
+    def test_mixed_weights_round_trip(self):
+        weight_types = [pmx.BoneWeight.BDEF1, pmx.BoneWeight.BDEF2, pmx.BoneWeight.BDEF4, pmx.BoneWeight.SDEF] * 75
+        self.assert_round_trip(create_model(weight_types))
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
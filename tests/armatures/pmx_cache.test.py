@@ -0,0 +1,197 @@
+# GPL License
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from mmd_tools_local.core import pmx
+from mmd_tools_local.core.pmx.cache import PMXCache
+
+
+def create_model(name, directory, vertex_count=30):
+    rng = np.random.default_rng(0)
+    data = pmx.VertexData(vertex_count, 1)
+    data.co[:] = rng.random((vertex_count, 3), dtype=np.float32)
+    data.normal[:] = (0, 1, 0)
+    data.uv[:] = rng.random((vertex_count, 2), dtype=np.float32)
+    data.additional_uvs[:] = rng.random((vertex_count, 1, 4), dtype=np.float32)
+    data.weight_type[:] = pmx.BoneWeight.BDEF1
+    data.bones[:, 0] = 0
+    data.weights[:, 0] = 1
+
+    model = pmx.Model()
+    model.name = name
+    model.name_e = 'Cache'
+    model.comment = 'comment'
+    model.setVertexData(data)
+    model.setFaceData(np.arange(vertex_count, dtype=np.int64).reshape(-1, 3))
+
+    for path in ('tex/body.png', 'toon.bmp'):
+        texture = pmx.Texture()
+        texture.path = os.path.join(directory, path)
+        model.textures.append(texture)
+
+    material = pmx.Material()
+    material.name = material.name_e = 'Body'
+    material.diffuse = (1.0, 0.5, 0.25, 1.0)
+    material.specular = (0.0, 0.0, 0.0)
+    material.ambient = (0.5, 0.5, 0.5)
+    material.edge_color = (0.0, 0.0, 0.0, 1.0)
+    material.texture = 0
+    material.vertex_count = vertex_count
+    model.materials.append(material)
+
+    for i in range(3):
+        bone = pmx.Bone()
+        bone.name = bone.name_e = 'Bone%d' % i
+        bone.location = (0.0, float(i), 0.0)
+        bone.parent = i - 1 if i else None
+        model.bones.append(bone)
+    model.bones[1].axis = (0.0, 0.0, 1.0)
+    model.bones[1].localCoordinate = pmx.Coordinate((1.0, 0.0, 0.0), (0.0, 0.0, 1.0))
+    model.bones[1].displayConnection = (0.0, 1.0, 0.0)
+    model.bones[2].isIK = True
+    model.bones[2].target = 1
+    link = pmx.IKLink()
+    link.target = 0
+    link.minimumAngle = (-1.0, 0.0, 0.0)
+    link.maximumAngle = (1.0, 0.0, 0.0)
+    model.bones[2].ik_links.append(link)
+
+    vertex_morph = pmx.VertexMorph('Vertex', 'Vertex', pmx.Morph.CATEGORY_EYE)
+    vertex_morph.setOffsetData(np.array([(1, (0.5, 0.0, 0.0))], dtype=[('index', np.int64), ('offset', np.float32, 3)]))
+    uv_morph = pmx.UVMorph('UV', 'UV', pmx.Morph.CATEGORY_OHTER, type_index=4)
+    uv_morph.setOffsetData(np.array([(2, (0.5, 0.0, 0.0, 0.0))], dtype=[('index', np.int64), ('offset', np.float32, 4)]))
+    bone_morph = pmx.BoneMorph('Bone', 'Bone', pmx.Morph.CATEGORY_OHTER)
+    bone_morph.setOffsetData(np.array([(1, (0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0))], dtype=pmx.BoneMorph.offsetDtype(pmx.Header(model))))
+    material_morph = pmx.MaterialMorph('Material', 'Material', pmx.Morph.CATEGORY_OHTER)
+    offset = pmx.MaterialMorphOffset()
+    offset.diffuse_offset = (0.0, 0.0, 0.0, 1.0)
+    offset.specular_offset = offset.ambient_offset = (0.0, 0.0, 0.0)
+    offset.edge_color_offset = offset.texture_factor = offset.sphere_texture_factor = offset.toon_texture_factor = (1.0, 1.0, 1.0, 1.0)
+    offset.edge_size_offset = 1.0
+    material_morph.offsets.append(offset)
+    group_morph = pmx.GroupMorph('Group', 'Group', pmx.Morph.CATEGORY_MOUTH)
+    offset = pmx.GroupMorphOffset()
+    offset.morph = 0
+    offset.factor = 0.5
+    group_morph.offsets.append(offset)
+    model.morphs.extend((vertex_morph, uv_morph, bone_morph, material_morph, group_morph))
+
+    model.display[0].data.append((0, 0))
+    model.display[1].data.append((1, 0))
+
+    rigid = pmx.Rigid()
+    rigid.name = rigid.name_e = 'Rigid'
+    rigid.bone = 0
+    rigid.size = rigid.location = rigid.rotation = (1.0, 1.0, 1.0)
+    rigid.velocity_attenuation = rigid.rotation_attenuation = rigid.bounce = rigid.friction = 0.5
+    model.rigids.extend((rigid, rigid))
+    joint = pmx.Joint()
+    joint.name = joint.name_e = 'Joint'
+    joint.src_rigid, joint.dest_rigid = 0, 1
+    joint.location = joint.rotation = joint.maximum_location = joint.minimum_location = (0.0, 0.0, 0.0)
+    joint.maximum_rotation = joint.minimum_rotation = joint.spring_constant = joint.spring_rotation_constant = (0.0, 0.0, 0.0)
+    model.joints.append(joint)
+    return model
+
+
+class TestAddon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save_model(self, name, filename='model.pmx', subdirectory='models'):
+        filepath = os.path.join(self.directory, subdirectory, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        pmx.save(filepath, create_model(name, os.path.dirname(filepath)))
+        return filepath
+
+    def assert_same(self, a, b, path='model'):
+        self.assertIs(type(a), type(b), path)
+        if isinstance(a, np.ndarray):
+            self.assertEqual(a.dtype, b.dtype, path)
+            np.testing.assert_array_equal(a, b, err_msg=path)
+        elif isinstance(a, pmx.ArrayBackedList):
+            self.assert_same(a.data, b.data, path + '.data')
+        elif isinstance(a, (list, tuple)):
+            self.assertEqual(len(a), len(b), path)
+            for i, (x, y) in enumerate(zip(a, b)):
+                self.assert_same(x, y, '%s[%d]' % (path, i))
+        elif hasattr(a, '__dict__'):
+            self.assertEqual(sorted(vars(a)), sorted(vars(b)), path)
+            for name, value in vars(a).items():
+                self.assert_same(value, getattr(b, name), path + '.' + name)
+        else:
+            self.assertEqual(a, b, path)
+
+    def test_hit(self):
+        filepath = self.save_model('Hit')
+        cache = PMXCache(self.cache_directory, 1 << 30)
+        cache.load(filepath)
+        model = cache.load(filepath)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assert_same(model, pmx.load(filepath))
+
+        # a new cache instance reads the index and the entry from the disk
+        cache = PMXCache(self.cache_directory, 1 << 30)
+        model = cache.load(filepath)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        resaved_filepath = os.path.join(self.directory, 'models', 'resaved.pmx')
+        pmx.save(resaved_filepath, model)
+        with open(filepath, 'rb') as f, open(resaved_filepath, 'rb') as f_resaved:
+            self.assertEqual(f.read(), f_resaved.read())
+
+    def test_miss_after_mtime_change(self):
+        filepath = self.save_model('Old!')
+        cache = PMXCache(self.cache_directory, 1 << 30)
+        self.assertEqual(cache.load(filepath).name, 'Old!')
+
+        # same size, only the modification time tells the index that the file changed
+        size, mtime = os.path.getsize(filepath), os.stat(filepath).st_mtime_ns
+        pmx.save(filepath, create_model('New!', os.path.dirname(filepath)))
+        os.utime(filepath, ns=(mtime + 10**9, mtime + 10**9))
+        self.assertEqual(os.path.getsize(filepath), size)
+        self.assertEqual(cache.load(filepath).name, 'New!')
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_copied_file(self):
+        filepath = self.save_model('Copy')
+        cache = PMXCache(self.cache_directory, 1 << 30)
+        cache.load(filepath)
+        copied_filepath = os.path.join(self.directory, 'copy', 'model.pmx')
+        os.makedirs(os.path.dirname(copied_filepath))
+        shutil.copy(filepath, copied_filepath)
+
+        model = cache.load(copied_filepath)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(model.filepath, copied_filepath)
+        self.assertEqual([x.path for x in model.textures], [x.path for x in pmx.load(copied_filepath).textures])
+        self.assertTrue(model.textures[0].path.startswith(os.path.join(self.directory, 'copy')))
+
+    def test_eviction(self):
+        first_filepath = self.save_model('First', 'first.pmx')
+        second_filepath = self.save_model('Second', 'second.pmx')
+        cache = PMXCache(self.cache_directory, 1 << 30)
+        cache.load(first_filepath)
+        entry_size = sum(os.path.getsize(os.path.join(self.cache_directory, x)) for x in os.listdir(self.cache_directory) if x.endswith('.npz'))
+
+        cache.max_size = entry_size * 3 // 2  # room for one entry
+        os.utime(first_filepath)  # the second entry is more recent
+        cache.load(second_filepath)
+        self.assertEqual(len([x for x in os.listdir(self.cache_directory) if x.endswith('.npz')]), 1)
+        self.assertEqual(cache.load(second_filepath).name, 'Second')
+        self.assertEqual(cache.load(first_filepath).name, 'First')
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
@@ -0,0 +1,81 @@
+# GPL License
+
+import unittest
+import sys
+import os
+import time
+import bpy
+import numpy as np
+
+from mmd_tools_local.core import pmx
+from mmd_tools_local.core.pmx.importer import PMXImporter
+
+
+def create_sdef_model(vertex_count):
+    rng = np.random.default_rng(0)
+    data = pmx.VertexData(vertex_count)
+    data.co[:] = rng.random((vertex_count, 3), dtype=np.float32) * 20
+    data.normal[:] = (0, 1, 0)
+    data.weight_type[:] = pmx.BoneWeight.BDEF1
+    data.bones[:, 0] = 0
+    data.weights[:, 0] = 1
+    sdef = np.flatnonzero(np.arange(vertex_count) % 3 > 0)
+    data.weight_type[sdef] = pmx.BoneWeight.SDEF
+    data.bones[sdef, :2] = np.where((sdef % 3 == 1)[:, None], (0, 1), (1, 0))  # every other SDEF vertex has swapped bones
+    data.weights[sdef, :2] = (0.75, 0.25)
+    data.sdef_c[sdef] = rng.random((len(sdef), 3), dtype=np.float32) * 20
+    data.sdef_r0[sdef] = rng.random((len(sdef), 3), dtype=np.float32) * 20
+    data.sdef_r1[sdef] = rng.random((len(sdef), 3), dtype=np.float32) * 20
+
+    model = pmx.Model()
+    model.name = model.name_e = 'SDEF'
+    model.setVertexData(data)
+    for name in ('Bone0', 'Bone1'):
+        bone = pmx.Bone()
+        bone.name = bone.name_e = name
+        bone.location = [0.0, 0.0, 0.0]
+        model.bones.append(bone)
+    return model
+
+
+class TestAddon(unittest.TestCase):
+    def test_sdef_shape_keys(self):
+        vertex_count = 300
+        scale = 0.08
+        model = create_sdef_model(vertex_count)
+        data = model.vertex_data
+        PMXImporter().execute(pmx=model, types={'MESH'}, scale=scale)
+
+        mesh = next(o for o in bpy.context.scene.objects if o.type == 'MESH' and o.data.shape_keys and 'mmd_sdef_c' in o.data.shape_keys.key_blocks).data
+        self.assertEqual(len(mesh.vertices), vertex_count)
+        sdef = data.weight_type == pmx.BoneWeight.SDEF
+        swapped = sdef & (data.bones[:, 0] > data.bones[:, 1])
+        self.assertTrue(swapped.any() and (sdef & ~swapped).any())
+        # vertices with swapped bones are stored with sorted bones, which swaps R0 and R1
+        r0 = np.where(swapped[:, None], data.sdef_r1, data.sdef_r0)
+        r1 = np.where(swapped[:, None], data.sdef_r0, data.sdef_r1)
+        basis = np.empty(vertex_count * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', basis)
+        basis = basis.reshape(-1, 3)
+        for name, vectors in (('mmd_sdef_c', data.sdef_c), ('mmd_sdef_r0', r0), ('mmd_sdef_r1', r1)):
+            co = np.empty(vertex_count * 3, dtype=np.float32)
+            mesh.shape_keys.key_blocks[name].data.foreach_get('co', co)
+            co = co.reshape(-1, 3)
+            np.testing.assert_allclose(co[sdef], vectors[sdef][:, [0, 2, 1]] * scale, rtol=1e-6)
+            np.testing.assert_array_equal(co[~sdef], basis[~sdef])
+
+    @unittest.skipUnless(os.environ.get('CATS_BENCHMARK_SECONDS'), 'set CATS_BENCHMARK_SECONDS to the time budget to run the benchmark')
+    def test_sdef_import_benchmark(self):
+        vertex_count = 200000
+        budget = float(os.environ['CATS_BENCHMARK_SECONDS'])
+        model = create_sdef_model(vertex_count)
+        start_time = time.perf_counter()
+        PMXImporter().execute(pmx=model, types={'MESH'})
+        elapsed = time.perf_counter() - start_time
+        self.assertLessEqual(elapsed, budget, 'Imported %d SDEF vertices in %.3f seconds' % (vertex_count, elapsed))
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
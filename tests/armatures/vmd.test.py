@@ -0,0 +1,118 @@
+# GPL License
+
+import unittest
+import sys
+import os
+import io
+import struct
+import tempfile
+
+from mmd_tools_local.core import vmd
+
+ARM = '左腕'.encode('shift_jis')
+
+# (name bytes, frame, location, rotation), the same names with garbage after the terminator are merged
+BONE_RECORDS = [
+    (b'Center', 10, (1.0, 2.0, 3.0), (0.0, 0.0, 0.0, 0.0)),
+    (ARM, 5, (0.0, 0.0, 0.0), (0.5, 0.5, 0.5, 0.5)),
+    (b'Center\x00garbage', 0, (4.0, 5.0, 6.0), (0.0, 0.0, 0.0, 1.0)),
+    (ARM + b'\x00\xff\xfe', 1, (0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 0.0)),
+    (b'Center', 20, (7.0, 8.0, 9.0), (0.0, 1.0, 0.0, 0.0)),
+]
+# (name bytes, frame, weight), the last record is cut off
+MORPH_RECORDS = [
+    (b'Smile', 30, 1.0),
+    (b'Smile\x00\x01\x02', 0, 0.25),
+    (b'Blink', 3, 0.5),
+]
+
+
+def create_vmd():
+    f = io.BytesIO()
+    f.write(struct.pack('<30s20s', vmd.Header.VMD_SIGN, b'Model'))
+    f.write(struct.pack('<L', len(BONE_RECORDS)))
+    for i, (name, frame, location, rotation) in enumerate(BONE_RECORDS):
+        f.write(struct.pack('<15sL3f4f64b', name, frame, *location, *rotation, *range(i, i + 64)))
+    f.write(struct.pack('<L', len(MORPH_RECORDS)))
+    for name, frame, weight in MORPH_RECORDS:
+        f.write(struct.pack('<15sLf', name, frame, weight))
+    return f.getvalue()[:-3]
+
+
+class TestAddon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, data):
+        filepath = os.path.join(self.directory.name, 'motion%d.vmd' % len(os.listdir(self.directory.name)))
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        vmd_file = vmd.File()
+        vmd_file.load(filepath=filepath)
+        return vmd_file
+
+    def save(self, vmd_file):
+        filepath = os.path.join(self.directory.name, 'saved%d.vmd' % len(os.listdir(self.directory.name)))
+        vmd_file.save(filepath=filepath)
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def bone_frames(vmd_file):
+        return {name: [(k.frame_number, k.location, k.rotation, k.interp[0]) for k in keys] for name, keys in vmd_file.boneAnimation.items()}
+
+    @staticmethod
+    def morph_frames(vmd_file):
+        return {name: [(k.frame_number, k.weight) for k in keys] for name, keys in vmd_file.shapeKeyAnimation.items()}
+
+    def test_load(self):
+        vmd_file = self.load(create_vmd())
+        self.assertEqual(vmd_file.header.model_name, 'Model')
+        self.assertEqual(list(vmd_file.boneAnimation), ['Center', '左腕'])
+        self.assertEqual(self.bone_frames(vmd_file), {
+            'Center': [(0, [4.0, 5.0, 6.0], [0.0, 0.0, 0.0, 1.0], 2), (10, [1.0, 2.0, 3.0], [0.0, 0.0, 0.0, 1.0], 0), (20, [7.0, 8.0, 9.0], [0.0, 1.0, 0.0, 0.0], 4)],
+            '左腕': [(1, [0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0], 3), (5, [0.0, 0.0, 0.0], [0.5, 0.5, 0.5, 0.5], 1)],
+        })
+        # the truncated record is dropped, the complete ones are kept
+        self.assertEqual(self.morph_frames(vmd_file), {'Smile': [(0, 0.25), (30, 1.0)]})
+        self.assertEqual(len(vmd_file.cameraAnimation), 0)
+
+    def test_truncated_records(self):
+        data = create_vmd()
+        fin = io.BytesIO(data)
+        fin.seek(30 + 20)
+        vmd.BoneAnimation().load(fin)
+        animation = vmd.ShapeKeyAnimation()
+        with self.assertRaises(struct.error):
+            animation.load(fin)
+        self.assertEqual(sorted(animation), ['Smile'])
+
+    def test_round_trip(self):
+        vmd_file = self.load(create_vmd())
+        saved = self.save(vmd_file)
+        self.assertNotIn(b'garbage', saved)
+        reloaded = self.load(saved)
+        self.assertEqual(self.bone_frames(reloaded), self.bone_frames(vmd_file))
+        self.assertEqual(self.morph_frames(reloaded), self.morph_frames(vmd_file))
+        self.assertEqual(self.save(reloaded), saved)
+
+    def test_round_trip_modified(self):
+        vmd_file = self.load(create_vmd())
+        key = vmd.ShapeKeyFrameKey()
+        key.frame_number, key.weight = 40, 0.75
+        vmd_file.shapeKeyAnimation['Smile'].append(key)  # written from the key objects
+        self.assertIsNone(vmd_file.shapeKeyAnimation.frameData('Smile'))
+        saved = self.save(vmd_file)
+        reloaded = self.load(saved)
+        self.assertEqual(self.morph_frames(reloaded), {'Smile': [(0, 0.25), (30, 1.0), (40, 0.75)]})
+        self.assertEqual(self.bone_frames(reloaded), self.bone_frames(vmd_file))
+        self.assertEqual(self.save(reloaded), saved)
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
@@ -90,7 +90,7 @@ pipe_to_std = options.pipe_to_std
 scripts = 0
 exit_code = 0
 error_code = 0
-scripts_only_executed_once = ['atlas.test.py', 'syntax.test.py']
+scripts_only_executed_once = ['atlas.test.py', 'syntax.test.py', 'sdef.test.py', 'pmx.test.py', 'pmx_cache.test.py', 'vmd.test.py']
 scripts_executed = []
 
 
@@ -1,6 +1,7 @@
 # GPL License
 
 import os
+import sys
 import bpy
 import json
 import copy
@@ -17,11 +18,26 @@ from ..tools.register import register_wrap
 from ..extern_tools.google_trans_new.google_trans_new import google_translator
 from . import translate as Translate
 from .translations import t
+from mmd_tools_local.core.pmx import cache as pmx_cache
 
 main_dir = pathlib.Path(os.path.dirname(__file__)).parent.resolve()
 resources_dir = os.path.join(str(main_dir), "resources")
 settings_file = os.path.join(resources_dir, "settings.json")
 
+
+def get_user_cache_dir():
+    # The add-on directory may be read-only (e.g. a system-wide install), so caches go to the cache directory of the user
+    if sys.platform == 'win32':
+        cache_dir = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    elif sys.platform == 'darwin':
+        cache_dir = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'cats_blender_plugin')
+
+
+pmx_cache_dir = os.path.join(get_user_cache_dir(), "pmx_cache")
+
 settings_data = None
 settings_data_unchanged = None
 settings_threads = []
@@ -31,6 +47,8 @@ settings_default = OrderedDict()
 settings_default['show_mmd_tabs'] = [True, False]
 settings_default['embed_textures'] = [False, False]
 settings_default['ui_lang'] = ["auto", False]
+settings_default['use_pmx_cache'] = [True, False]
+settings_default['pmx_cache_size'] = [1024, False]
 # settings_default['use_custom_mmd_tools'] = [False, True]
 
 lock_settings = False
@@ -149,6 +167,7 @@ def load_settings():
 
     # Save the settings into the unchanged settings in order to know if the settings changed later
     settings_data_unchanged = copy.deepcopy(settings_data)
+    update_pmx_cache()
 
 
 def save_settings():
@@ -179,6 +198,7 @@ def reset_settings(full_reset=False, to_reset_settings=None):
     save_settings()
 
     settings_data_unchanged = copy.deepcopy(settings_data)
+    update_pmx_cache()
     print('SETTINGS RESET')
 
 
@@ -254,10 +274,19 @@ def update_settings_core(self, context):
 
     if settings_changed_tmp:
         save_settings()
+        update_pmx_cache()
 
     return settings_changed_tmp
 
 
+def update_pmx_cache():
+    # The pmx cache stores parsed models, so importing the same model again skips parsing the file
+    if get_use_pmx_cache():
+        pmx_cache.configure(pmx_cache_dir, get_pmx_cache_size() * 1024 * 1024)
+    else:
+        pmx_cache.configure(None, 0)
+
+
 def set_last_supporter_update(last_supporter_update):
     settings_data['last_supporter_update'] = last_supporter_update
     save_settings()
@@ -277,3 +306,11 @@ def get_embed_textures():
 
 def get_ui_lang():
     return settings_data.get('ui_lang')
+
+
+def get_use_pmx_cache():
+    return settings_data.get('use_pmx_cache')
+
+
+def get_pmx_cache_size():
+    return settings_data.get('pmx_cache_size')
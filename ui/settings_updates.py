@@ -32,6 +32,11 @@ class UpdaterPanel(ToolPanel, bpy.types.Panel):
         row.prop(context.scene, 'show_avatar_2_tabs')
         row = col.row(align=True)
         row.prop(context.scene, 'embed_textures')
+        row = col.row(align=True)
+        row.prop(context.scene, 'use_pmx_cache')
+        row = col.row(align=True)
+        row.active = context.scene.use_pmx_cache
+        row.prop(context.scene, 'pmx_cache_size')
 
         col.separator()
 